@@ -3,13 +3,14 @@
 #  See file LICENSE for full license details
 import logging
 import getpass
+import sys
 
 from lib.check_helper import quickxorhash
 from lib.shell_helper import OneDriveShell, LsFormatter, MsFolderFormatter, MsNoFolderFormatter
 from lib.msobject_info import ObjectInfoFactory as OIF
 from lib.bulk_helper import bulk_folder_download, bulk_folder_upload
 from beartype import beartype
-from lib.graph_helper import MsGraphClient
+from lib.graph_helper import MsGraphClient, MsGraphHashMismatchException
 from lib._typing import Optional
 import os
 
@@ -56,23 +57,46 @@ def action_upload(
         mgc: MsGraphClient,
         remote_folder: str,
         src_file: str,
-        with_progress_bar: bool):
+        with_progress_bar: bool,
+        nb_parallel_fragments: int = 1):
   # Upload a file
-  mgc.put_file_content_from_fullpath_of_dstfolder(
-      remote_folder,
-      src_file,
-      with_progress_bar=with_progress_bar
-  )
+  mgc.set_upload_parallelism(nb_parallel_fragments)
+  try:
+    if src_file == '-':
+      # Upload standard input. 'remote_folder' is the remote file path
+      mgc.put_stream_content_from_fullpath(
+          remote_folder,
+          sys.stdin.buffer,
+          with_progress_bar=with_progress_bar)
+      return
+    mgc.put_file_content_from_fullpath_of_dstfolder(
+        remote_folder,
+        src_file,
+        with_progress_bar=with_progress_bar
+    )
+  except MsGraphHashMismatchException as e:
+    print(
+        f"Uploaded content of '{src_file}' differs from local content -"
+        f" local quickxorhash '{e.local_qxh}' - remote quickxorhash"
+        f" '{e.remote_qxh}'",
+        file=sys.stderr)
 
 
 @beartype
 def action_mupload(
         mgc: MsGraphClient,
         src_local_path: str,
-        dst_remote_folder: str):
+        dst_remote_folder: str,
+        nb_parallel_fragments: int = 1,
+        nb_jobs: int = 1,
+        compare: str = 'hash'):
   lg.debug(
       f"action_mupload - folder = '{src_local_path}' to '{dst_remote_folder}'")
-  bulk_folder_upload(mgc, src_local_path, dst_remote_folder)
+  mgc.set_upload_parallelism(nb_parallel_fragments)
+  mgc.set_file_concurrency(nb_jobs)
+  bulk_folder_upload(
+      mgc, src_local_path, dst_remote_folder, nb_jobs=nb_jobs,
+      compare=compare)
 
 
 @beartype
@@ -88,7 +112,21 @@ def action_raw_cmd(mgc: MsGraphClient):
 
 
 @beartype
-def action_download(mgc: MsGraphClient, remote_file: str, dst_local_path: str):
+def action_download(
+        mgc: MsGraphClient,
+        remote_file: str,
+        dst_local_path: str,
+        nb_connections: int = 1,
+        parallel_threshold: int = 100):
+  mgc.set_download_parallelism(nb_connections, parallel_threshold * 1048576)
+  if dst_local_path == '-':
+    # Download to standard output
+    file_id = mgc.get_id_from_path(remote_file)
+    if file_id is None:
+      print(f"'{remote_file}' not found", file=sys.stderr)
+      return
+    mgc.download_file_content_to_stream(file_id, sys.stdout.buffer)
+    return
   r = mgc.download_file_content_from_path(
       remote_file,
       dst_local_path
@@ -102,9 +140,15 @@ def action_mdownload(
         dest_path: str,
         max_depth: int,
         skip_warning: bool,
-        file_with_exclusion: Optional[str] = None):
+        file_with_exclusion: Optional[str] = None,
+        nb_connections: int = 1,
+        parallel_threshold: int = 100,
+        nb_jobs: int = 1,
+        compare: str = 'hash'):
   lg.debug(
       f"action_mdownload - folder = '{folder_path}' - depth = '{max_depth}'")
+  mgc.set_download_parallelism(nb_connections, parallel_threshold * 1048576)
+  mgc.set_file_concurrency(nb_jobs)
   if file_with_exclusion is None:
     files_to_be_excluded = set()
   else:
@@ -112,7 +156,9 @@ def action_mdownload(
                                for l in open(file_with_exclusion).readlines())
   bulk_folder_download(mgc, folder_path, dest_path,
                        max_depth, skip_warning,
-                       files_to_be_excluded=files_to_be_excluded)
+                       files_to_be_excluded=files_to_be_excluded,
+                       nb_jobs=nb_jobs,
+                       compare=compare)
 
 
 @beartype
@@ -6,6 +6,64 @@
 import argparse
 import sys
 from lib._common import get_versionned_name
+from lib.rate_limit_helper import parse_rate
+
+
+def add_download_parallelism_args(parser):
+  parser.add_argument(
+      '--connections',
+      type=int,
+      default=1,
+      help='number of concurrent connections used to download a large file. Default 1')
+  parser.add_argument(
+      '--parallelthreshold',
+      type=int,
+      default=100,
+      help='minimum size in MB of a file to be downloaded through concurrent connections. Default 100')
+
+
+def add_upload_parallelism_args(parser):
+  parser.add_argument(
+      '--parallelfragments',
+      type=int,
+      default=1,
+      help='number of fragments of a large file uploaded concurrently. Default 1')
+
+
+def add_bandwidth_args(parser):
+  parser.add_argument(
+      '--limit-rate',
+      dest='limit_rate',
+      type=parse_rate,
+      default=None,
+      help='maximum bandwidth shared by all transfers in bytes per second.'
+           ' Suffixes K, M and G are accepted (ie. 500K). Default unlimited')
+  parser.add_argument(
+      '--limit-rate-schedule',
+      dest='limit_rate_schedule',
+      type=str,
+      default=None,
+      help="file of time-of-day rates with lines 'HH:MM RATE'. It overrides"
+           ' --limit-rate')
+
+
+def add_socket_buffer_args(parser):
+  parser.add_argument(
+      '--socketbuffer',
+      type=int,
+      default=None,
+      help='size in KB of send and receive buffers of connections. Default'
+           ' chosen by the system')
+
+
+def add_compare_args(parser):
+  parser.add_argument(
+      '--compare',
+      choices=('size-mtime', 'hash', 'both'),
+      default='hash',
+      help="how local and remote files are compared to skip unchanged files."
+           " 'size-mtime' does not read files. 'both' reads files whose"
+           " modification time differs. Default 'hash'")
 
 
 def parse_odc_args(default_action):
@@ -34,6 +92,12 @@ def parse_odc_args(default_action):
       type=int,
       help='log level (default = WARN)',
       default=2)
+  parser.add_argument(
+      '--metadatacache',
+      help='keep the remote tree in a local cache synchronized at startup'
+           ' (ls, stat, mget, mput and shell)',
+      action="store_true",
+      default=False)
   parser.set_defaults(command="")
   sub_parsers = parser.add_subparsers(dest='cmd')
 
@@ -47,8 +111,15 @@ def parse_odc_args(default_action):
       help='add a progress bar',
       action="store_true",
       default=False)
-  parser_upload.add_argument('srcfile', type=str, help='source file')
-  parser_upload.add_argument('dstpath', type=str, help='destination path')
+  parser_upload.add_argument(
+      'srcfile', type=str, help="source file. '-' reads standard input")
+  parser_upload.add_argument(
+      'dstpath',
+      type=str,
+      help="destination path. Remote file path if source file is '-'")
+  add_upload_parallelism_args(parser_upload)
+  add_bandwidth_args(parser_upload)
+  add_socket_buffer_args(parser_upload)
   parser_upload.set_defaults(command="put")
 
   parser_mupload = sub_parsers.add_parser(
@@ -61,6 +132,16 @@ def parse_odc_args(default_action):
       'dstremotefolder',
       type=str,
       help='destination remote folder')
+  parser_mupload.add_argument(
+      '--jobs',
+      '-j',
+      type=int,
+      default=1,
+      help='number of files uploaded concurrently. Default 1')
+  add_upload_parallelism_args(parser_mupload)
+  add_bandwidth_args(parser_mupload)
+  add_socket_buffer_args(parser_mupload)
+  add_compare_args(parser_mupload)
   parser_mupload.set_defaults(command="mput")
 
   parser_get_user = sub_parsers.add_parser('whoami', help='get user')
@@ -98,7 +179,11 @@ def parse_odc_args(default_action):
   parser_download.add_argument(
       'dstlocalpath',
       type=str,
-      help='destination path where file will be downloaded')
+      help="destination path where file will be downloaded. '-' writes to"
+           " standard output")
+  add_download_parallelism_args(parser_download)
+  add_bandwidth_args(parser_download)
+  add_socket_buffer_args(parser_download)
   parser_download.set_defaults(command="get")
 
   parser_mdownload = sub_parsers.add_parser(
@@ -128,6 +213,16 @@ def parse_odc_args(default_action):
       action="store_true",
       default=False,
       help='skip warning if no-file-or-folder object are found (as Notebook)')
+  parser_mdownload.add_argument(
+      '--jobs',
+      '-j',
+      type=int,
+      default=1,
+      help='number of files downloaded concurrently. Default 1')
+  add_download_parallelism_args(parser_mdownload)
+  add_bandwidth_args(parser_mdownload)
+  add_socket_buffer_args(parser_mdownload)
+  add_compare_args(parser_mdownload)
   parser_mdownload.set_defaults(command="mget")
 
   parser_get_info = sub_parsers.add_parser(
@@ -9,7 +9,9 @@ import os
 import time
 import json
 import msal
+import tempfile
 import urllib.parse
+from threading import RLock
 
 lg = logging.getLogger('odc.auth')
 
@@ -44,6 +46,9 @@ class TokenRecorder:
     self.filename = filename
     self.token = None
     self.__cache = None
+    # The session is shared by threads. Its token is refreshed and stored
+    # by one thread at a time.
+    self.__lock = RLock()
 
   def get_token_interactivaly(self, prefix_url, prompt_url_callback):
     # Initialize the OAuth client
@@ -76,16 +81,34 @@ class TokenRecorder:
     return "access_token" in result
 
   def store_token(self):
-    if self.__cache is not None and self.__cache.has_state_changed:
-      lg.debug(f"[store_token]Store in file {self.filename}")
-      open(self.filename, 'w').write(self.__cache.serialize())
-    else:
-      lg.error("[store_token]No need to store token")
+    with self.__lock:
+      if self.__cache is not None and self.__cache.has_state_changed:
+        lg.debug(f"[store_token]Store in file {self.filename}")
+        self.__write_atomically(self.__cache.serialize())
+      else:
+        lg.error("[store_token]No need to store token")
+
+  def __write_atomically(self, content: str):
+    """
+      Write 'content' in a temporary file which replaces the token file so
+      that the token file is never read partially written
+    """
+    (fd, tmp_filename) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(self.filename)),
+        prefix=f"{os.path.basename(self.filename)}.")
+    try:
+      with os.fdopen(fd, 'w') as f:
+        f.write(content)
+      os.replace(tmp_filename, self.filename)
+    except BaseException:
+      os.remove(tmp_filename)
+      raise
 
   def __refresh_token(self, token):
     lg.debug("Refresh token")
-    self.init_token_from_file()
-    self.store_token()
+    with self.__lock:
+      self.init_token_from_file()
+      self.store_token()
 
   def token_exists(self):
     return self.token is not None
@@ -0,0 +1,170 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import logging
+
+lg = logging.getLogger('odc.batch')
+
+
+class MsGraphBatch:
+  """
+    Requests sent to msgraph through JSON batching.
+
+    Requests are added with add() and sent by execute() in '/$batch' calls
+    of up to MAX_REQUESTS requests. Each response is returned with the id
+    of its request.
+    A request may depend on previous requests ('depends_on'). It is then
+    executed once they have succeeded.
+    Throttled requests are sent again in a next call.
+    https://learn.microsoft.com/en-us/graph/json-batching
+  """
+
+  MAX_REQUESTS = 20
+
+  class Response:
+    """
+      Response of one request of a batch. Same interface as the subset of
+      requests.Response used in this program.
+    """
+
+    def __init__(self, status_code: int, headers: dict, body):
+      self.status_code = status_code
+      self.headers = headers if headers is not None else {}
+      self.body = body
+
+    @property
+    def ok(self):
+      return self.status_code < 400
+
+    @property
+    def reason(self):
+      if isinstance(self.body, dict) and 'error' in self.body:
+        return self.body['error'].get('message', '')
+      return ''
+
+    def json(self):
+      return self.body
+
+  def __init__(self, mgc, max_retry: int = 5):
+    """
+      'mgc' is the MsGraphClient through which batches are sent
+    """
+    self.mgc = mgc
+    self.max_retry = max_retry
+    self.__requests = []  # requests in order of addition
+
+  def __len__(self):
+    return len(self.__requests)
+
+  def add(
+          self,
+          method: str,
+          url: str,
+          body=None,
+          headers: dict = None,
+          depends_on: list = None) -> str:
+    """
+      Add a request and return its id.
+      'url' is relative to graph_url (ie. '/me/drive/items/{id}').
+      'depends_on' is a list of ids of requests previously added.
+    """
+    request_id = str(len(self.__requests) + 1)
+    request = {'id': request_id, 'method': method, 'url': url}
+    if body is not None:
+      request['body'] = body
+      request['headers'] = {'Content-Type': 'application/json'}
+    if headers is not None:
+      request.setdefault('headers', {}).update(headers)
+    if depends_on is not None and len(depends_on) > 0:
+      request['dependsOn'] = list(depends_on)
+    self.__requests.append(request)
+    return request_id
+
+  def execute(self) -> dict:
+    """
+      Send all requests and return a dictionary id -> Response.
+      Requests are removed from the batch.
+    """
+    pending = self.__requests
+    self.__requests = []
+    responses = {}
+    nb_retry = 0
+    while len(pending) > 0:
+      chunk = []
+      while len(pending) > 0 and len(chunk) < MsGraphBatch.MAX_REQUESTS:
+        request = pending.pop(0)
+        failed_dependencies = [
+            i for i in request.get('dependsOn', [])
+            if i in responses and not responses[i].ok]
+        if len(failed_dependencies) > 0:
+          # 424 = Failed Dependency. Same as msgraph
+          responses[request['id']] = MsGraphBatch.Response(424, {}, None)
+        else:
+          chunk.append(request)
+      if len(chunk) == 0:
+        break
+
+      to_be_retried = self.__send(chunk, responses, nb_retry)
+      if len(to_be_retried) > 0:
+        nb_retry += 1
+        pending = to_be_retried + pending
+
+    return responses
+
+  def __send(self, chunk: list, responses: dict, nb_retry: int) -> list:
+    """
+      Send one '/$batch' call. Fill 'responses' and return the list of
+      requests of 'chunk' to be sent again.
+    """
+    ids_in_chunk = set(request['id'] for request in chunk)
+    payload = []
+    for request in chunk:
+      request = dict(request)
+      # Dependencies sent by previous calls have already succeeded
+      depends_on = [
+          i for i in request.pop('dependsOn', []) if i in ids_in_chunk]
+      if len(depends_on) > 0:
+        request['dependsOn'] = depends_on
+      payload.append(request)
+
+    r = self.mgc.request(
+        "POST",
+        f"{self.mgc.graph_url}/$batch",
+        headers={'Content-Type': 'application/json'},
+        json={'requests': payload})
+    if r.status_code != 200:
+      lg.error(
+          f"[MsGraphBatch]Error during batch of {len(chunk)} requests -"
+          f" {r.reason} (error {r.status_code})")
+      for request in chunk:
+        responses[request['id']] = MsGraphBatch.Response(
+            r.status_code, {}, None)
+      return []
+
+    item_responses = {
+        item['id']: MsGraphBatch.Response(
+            item.get('status', 500), item.get('headers'), item.get('body'))
+        for item in r.json().get('responses', [])}
+
+    ids_to_be_retried = set()
+    for request in chunk:
+      response = item_responses.get(request['id'])
+      if response is None:
+        response = MsGraphBatch.Response(500, {}, None)
+      retry_after = self.mgc.throttle.notify(
+          response.status_code, response.headers)
+      if retry_after is not None and nb_retry < self.max_retry:
+        ids_to_be_retried.add(request['id'])
+      elif (response.status_code == 424
+            and any(i in ids_to_be_retried
+                    for i in request.get('dependsOn', []))):
+        # Dependency is throttled. Send the request again with it
+        ids_to_be_retried.add(request['id'])
+      else:
+        responses[request['id']] = response
+
+    if len(ids_to_be_retried) > 0:
+      lg.warning(
+          f"[MsGraphBatch]{len(ids_to_be_retried)} throttled requests"
+          f" - Retry nb = {nb_retry + 1}")
+    return [request for request in chunk if request['id'] in ids_to_be_retried]
@@ -3,9 +3,16 @@
 #  See file LICENSE for full license details
 import logging
 
+import functools
 import os
+import queue
 import sys
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+from threading import Lock
 from lib.check_helper import quickxorhash
+from lib.datetime_helper import str_ms_datetime_from_timestamp
+from lib.hash_record_helper import get_recorded_quickxorhash, record_quickxorhash
 from beartype import beartype
 from lib.graph_helper import MsGraphClient
 from lib.msobject_info import (
@@ -20,6 +27,191 @@ except Exception:
 lg = logging.getLogger('odc.bulk')
 qxh = quickxorhash()
 
+# Strategies to compare a local file with a remote file:
+#  - 'size-mtime': same size and same modification time
+#  - 'hash': same size and same quickxorhash
+#  - 'both': same size and same modification time, else same quickxorhash
+COMPARE_STRATEGIES = ('size-mtime', 'hash', 'both')
+# Remote modification times are truncated to the second
+MTIME_TOLERANCE = 1  # seconds
+
+
+class HashingStage:
+  """
+    Comparisons of local files with remote files run ahead of transfers.
+
+    Comparisons which need the hash of the local file are sent by batches
+    to the pool of processes of quickxorhash (a batch is hashed by one run
+    of the quickxorhash command if it is used). Each item is put in a ready
+    queue as soon as it is decided, so that transfer workers start with
+    files which do not need to be hashed while other files are still
+    hashed.
+
+    A file whose hash cannot be computed (ie. the pool of processes is
+    broken) needs to be transferred.
+
+    Usage:
+      stage = HashingStage()
+      for item in items:
+        stage.submit(item, local_file_name, ms_fileinfo)
+      for (item, needs_transfer) in stage.results():
+        ...
+  """
+
+  # Seconds between two checks of the hashes still expected by results()
+  POLL_INTERVAL = 5
+  # Hashes still expected after this delay (seconds) without any hash
+  # received are given up
+  STALL_TIMEOUT = 600
+
+  def __init__(self, compare: str = 'hash'):
+    self.compare = compare
+    self.__ready = queue.Queue()
+    self.__nb_submitted = 0
+    self.__to_be_hashed = []  # (item, local file name, ms_fileinfo)
+    self.__lock = Lock()
+    # id(future) -> (item, local file name, future) of files being hashed
+    self.__pending = {}
+
+  def submit(
+          self,
+          item,
+          local_file_name: str,
+          ms_fileinfo: Optional[MsFileInfo]):
+    """
+      Compare 'local_file_name' with 'ms_fileinfo' (None if there is no
+      remote file). 'item' is returned by results() with the comparison.
+    """
+    self.__nb_submitted += 1
+    result = (
+        compare_without_hash(local_file_name, ms_fileinfo, self.compare)
+        if ms_fileinfo is not None else True)
+    if result is not None:
+      self.__ready.put((item, result))
+      return
+    self.__to_be_hashed.append((item, local_file_name, ms_fileinfo))
+    if len(self.__to_be_hashed) >= quickxorhash.BATCH_SIZE:
+      self.__flush()
+
+  def __flush(self):
+    """ Send files to be hashed to the pool of processes """
+    to_be_hashed = self.__to_be_hashed
+    self.__to_be_hashed = []
+    if len(to_be_hashed) == 0:
+      return
+    try:
+      futures = qxh.submit_files([f for (_, f, _) in to_be_hashed])
+    except Exception as e:
+      lg.warning(f"[HashingStage]Unable to hash files - {e}")
+      for (item, _, _) in to_be_hashed:
+        self.__ready.put((item, True))
+      return
+    for (item, local_file_name, ms_fileinfo) in to_be_hashed:
+      future = futures[local_file_name]
+      with self.__lock:
+        self.__pending[id(future)] = (item, local_file_name, future)
+      future.add_done_callback(
+          functools.partial(self.__hashed, item, local_file_name, ms_fileinfo))
+
+  def __hashed(self, item, local_file_name, ms_fileinfo, future):
+    with self.__lock:
+      if self.__pending.pop(id(future), None) is None:
+        # Already given up by results()
+        return
+    try:
+      hash_qxh = future.result()
+      record_quickxorhash(local_file_name, hash_qxh)
+      lg.debug(
+          f"[HashingStage]'{local_file_name}'"
+          f" - '{hash_qxh}' vs '{ms_fileinfo.qxh}'")
+      result = hash_qxh != ms_fileinfo.qxh
+    except Exception as e:
+      lg.warning(f"[HashingStage]Unable to hash '{local_file_name}' - {e}")
+      result = True
+    self.__ready.put((item, result))
+
+  def results(self):
+    """
+      Yield tuples (item, True if the file needs to be transferred) of all
+      submitted items, in the order of their decision
+    """
+    self.__flush()
+    for _ in range(self.__nb_submitted):
+      yield self.__next_result()
+    self.__nb_submitted = 0
+
+  def __next_result(self):
+    """
+      Wait for the next decision. Hashes which have failed without calling
+      back (ie. broken pool) or which are stalled are given up.
+    """
+    last_progress = time.monotonic()
+    while True:
+      try:
+        return self.__ready.get(timeout=HashingStage.POLL_INTERVAL)
+      except queue.Empty:
+        pass
+      stalled = (
+          time.monotonic() - last_progress >= HashingStage.STALL_TIMEOUT)
+      with self.__lock:
+        pending = list(self.__pending.values())
+      for (item, local_file_name, future) in pending:
+        try:
+          e = future.exception(timeout=0)
+          if e is None:
+            continue
+        except TimeoutError:
+          if not stalled:
+            continue
+          e = f"no hash after {HashingStage.STALL_TIMEOUT} seconds"
+        except CancelledError:
+          e = "hash cancelled"
+        with self.__lock:
+          if self.__pending.pop(id(future), None) is None:
+            continue
+        lg.error(f"[HashingStage]Unable to hash '{local_file_name}' - {e}")
+        self.__ready.put((item, True))
+      if stalled:
+        last_progress = time.monotonic()
+
+
+class ThreadSafeProgress:
+  """
+    Progress bar shared by concurrent transfers.
+    It is updated with the number of processed bytes.
+  """
+
+  def __init__(self, desc: str, total: int):
+    self.__lock = Lock()
+    self.nb_files_done = 0
+    if tqdm is not None:
+      self.__tqdm = tqdm(
+          desc=desc,
+          total=total,
+          unit="B",
+          unit_scale=True,
+          unit_divisor=1024,
+          colour="green",
+          position=0,
+          leave=True)
+    else:
+      self.__tqdm = None
+
+  def update(self, nb_bytes: int):
+    with self.__lock:
+      if self.__tqdm is not None:
+        self.__tqdm.update(nb_bytes)
+
+  def file_done(self):
+    with self.__lock:
+      self.nb_files_done += 1
+      if self.__tqdm is not None:
+        self.__tqdm.set_postfix(files=self.nb_files_done, refresh=False)
+
+  def close(self):
+    if self.__tqdm is not None:
+      self.__tqdm.close()
+
 
 @beartype
 def bulk_folder_download(
@@ -28,10 +220,13 @@ def bulk_folder_download(
         dest_path: str,
         max_depth: int,
         skip_warning: bool = False,
-        files_to_be_excluded: Optional[set] = None):  # str[]
+        files_to_be_excluded: Optional[set] = None,  # str[]
+        nb_jobs: int = 1,
+        compare: str = 'hash'):
   lg.debug(
       f"bulk_folder_download - folder = '{folder_path}'"
-      f" - dest_path = {dest_path} - depth = '{max_depth}'")
+      f" - dest_path = {dest_path} - depth = '{max_depth}'"
+      f" - nb_jobs = {nb_jobs} - compare = {compare}")
   if files_to_be_excluded is None:
     files_to_be_excluded = set()
 
@@ -44,18 +239,32 @@ def bulk_folder_download(
           f"[bulk_folder_download]'{dest_path}' is a file")
       return False
 
-    remote_object.retrieve_children_info(
-            recursive=True, depth=max_depth,
-            max_retrieved_children=99999)
-    non_downloadable_files = mdownload_folder(
-        mgc, remote_object, dest_path, depth=max_depth,
-        files_to_be_excluded=files_to_be_excluded)
+    if not remote_object.retrieve_tree_from_delta(depth=max_depth):
+      remote_object.retrieve_children_info_concurrently(
+          depth=max_depth, max_retrieved_children=99999)
+    failed_files = []
+    if nb_jobs > 1:
+      non_downloadable_files = mdownload_folder_concurrently(
+          mgc, remote_object, dest_path, nb_jobs, depth=max_depth,
+          files_to_be_excluded=files_to_be_excluded,
+          failed_files=failed_files, compare=compare)
+    else:
+      non_downloadable_files = mdownload_folder(
+          mgc, remote_object, dest_path, depth=max_depth,
+          files_to_be_excluded=files_to_be_excluded,
+          failed_files=failed_files, compare=compare)
     if len(non_downloadable_files) > 0 and not skip_warning:
       print(
           "WARN: some non downloadable files have been found and skipped:",
           file=sys.stderr)
       for ndf in non_downloadable_files:
         print(f"  {ndf.path} ({ndf.type_other})")
+    if len(failed_files) > 0:
+      print(
+          "ERROR: some files have not been downloaded:",
+          file=sys.stderr)
+      for (ff, reason) in failed_files:
+        print(f"  {ff.path} ({reason})", file=sys.stderr)
 
   except OIF.ObjectRetrievalException:
     lg.error(
@@ -70,10 +279,16 @@ def mdownload_folder(
         dest_path: str,
         depth: int = 999,
         list_tqdm: list = [],
-        files_to_be_excluded: Optional[set] = None):  # str[]
+        files_to_be_excluded: Optional[set] = None,  # str[]
+        failed_files: Optional[list] = None,  # (file_info, reason)[]
+        compare: str = 'hash'):
   """
     Return list of file_info non downloadable
+    Files whose download has failed are appended to failed_files
+    Modification times of remote files are preserved.
   """
+  if failed_files is None:
+    failed_files = []
 
   if os.path.exists(dest_path) and not os.path.isdir(dest_path):
     lg.error(
@@ -99,6 +314,9 @@ def mdownload_folder(
 
     list_tqdm.append(n_tqdm)
 
+  # Local files are hashed in the pool of processes while files already
+  # known to be different are downloaded
+  stage = HashingStage(compare)
   for file_info in ms_folder.children_file:
     if file_info.path in files_to_be_excluded:
       lg.debug(f"[mdownload_folder] '{file_info.path}' in excluded list."
@@ -107,19 +325,26 @@ def mdownload_folder(
         for i in range(len(list_tqdm) - 1, -1, -1):
           t = list_tqdm[i]
           t.update(file_info.size)
+    else:
+      stage.submit(file_info, f"{dest_path}/{file_info.name}", file_info)
 
-    elif file_needs_download(file_info, dest_path):
+  for (file_info, needs_download) in stage.results():
+    if needs_download:
       lg.info(
           f"[mdownload_folder] download '{file_info.path}' in '{dest_path}'")
-      mgc.download_file_content_from_id_and_fullpath(
-          file_info.ms_id,
-          f"{dest_path}/{file_info.name}",
-          retry_if_throttled=True, list_tqdm=list_tqdm)
+      if mgc.download_file_content_from_id_and_fullpath(
+              file_info.ms_id,
+              f"{dest_path}/{file_info.name}",
+              retry_if_throttled=True, list_tqdm=list_tqdm,
+              preserve_mtime=True, file_info=file_info) != 1:
+        failed_files.append((file_info, "download error"))
 
     else:
       lg.debug(
           f"[mdownload_folder] no need to download '{file_info.path}'"
           f" in '{dest_path}'")
+      align_local_mtime(
+          f"{dest_path}/{file_info.name}", file_info, compare)
 
       if tqdm is not None:
         for i in range(len(list_tqdm) - 1, -1, -1):
@@ -141,7 +366,8 @@ def mdownload_folder(
       non_downloadable_files.extend(
           mdownload_folder(
               mgc, cf, f"{dest_path}/{cf.name}", depth - 1, list_tqdm,
-              files_to_be_excluded=files_to_be_excluded)
+              files_to_be_excluded=files_to_be_excluded,
+              failed_files=failed_files, compare=compare)
       )
 
       # last_tqdm.close()
@@ -156,25 +382,249 @@ def mdownload_folder(
 
 
 @beartype
-def file_needs_download(ms_fileinfo: MsFileInfo, dest_path: str):
-  local_file_name = f"{dest_path}/{ms_fileinfo.name}"
+def mdownload_folder_concurrently(
+        mgc: MsGraphClient,
+        ms_folder: MsFolderInfo,
+        dest_path: str,
+        nb_jobs: int,
+        depth: int = 999,
+        files_to_be_excluded: Optional[set] = None,  # str[]
+        failed_files: Optional[list] = None,  # (file_info, reason)[]
+        compare: str = 'hash'):
+  """
+    Download files of a folder tree with nb_jobs concurrent downloads.
+    Local folders are created first. Then files are downloaded by a
+    bounded pool of workers. Modification times of remote files are
+    preserved.
 
-  result = False
+    Return list of file_info non downloadable
+    Files whose download has failed are appended to failed_files
+  """
+  if files_to_be_excluded is None:
+    files_to_be_excluded = set()
+  if failed_files is None:
+    failed_files = []
 
+  files_to_be_checked = []  # (file_info, dest_path)
+  non_downloadable_files = []
+  progress = ThreadSafeProgress(ms_folder.name, ms_folder.size)
+
+  # Plan downloads
+  folders_to_be_planned = [(ms_folder, dest_path, depth)]
+  while len(folders_to_be_planned) > 0:
+    (current_folder, current_dest_path, current_depth) = (
+        folders_to_be_planned.pop())
+
+    if (os.path.exists(current_dest_path)
+            and not os.path.isdir(current_dest_path)):
+      lg.error(
+          f"[mdownload_folder_concurrently] {current_dest_path} exists and"
+          " is not a folder - skipping")
+      failed_files.extend(
+          (fi, "local path is not a folder")
+          for fi in current_folder.children_file)
+      continue
+    elif not os.path.exists(current_dest_path):
+      lg.info(
+          f"[mdownload_folder_concurrently] {current_dest_path} does not"
+          " exists - create it")
+      os.mkdir(current_dest_path)
+
+    for file_info in current_folder.children_file:
+      if file_info.path in files_to_be_excluded:
+        lg.debug(
+            f"[mdownload_folder_concurrently] '{file_info.path}' in excluded"
+            " list. Skipping it.")
+        progress.update(file_info.size)
+      else:
+        files_to_be_checked.append((file_info, current_dest_path))
+
+    for file_info in current_folder.children_other:
+      lg.info(
+          f"[mdownload_folder_concurrently] object {file_info.path} with type"
+          f"{file_info.type_other} is not downloadable. Skipping.")
+      non_downloadable_files.append(file_info)
+      progress.update(file_info.size)
+
+    if current_depth > 1:
+      for cf in current_folder.children_folder:
+        folders_to_be_planned.append(
+            (cf, f"{current_dest_path}/{cf.name}", current_depth - 1))
+
+  lock_failed_files = Lock()
+
+  def download_file(file_info: MsFileInfo, file_dest_path: str):
+    try:
+      if mgc.download_file_content_from_id_and_fullpath(
+              file_info.ms_id,
+              f"{file_dest_path}/{file_info.name}",
+              retry_if_throttled=True, list_tqdm=[progress],
+              with_progress_bar=False, preserve_mtime=True,
+              file_info=file_info) != 1:
+        with lock_failed_files:
+          failed_files.append((file_info, "download error"))
+    except Exception as e:
+      lg.error(
+          f"[mdownload_folder_concurrently] error while downloading"
+          f" '{file_info.path}' - {e}")
+      with lock_failed_files:
+        failed_files.append((file_info, str(e)))
+    progress.file_done()
+
+  # Local files are compared while files already known to be different
+  # are downloaded
+  stage = HashingStage(compare)
+  for (file_info, file_dest_path) in files_to_be_checked:
+    stage.submit(
+        (file_info, file_dest_path),
+        f"{file_dest_path}/{file_info.name}",
+        file_info)
+
+  with ThreadPoolExecutor(max_workers=nb_jobs) as executor:
+    for ((file_info, file_dest_path), needs_download) in stage.results():
+      if needs_download:
+        executor.submit(download_file, file_info, file_dest_path)
+      else:
+        lg.debug(
+            f"[mdownload_folder_concurrently] no need to download"
+            f" '{file_info.path}' in '{file_dest_path}'")
+        align_local_mtime(
+            f"{file_dest_path}/{file_info.name}", file_info, compare)
+        progress.update(file_info.size)
+        progress.file_done()
+
+  progress.close()
+  return non_downloadable_files
+
+
+def compare_without_hash(
+        local_file_name: str,
+        ms_fileinfo: MsFileInfo,
+        compare: str = 'hash'):
+  """
+    Return True if local file 'local_file_name' differs from remote file
+    'ms_fileinfo', False if they are the same, or None if the local file has
+    to be hashed to know it.
+    'compare' is one of COMPARE_STRATEGIES.
+  """
   # Check if local file exists
-  if not os.path.exists(local_file_name):
-    result = True
+  try:
+    st = os.stat(local_file_name)
+  except OSError:
+    return True
+
+  # No need to read a file whose size differs
+  if st.st_size != ms_fileinfo.size:
+    return True
+
+  if compare != 'hash':
+    if mtimes_match(st.st_mtime, ms_fileinfo):
+      return False
+    if compare == 'size-mtime':
+      return True
 
   # Check from quickxorhash if possible
-  if not result and ms_fileinfo.qxh is not None:
+  if ms_fileinfo.qxh is None:
+    return True
+
+  # Hash recorded by a previous run avoids reading the file
+  hash_qxh = get_recorded_quickxorhash(local_file_name)
+  if hash_qxh is not None:
+    lg.debug(
+        f"[compare_without_hash]recorded qxh for '{local_file_name}'"
+        f" - '{hash_qxh}' vs '{ms_fileinfo.qxh}'")
+    return hash_qxh != ms_fileinfo.qxh
+
+  return None
+
+
+def compare_with_hash(
+        local_file_name: str,
+        ms_fileinfo: MsFileInfo,
+        compare: str = 'hash') -> bool:
+  """
+    Return True if local file 'local_file_name' differs from remote file
+    'ms_fileinfo'. The local file is hashed if necessary.
+  """
+  result = compare_without_hash(local_file_name, ms_fileinfo, compare)
+  if result is None:
     hash_qxh = qxh.quickxorhash(local_file_name)
+    record_quickxorhash(local_file_name, hash_qxh)
     lg.debug(
-        f"[file_needs_download]qxh exists for '{ms_fileinfo.name}'"
+        f"[compare_with_hash]qxh exists for '{ms_fileinfo.name}'"
         f" - '{hash_qxh}' vs '{ms_fileinfo.qxh}'")
     result = hash_qxh != ms_fileinfo.qxh
+  return result
 
-  else:
-    result = True
+
+def mtimes_match(local_mtime: float, ms_fileinfo: MsFileInfo) -> bool:
+  """
+    Return True if modification time 'local_mtime' of a local file is the
+    one of remote file 'ms_fileinfo'
+  """
+  remote_mtime = ms_fileinfo.content_modified_datetime.timestamp()
+  return abs(local_mtime - remote_mtime) <= MTIME_TOLERANCE
+
+
+def align_local_mtime(
+        local_file_name: str,
+        ms_fileinfo: MsFileInfo,
+        compare: str = 'hash'):
+  """
+    With 'both' comparison, a local file which is the same as remote file
+    'ms_fileinfo' but whose modification time differs gets the remote
+    modification time. Next comparisons do not need its hash.
+  """
+  if compare != 'both':
+    return
+  try:
+    st = os.stat(local_file_name)
+    if mtimes_match(st.st_mtime, ms_fileinfo):
+      return
+    lg.debug(f"[align_local_mtime]Set modification time of '{local_file_name}'")
+    os.utime(
+        local_file_name,
+        (st.st_atime, ms_fileinfo.content_modified_datetime.timestamp()))
+    if ms_fileinfo.qxh is not None:
+      record_quickxorhash(local_file_name, ms_fileinfo.qxh)
+  except OSError as e:
+    lg.warning(
+        f"[align_local_mtime]Unable to set modification time of"
+        f" '{local_file_name}' - {e}")
+
+
+def align_remote_mtime(
+        mgc: MsGraphClient,
+        local_file_name: str,
+        ms_fileinfo: MsFileInfo,
+        compare: str = 'hash'):
+  """
+    With 'both' comparison, remote file 'ms_fileinfo' which is the same as
+    local file 'local_file_name' but whose modification time differs gets
+    the local modification time (see MsGraphClient.defer_file_system_info()).
+    Next comparisons do not need the hash of the local file.
+  """
+  if compare != 'both':
+    return
+  try:
+    st = os.stat(local_file_name)
+  except OSError:
+    return
+  if not mtimes_match(st.st_mtime, ms_fileinfo):
+    lg.debug(
+        f"[align_remote_mtime]Set modification time of '{ms_fileinfo.path}'")
+    mgc.defer_file_system_info(
+        ms_fileinfo.ms_id,
+        {'lastModifiedDateTime': str_ms_datetime_from_timestamp(st.st_mtime)})
+
+
+@beartype
+def file_needs_download(
+        ms_fileinfo: MsFileInfo,
+        dest_path: str,
+        compare: str = 'hash'):
+  local_file_name = f"{dest_path}/{ms_fileinfo.name}"
+  result = compare_with_hash(local_file_name, ms_fileinfo, compare)
 
   lg.debug(
       f"[file_needs_download] {local_file_name}"
@@ -187,10 +637,13 @@ def bulk_folder_upload(
         mgc: MsGraphClient,
         src_local_path: str,
         dst_remote_folder: str,
-        max_depth: int = 999):
+        max_depth: int = 999,
+        nb_jobs: int = 1,
+        compare: str = 'hash'):
   lg.debug(
       f"[bulk_folder_upload]src_local_path = '{src_local_path}'"
-      f" - dst_remote_folder = {dst_remote_folder} - depth = '{max_depth}'")
+      f" - dst_remote_folder = {dst_remote_folder} - depth = '{max_depth}'"
+      f" - nb_jobs = {nb_jobs} - compare = {compare}")
   try:
     remote_folder_info = OIF.get_object_info_from_path(
         mgc, dst_remote_folder, no_warn_if_no_parent=True)
@@ -199,13 +652,32 @@ def bulk_folder_upload(
           f"[bulk_folder_upload]{dst_remote_folder} exists but is not a folder"
           " - stop upload")
       return False
-    remote_folder_info.retrieve_children_info(recursive=True, depth=max_depth)
-    mupload_folder(mgc, remote_folder_info, src_local_path, depth=max_depth)
+    if not remote_folder_info.retrieve_tree_from_delta(depth=max_depth):
+      remote_folder_info.retrieve_children_info_concurrently(depth=max_depth)
+    failed_files = []
+    if nb_jobs > 1:
+      mupload_folder_concurrently(
+          mgc, remote_folder_info, src_local_path, nb_jobs, depth=max_depth,
+          failed_files=failed_files, compare=compare)
+    else:
+      mupload_folder(
+          mgc, remote_folder_info, src_local_path, depth=max_depth,
+          failed_files=failed_files, compare=compare)
+    if len(failed_files) > 0:
+      print(
+          "ERROR: some files have not been uploaded:",
+          file=sys.stderr)
+      for (ff, reason) in failed_files:
+        print(f"  {ff} ({reason})", file=sys.stderr)
   except OIF.ObjectRetrievalException:
     lg.error(
         f"[bulk_folder_upload]folder '{dst_remote_folder}' does not exist"
         " - Please create it first")
     return False
+  finally:
+    # Modification times of files already uploaded are not lost if the
+    # upload is interrupted
+    mgc.flush_file_system_infos()
 
 
 @beartype
@@ -213,11 +685,25 @@ def mupload_folder(
         mgc: MsGraphClient,
         ms_folder: MsFolderInfo,
         src_path: str,
-        depth: int = 999):
+        depth: int = 999,
+        failed_files: Optional[list] = None,  # (local path, reason)[]
+        compare: str = 'hash'):
+  """
+    Upload a local folder tree. Modification times of local files are
+    preserved.
+  """
   lg.debug(
       f"[mupload_folder]Starting. remote path = {ms_folder.path}"
       f" - src path = {src_path} - depth = {depth}")
-  ms_folder.retrieve_children_info(recursive=True, depth=depth)
+  if failed_files is None:
+    failed_files = []
+  # The tree is walked once by the caller (see bulk_folder_upload()). Only
+  # the children of a folder which has not been walked (ie. a new folder)
+  # are retrieved here.
+  ms_folder.retrieve_children_info_concurrently(depth=0)
+  # Local files are hashed in the pool of processes while sub folders are
+  # uploaded. Files of the folder are uploaded once it is scanned.
+  stage = HashingStage(compare)
   scan_dir = os.scandir(src_path)
   for entry in scan_dir:
 
@@ -227,10 +713,10 @@ def mupload_folder(
             f"[mupload_folder]{entry.path} is a local file but is"
             " a remote folder. Skip it")
       else:
-        if file_needs_upload(src_path, entry.name, ms_folder):
-          lg.info(f"[mupload_folder]Upload file {entry.path}")
-          mgc.put_file_content_from_fullpath_of_dstfolder(
-              ms_folder.path, f"{src_path}/{entry.name}")
+        stage.submit(
+            entry.name,
+            f"{src_path}/{entry.name}",
+            ms_folder.get_direct_child_file(entry.name))
 
     elif entry.is_dir():
 
@@ -244,8 +730,12 @@ def mupload_folder(
           lg.info(f"[mupload_folder]{entry.path} does not exist. Create it")
           sub_folder_info = ms_folder.create_empty_subfolder(entry.name)
 
-        if depth > 0:
-          mupload_folder(mgc, sub_folder_info, entry.path, depth - 1)
+        if sub_folder_info is None:
+          failed_files.append((entry.path, "remote folder not created"))
+        elif depth > 0:
+          mupload_folder(
+              mgc, sub_folder_info, entry.path, depth - 1, failed_files,
+              compare=compare)
         else:
           lg.info(
               f"[mupload_folder]maxdepth is reach for folder {entry.path}."
@@ -256,6 +746,181 @@ def mupload_folder(
 
   scan_dir.close()
 
+  for (file_name, needs_upload) in stage.results():
+    if needs_upload:
+      lg.info(f"[mupload_folder]Upload file {src_path}/{file_name}")
+      upload_file(
+          mgc, ms_folder, f"{src_path}/{file_name}", failed_files,
+          preserve_mtime=True)
+    else:
+      align_remote_mtime(
+          mgc, f"{src_path}/{file_name}",
+          ms_folder.get_direct_child_file(file_name), compare)
+
+  return True
+
+
+@beartype
+def upload_file(
+        mgc: MsGraphClient,
+        ms_folder: MsFolderInfo,
+        src_file: str,
+        failed_files: list,
+        with_progress_bar: bool = True,
+        preserve_mtime: bool = False):
+  """
+    Upload a local file in a remote folder.
+    Return True if upload is successful. Else, the file is appended to
+    failed_files and False is returned.
+  """
+  try:
+    r = mgc.put_file_content_from_id_of_dstfolder(
+        ms_folder.ms_id, src_file, with_progress_bar=with_progress_bar,
+        preserve_mtime=preserve_mtime)
+    if r is not None and r.status_code in (200, 201):
+      return True
+    reason = (
+        "no response" if r is None
+        else f"{r.reason} (error {r.status_code})")
+  except Exception as e:
+    reason = str(e)
+  lg.error(f"[upload_file]Error while uploading '{src_file}' - {reason}")
+  failed_files.append((src_file, reason))
+  return False
+
+
+@beartype
+def mupload_folder_concurrently(
+        mgc: MsGraphClient,
+        ms_folder: MsFolderInfo,
+        src_path: str,
+        nb_jobs: int,
+        depth: int = 999,
+        failed_files: Optional[list] = None,  # (local path, reason)[]
+        compare: str = 'hash'):
+  """
+    Upload a local folder tree with nb_jobs concurrent uploads.
+    Remote folders are created first, parents before children. Then files
+    of all folders are uploaded by a bounded pool of workers. Modification
+    times of local files are preserved.
+  """
+  lg.debug(
+      f"[mupload_folder_concurrently]Starting. remote path = {ms_folder.path}"
+      f" - src path = {src_path} - depth = {depth} - nb_jobs = {nb_jobs}")
+  if failed_files is None:
+    failed_files = []
+
+  files_to_be_checked = []  # (local path, file name, remote folder, size)
+  # The remote tree is walked once. Only the children of folders which have
+  # not been walked (ie. new folders) are retrieved during the scan.
+  ms_folder.retrieve_children_info_concurrently(depth=depth)
+  folders_to_be_scanned = [(ms_folder, src_path, depth)]
+  while len(folders_to_be_scanned) > 0:
+    (current_folder, current_src_path, current_depth) = (
+        folders_to_be_scanned.pop(0))
+    current_folder.retrieve_children_info_concurrently(depth=0)
+    sub_folders = []  # (local path, name)
+    with os.scandir(current_src_path) as scan_dir:
+      for entry in scan_dir:
+
+        if entry.is_file():
+          if current_folder.is_direct_child_folder(entry.name):
+            lg.warning(
+                f"[mupload_folder_concurrently]{entry.path} is a local file"
+                " but is a remote folder. Skip it")
+          else:
+            try:
+              size = entry.stat().st_size
+            except OSError as e:
+              # ie. file removed during the scan
+              lg.warning(
+                  f"[mupload_folder_concurrently]{entry.path} - {e}."
+                  " Skip it")
+              continue
+            files_to_be_checked.append(
+                (current_src_path, entry.name, current_folder, size))
+
+        elif entry.is_dir():
+          if current_folder.is_direct_child_file(entry.name):
+            lg.warning(
+                f"[mupload_folder_concurrently]{entry.path} is a local folder"
+                " but is a remote file. Skip it")
+            continue
+          sub_folders.append((entry.path, entry.name))
+
+        else:
+          lg.warning(
+              '[mupload_folder_concurrently]entry is nothing 8-/ Skip it')
+
+    # Missing remote folders are created with batched requests
+    missing_names = [
+        name for (_, name) in sub_folders
+        if current_folder.get_child_folder(name) is None]
+    for name in missing_names:
+      lg.info(
+          f"[mupload_folder_concurrently]{current_src_path}/{name} does not"
+          " exist. Create it")
+    new_folders = (
+        current_folder.create_empty_subfolders(missing_names)
+        if len(missing_names) > 0 else {})
+
+    for (sub_folder_path, name) in sub_folders:
+      sub_folder_info = (
+          new_folders[name] if name in new_folders
+          else current_folder.get_child_folder(name))
+      if sub_folder_info is None:
+        failed_files.append((sub_folder_path, "remote folder not created"))
+      elif current_depth > 0:
+        folders_to_be_scanned.append(
+            (sub_folder_info, sub_folder_path, current_depth - 1))
+      else:
+        lg.info(
+            f"[mupload_folder_concurrently]maxdepth is reach for folder"
+            f" {sub_folder_path}. Stop recursive upload")
+
+  progress = ThreadSafeProgress(
+      os.path.basename(os.path.normpath(src_path)),
+      sum(size for (_, _, _, size) in files_to_be_checked))
+  lock_failed_files = Lock()
+
+  def upload_one_file(
+          local_path: str, remote_folder: MsFolderInfo, size: int):
+    local_failed_files = []
+    try:
+      lg.info(f"[mupload_folder_concurrently]Upload file {local_path}")
+      upload_file(
+          mgc, remote_folder, local_path, local_failed_files,
+          with_progress_bar=False, preserve_mtime=True)
+    except Exception as e:
+      local_failed_files.append((local_path, str(e)))
+    if len(local_failed_files) > 0:
+      with lock_failed_files:
+        failed_files.extend(local_failed_files)
+    progress.update(size)
+    progress.file_done()
+
+  # Local files are compared while files already known to be different
+  # are uploaded
+  stage = HashingStage(compare)
+  for (file_src_path, file_name, remote_folder, size) in files_to_be_checked:
+    stage.submit(
+        (f"{file_src_path}/{file_name}", remote_folder, size),
+        f"{file_src_path}/{file_name}",
+        remote_folder.get_direct_child_file(file_name))
+
+  with ThreadPoolExecutor(max_workers=nb_jobs) as executor:
+    for ((local_path, remote_folder, size), needs_upload) in stage.results():
+      if needs_upload:
+        executor.submit(upload_one_file, local_path, remote_folder, size)
+      else:
+        align_remote_mtime(
+            mgc, local_path,
+            remote_folder.get_direct_child_file(os.path.basename(local_path)),
+            compare)
+        progress.update(size)
+        progress.file_done()
+
+  progress.close()
   return True
 
 
@@ -263,20 +928,15 @@ def mupload_folder(
 def file_needs_upload(
         src_folder_path: str,
         str_file_name: str,
-        ms_remote_folder: MsFolderInfo):
+        ms_remote_folder: MsFolderInfo,
+        compare: str = 'hash'):
   str_local_file_name = f"{src_folder_path}/{str_file_name}"
 
   if ms_remote_folder.is_direct_child_file(str_file_name):
-    hash_qxh = qxh.quickxorhash(str_local_file_name)
-    ms_fileinfo = ms_remote_folder.get_direct_child_file(str_file_name)
-
-    if ms_fileinfo.qxh is not None:
-      lg.debug(
-          f"[file_needs_upload]qxh exists for '{ms_fileinfo.name}'"
-          f" - '{hash_qxh}' vs '{ms_fileinfo.qxh}'")
-      result = ms_fileinfo.qxh != hash_qxh
-    else:
-      result = True
+    result = compare_with_hash(
+        str_local_file_name,
+        ms_remote_folder.get_direct_child_file(str_file_name),
+        compare)
   else:
     result = True
   return result
@@ -2,24 +2,440 @@
 #  This file is part of OneDrive Client Program which is released under MIT License
 #  See file LICENSE for full license details
 import base64
+import functools
+import logging
+import multiprocessing
+import re
 import subprocess
 import os
+from concurrent.futures import Future, ProcessPoolExecutor
 from shutil import which
+from threading import Lock
+from lib.file_fragment_helper import FileFragments
 
 try:
   import quickxorhash as qxh
 except ImportError:
   qxh = None
 
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+lg = logging.getLogger('odc.check')
+
+
+class QuickXorHasher:
+  """
+    Accumulator of quickXorHash.
+    https://learn.microsoft.com/en-us/onedrive/developer/code-snippets/quickxorhash
+
+    Each byte at position p is XORed in a 160-bit circular state at bit
+    (11 * p) % 160. The state is then a XOR of independent contributions:
+    data can be added in any order with update_at() as long as each byte is
+    added once.
+
+    Bytes are first folded in 160 columns (bytes at the same position
+    modulo 160 share the same bit of the state). The fold is done by NumPy
+    if it is installed, else by XOR of large integers.
+  """
+
+  WIDTH = 160
+  SHIFT = 11
+  __MASK = (1 << 160) - 1
+  __ROW_BITS = 160 * 8
+  # Rows read at once by the pure Python fold. 1024 rows stay in CPU cache
+  __PART_SIZE = 160 * 1024
+  # Bytes of a file hashed at once by hash_file(). Multiple of 160 bytes
+  FILE_BLOCK_SIZE = 160 * 409600
+
+  def __init__(self, state: int = 0, length: int = 0):
+    self.state = state
+    self.length = length
+
+  @staticmethod
+  def rotate(value: int, nb_bits: int) -> int:
+    """ Rotate 160-bit 'value' by 'nb_bits' to the left """
+    nb_bits %= QuickXorHasher.WIDTH
+    value <<= nb_bits
+    return (value & QuickXorHasher.__MASK) | (value >> QuickXorHasher.WIDTH)
+
+  @staticmethod
+  def columns(data) -> bytes:
+    """
+      Return the 160 bytes whose byte j is the XOR of all bytes of 'data'
+      at positions j modulo 160
+    """
+    view = memoryview(data)
+    if np is not None:
+      return QuickXorHasher.__numpy_columns(view)
+
+    # XOR parts of __PART_SIZE bytes as integers, then fold the rows of
+    # the result
+    x = 0
+    part_size = QuickXorHasher.__PART_SIZE
+    for start in range(0, len(view), part_size):
+      x ^= int.from_bytes(view[start:start + part_size], 'little')
+    nb_rows = -(-min(len(view), part_size) // 160)
+    # XOR the upper half of rows on the lower half until one row is left
+    while nb_rows > 1:
+      nb_low_rows = nb_rows - nb_rows // 2
+      nb_low_bits = nb_low_rows * QuickXorHasher.__ROW_BITS
+      x = (x & ((1 << nb_low_bits) - 1)) ^ (x >> nb_low_bits)
+      nb_rows = nb_low_rows
+    return x.to_bytes(160, 'little')
+
+  @staticmethod
+  def __numpy_columns(view: memoryview) -> bytes:
+    nb_full_row_bytes = len(view) - len(view) % 160
+    result = bytearray(160)
+    if nb_full_row_bytes > 0:
+      # A row of 160 bytes is 20 integers of 64 bits
+      rows = np.frombuffer(
+          view[:nb_full_row_bytes], dtype='<u8').reshape(-1, 20)
+      result[:] = np.bitwise_xor.reduce(rows, axis=0).tobytes()
+      del rows
+    for (j, b) in enumerate(view[nb_full_row_bytes:]):
+      result[j] ^= b
+    return bytes(result)
+
+  @staticmethod
+  def state_from_columns(columns: bytes, offset: int = 0) -> int:
+    """
+      Return the state of 160 column bytes whose first byte is at position
+      'offset' of the file
+    """
+    state = 0
+    for (j, b) in enumerate(columns):
+      if b != 0:
+        state ^= QuickXorHasher.rotate(
+            b, QuickXorHasher.SHIFT * (offset + j))
+    return state
+
+  @staticmethod
+  def partial_state(data, offset: int = 0) -> int:
+    """
+      Return the contribution to the state of 'data' located at position
+      'offset' of the file
+    """
+    if len(data) == 0:
+      return 0
+    return QuickXorHasher.state_from_columns(
+        QuickXorHasher.columns(data), offset)
+
+  def combine(self, partial_state: int, nb_bytes: int):
+    """ Add the partial state of 'nb_bytes' bytes """
+    self.state ^= partial_state
+    self.length += nb_bytes
+
+  def update_at(self, offset: int, data):
+    self.combine(QuickXorHasher.partial_state(data, offset), len(data))
+
+  def update(self, data):
+    """ Add 'data' after the data previously added """
+    self.update_at(self.length, data)
+
+  def digest(self) -> bytes:
+    result = bytearray(self.state.to_bytes(20, 'little'))
+    # Length is XORed in the last 8 bytes
+    for (i, b) in enumerate(self.length.to_bytes(8, 'little')):
+      result[12 + i] ^= b
+    return bytes(result)
+
+  def base64_digest(self) -> str:
+    return base64.b64encode(self.digest()).decode('utf8')
+
+  @staticmethod
+  def file_partial_state(
+          filename: str, start: int, end_exclusive: int) -> int:
+    """
+      Return the partial state of bytes [start, end_exclusive) of local
+      file 'filename'. Used by the processes hashing segments of a file.
+    """
+    hasher = QuickXorHasher()
+    if start >= end_exclusive:
+      return hasher.state
+    block_size = QuickXorHasher.FILE_BLOCK_SIZE
+    with FileFragments(filename) as source:
+      end_exclusive = min(end_exclusive, source.size)
+      for block_start in range(start, end_exclusive, block_size):
+        block_end = min(block_start + block_size, end_exclusive) - 1
+        hasher.update_at(
+            block_start, source.fragment(block_start, block_end))
+        source.release(block_start, block_end)
+    return hasher.state
+
+  @staticmethod
+  def hash_file(filename: str) -> str:
+    """ Return the base64 quickxorhash of local file 'filename' """
+    size = os.path.getsize(filename)
+    return QuickXorHasher(
+        QuickXorHasher.file_partial_state(filename, 0, size),
+        size).base64_digest()
+
+
+class QuickXorRangeHasher:
+  """
+    quickXorHash of a file of 'size' bytes whose ranges are added in any
+    order, possibly several times (ie. fragments sent again after an
+    error). Each byte is only hashed once.
+  """
+
+  def __init__(self, size: int):
+    self.size = size
+    self.__hasher = QuickXorHasher()
+    self.__covered = []  # sorted list of [start, end_exclusive]
+    self.__lock = Lock()
+
+  def __uncovered(self, start: int, end_exclusive: int) -> list:
+    """ Return ranges of [start, end_exclusive) which are not covered """
+    result = []
+    pos = start
+    for (covered_start, covered_end) in self.__covered:
+      if covered_end <= pos:
+        continue
+      if covered_start >= end_exclusive:
+        break
+      if covered_start > pos:
+        result.append((pos, covered_start))
+      pos = max(pos, covered_end)
+    if pos < end_exclusive:
+      result.append((pos, end_exclusive))
+    return result
+
+  def __cover(self, start: int, end_exclusive: int):
+    self.__covered.append([start, end_exclusive])
+    self.__covered.sort()
+    merged = []
+    for r in self.__covered:
+      if len(merged) > 0 and r[0] <= merged[-1][1]:
+        merged[-1][1] = max(merged[-1][1], r[1])
+      else:
+        merged.append(r)
+    self.__covered = merged
+
+  def add(self, start: int, data):
+    """ Add 'data' located at position 'start' of the file """
+    with self.__lock:
+      ranges = self.__uncovered(start, start + len(data))
+      for (range_start, range_end) in ranges:
+        self.__cover(range_start, range_end)
+    for (range_start, range_end) in ranges:
+      partial_state = QuickXorHasher.partial_state(
+          data[range_start - start:range_end - start], range_start)
+      with self.__lock:
+        self.__hasher.combine(partial_state, range_end - range_start)
+
+  def missing_ranges(self) -> list:
+    """ Return list of (start, end_exclusive) not added yet """
+    with self.__lock:
+      return self.__uncovered(0, self.size)
+
+  def base64_digest(self) -> str:
+    with self.__lock:
+      return self.__hasher.base64_digest()
+
 
 class quickxorhash:
+  """
+    quickxorhash of local files.
+
+    Files larger than PARALLEL_THRESHOLD are split in segments hashed by a
+    pool of processes (one per CPU). Partial states of segments are XORed.
+    Else, the 'quickxorhash' C module is used if it is installed. Else the
+    built-in implementation is used, except that a 'quickxorhash' command
+    in the PATH is preferred to the pure Python fold when NumPy is not
+    installed. The command is then run once for a batch of files by
+    quickxorhash_files() and submit_files().
+
+    submit() and submit_files() hash files in the pool of processes
+    without waiting for their hash.
+  """
 
   __COMMAND_NAME = 'quickxorhash'
+  # Files hashed by one run of the quickxorhash command
+  BATCH_SIZE = 256
+  __HASH_PATTERN = re.compile(r'[A-Za-z0-9+/]{27}=')
+
+  PARALLEL_THRESHOLD = 512 * 1048576
+  SEGMENT_SIZE = QuickXorHasher.FILE_BLOCK_SIZE * 2
 
-  def __init__(self):
+  # Pool shared by all instances. Created at first use
+  __pool = None
+  __pool_lock = Lock()
+
+  def __init__(self, nb_processes: int = None):
     self.program = which(self.__COMMAND_NAME)
+    self.nb_processes = (
+        nb_processes if nb_processes is not None else os.cpu_count() or 1)
+
+  @classmethod
+  def __get_pool(cls, nb_processes: int) -> ProcessPoolExecutor:
+    with cls.__pool_lock:
+      if cls.__pool is None:
+        # Processes are spawned rather than forked as the program may run
+        # threads (ie. concurrent transfers) holding locks
+        cls.__pool = ProcessPoolExecutor(
+            max_workers=nb_processes,
+            mp_context=multiprocessing.get_context('spawn'))
+      return cls.__pool
+
+  def __submit_segments(self, filename: str, size: int) -> list:
+    """ Return futures of the partial states of segments of 'filename' """
+    pool = self.__get_pool(self.nb_processes)
+    return [
+        pool.submit(
+            QuickXorHasher.file_partial_state,
+            filename,
+            start,
+            min(start + quickxorhash.SEGMENT_SIZE, size))
+        for start in range(0, size, quickxorhash.SEGMENT_SIZE)]
+
+  def quickxorhash_by_segments(self, filename: str) -> str:
+    """ Hash segments of 'filename' concurrently in a pool of processes """
+    size = os.path.getsize(filename)
+    state = 0
+    for future in self.__submit_segments(filename, size):
+      state ^= future.result()
+    return QuickXorHasher(state, size).base64_digest()
+
+  @staticmethod
+  def hash_in_process(filename: str) -> str:
+    """ Hash 'filename' in a process of the pool """
+    return quickxorhash(nb_processes=1).quickxorhash(filename)
+
+  def submit(self, filename: str) -> Future:
+    """
+      Hash 'filename' in the pool of processes without waiting. Return a
+      future of the hash. Files larger than PARALLEL_THRESHOLD are hashed
+      by segments.
+    """
+    size = os.path.getsize(filename)
+    if size <= quickxorhash.PARALLEL_THRESHOLD:
+      return self.__get_pool(self.nb_processes).submit(
+          quickxorhash.hash_in_process, filename)
+
+    result = Future()
+    segment_futures = self.__submit_segments(filename, size)
+    lock = Lock()
+
+    def segment_done(_):
+      with lock:
+        if result.done() or not all(f.done() for f in segment_futures):
+          return
+        try:
+          state = 0
+          for future in segment_futures:
+            state ^= future.result()
+          result.set_result(QuickXorHasher(state, size).base64_digest())
+        except Exception as e:
+          result.set_exception(e)
+
+    for future in segment_futures:
+      future.add_done_callback(segment_done)
+    return result
+
+  def uses_program(self) -> bool:
+    """ True if files are hashed by the quickxorhash command """
+    return qxh is None and np is None and self.program is not None
+
+  def __run_program(self, filenames: list) -> dict:
+    """
+      Run the quickxorhash command once for 'filenames'. Return a
+      dictionary filename -> quickxorhash, empty if the output of the
+      command does not give one hash per file.
+    """
+    # A file name starting with '-' would be taken for an option
+    args = [f"./{f}" if f.startswith('-') else f for f in filenames]
+    try:
+      p = subprocess.run(
+          [self.program] + args,
+          stdout=subprocess.PIPE,
+          stderr=subprocess.DEVNULL)
+    except OSError as e:
+      lg.warning(f"[quickxorhash]Unable to run {self.program} - {e}")
+      return {}
+    if p.returncode != 0:
+      return {}
+    hashes = []
+    for line in str(p.stdout, 'utf-8', errors='replace').splitlines():
+      if line.strip() == '':
+        continue
+      m = quickxorhash.__HASH_PATTERN.search(line)
+      if m is None:
+        return {}
+      hashes.append(m.group(0))
+    if len(hashes) != len(filenames):
+      return {}
+    return dict(zip(filenames, hashes))
+
+  def quickxorhash_files(self, filenames: list) -> dict:
+    """
+      Return a dictionary filename -> quickxorhash of 'filenames'.
+      The quickxorhash command, if used, is run once per batch of
+      BATCH_SIZE files. Files of a batch which fails are hashed one by one.
+    """
+    result = {}
+    if self.uses_program():
+      small_files = [
+          f for f in filenames
+          if os.path.getsize(f) <= quickxorhash.PARALLEL_THRESHOLD]
+      for start in range(0, len(small_files), quickxorhash.BATCH_SIZE):
+        result.update(
+            self.__run_program(
+                small_files[start:start + quickxorhash.BATCH_SIZE]))
+    for filename in filenames:
+      if filename not in result:
+        result[filename] = self.quickxorhash(filename)
+    return result
+
+  @staticmethod
+  def hash_files_in_process(filenames: list) -> dict:
+    """ Hash 'filenames' in a process of the pool """
+    return quickxorhash(nb_processes=1).quickxorhash_files(filenames)
+
+  def submit_files(self, filenames: list) -> dict:
+    """
+      Hash 'filenames' in the pool of processes without waiting. Return a
+      dictionary filename -> future of the hash.
+      With the quickxorhash command, a process hashes a batch of files.
+    """
+    if not self.uses_program():
+      return {filename: self.submit(filename) for filename in filenames}
+
+    result = {}
+    small_files = []
+    for filename in filenames:
+      if os.path.getsize(filename) > quickxorhash.PARALLEL_THRESHOLD:
+        result[filename] = self.submit(filename)
+      else:
+        small_files.append(filename)
+
+    def batch_done(batch_futures, batch_future):
+      try:
+        hashes = batch_future.result()
+      except Exception as e:
+        for future in batch_futures.values():
+          future.set_exception(e)
+        return
+      for (filename, future) in batch_futures.items():
+        future.set_result(hashes[filename])
+
+    pool = self.__get_pool(self.nb_processes)
+    for start in range(0, len(small_files), quickxorhash.BATCH_SIZE):
+      batch = small_files[start:start + quickxorhash.BATCH_SIZE]
+      batch_futures = {filename: Future() for filename in batch}
+      result.update(batch_futures)
+      pool.submit(quickxorhash.hash_files_in_process, batch).add_done_callback(
+          functools.partial(batch_done, batch_futures))
+    return result
 
   def quickxorhash(self, filename, force_process = False):
+    if (not force_process and self.nb_processes > 1
+            and os.path.getsize(filename) > quickxorhash.PARALLEL_THRESHOLD):
+      return self.quickxorhash_by_segments(filename)
+
     if qxh is not None and not force_process:
       chunksize = 1024 * 1024
       h = qxh.quickxorhash()
@@ -31,14 +447,12 @@ class quickxorhash:
               h.update(chunk)
       return base64.b64encode(h.digest()).decode('utf8')
 
-    if self.program is not None:
+    if self.program is not None and (np is None or force_process):
       p = subprocess.run([self.program, filename], stdout=subprocess.PIPE)
-      if p.returncode != 0:
-        return None
-      else:
+      if p.returncode == 0:
         return str(p.stdout, 'utf-8').rstrip('\n').rstrip('\r')
-    else:
-      return None
+
+    return QuickXorHasher.hash_file(filename)
 
 
   # How to get quickxorhash command
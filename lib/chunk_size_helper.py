@@ -0,0 +1,74 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import logging
+from threading import Lock
+
+lg = logging.getLogger('odc.chunksize')
+
+
+class ChunkSizeController:
+  """
+    Adapt the size of transferred chunks to the measured throughput.
+
+    The size is computed so that the transfer of one chunk lasts about
+    'target_duration' seconds. It grows at most twice per successful
+    chunk and is halved after each failure, so that a flaky link uses small
+    chunks which are cheap to retry.
+    The size is always a multiple of 'multiple' between 'min_size' and
+    'max_size'.
+  """
+
+  def __init__(
+          self,
+          initial_size: int,
+          min_size: int,
+          max_size: int,
+          multiple: int = 1,
+          target_duration: float = 10):
+    self.min_size = min_size
+    self.max_size = max_size
+    self.multiple = multiple
+    self.target_duration = target_duration
+    self.__alpha = 0.3
+    self.__throughput = None  # bytes per second - Exponential Moving Average
+    self.__rtt = 0            # seconds - Exponential Moving Average
+    self.__lock = Lock()
+    self.__size = self.__bounded(initial_size)
+
+  def __bounded(self, size):
+    size = max(self.min_size, min(int(size), self.max_size))
+    return max(self.min_size, size - size % self.multiple)
+
+  @property
+  def size(self) -> int:
+    with self.__lock:
+      return self.__size
+
+  def record_rtt(self, rtt: float):
+    """ Record the round-trip time of a request without payload """
+    with self.__lock:
+      self.__rtt = (
+          rtt if self.__rtt == 0
+          else rtt * self.__alpha + self.__rtt * (1 - self.__alpha))
+
+  def record_success(self, nb_bytes: int, duration: float):
+    """ Record the transfer of 'nb_bytes' in 'duration' seconds """
+    with self.__lock:
+      # Round-trip time is not part of the transfer itself
+      transfer_duration = max(duration - self.__rtt, duration / 10, 0.001)
+      throughput = nb_bytes / transfer_duration
+      self.__throughput = (
+          throughput if self.__throughput is None
+          else throughput * self.__alpha
+          + self.__throughput * (1 - self.__alpha))
+      wished_size = self.__throughput * self.target_duration
+      self.__size = self.__bounded(min(wished_size, self.__size * 2))
+      lg.debug(
+          f"[ChunkSizeController]throughput = {self.__throughput:,.0f} B/s"
+          f" - rtt = {self.__rtt:.3f}s - size = {self.__size:,}")
+
+  def record_failure(self):
+    with self.__lock:
+      self.__size = self.__bounded(self.__size // 2)
+      lg.debug(f"[ChunkSizeController]failure - size = {self.__size:,}")
@@ -0,0 +1,169 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import logging
+import socket
+import urllib.parse
+from collections import OrderedDict
+from threading import Lock
+
+from requests.adapters import HTTPAdapter
+
+lg = logging.getLogger('odc.connectionpool')
+
+
+class TunedHTTPAdapter(HTTPAdapter):
+  """
+    HTTPAdapter whose connections are kept alive by TCP keep-alive probes
+    and whose socket buffers may be sized.
+  """
+
+  KEEPALIVE_IDLE = 60       # seconds before the first probe
+  KEEPALIVE_INTERVAL = 15   # seconds between probes
+  KEEPALIVE_COUNT = 4       # failed probes before closing the connection
+
+  def __init__(
+          self,
+          pool_connections: int,
+          pool_maxsize: int,
+          socket_buffer_size: int = None):
+    self.socket_buffer_size = socket_buffer_size
+    super().__init__(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize)
+
+  def socket_options(self):
+    options = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for (name, value) in (
+            ('TCP_KEEPIDLE', TunedHTTPAdapter.KEEPALIVE_IDLE),
+            ('TCP_KEEPINTVL', TunedHTTPAdapter.KEEPALIVE_INTERVAL),
+            ('TCP_KEEPCNT', TunedHTTPAdapter.KEEPALIVE_COUNT)):
+      if hasattr(socket, name):  # Not available on all platforms
+        options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    if self.socket_buffer_size is not None:
+      options.append(
+          (socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer_size))
+      options.append(
+          (socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer_size))
+    return options
+
+  def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+    pool_kwargs['socket_options'] = self.socket_options()
+    super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+
+  def stats(self) -> dict:
+    """
+      Return a dictionary host -> (nb requests, nb new connections) of the
+      pools of this adapter
+    """
+    result = {}
+    pools = self.poolmanager.pools
+    for key in list(pools.keys()):
+      pool = pools.get(key)
+      if pool is not None:
+        host = (
+            pool.host if pool.port in (None, 80, 443)
+            else f"{pool.host}:{pool.port}")
+        (nb_requests, nb_connections) = result.get(host, (0, 0))
+        result[host] = (
+            nb_requests + pool.num_requests,
+            nb_connections + pool.num_connections)
+    return result
+
+
+class ConnectionPools:
+  """
+    Connection pools of a requests session with one pool per destination
+    host (Graph API, upload host, download CDN).
+
+    A pool is created when a host is used for the first time. Its size is
+    given by 'pool_maxsize' so that concurrent transfers do not open and
+    close connections. Other hosts (ie. redirections) use a default pool.
+  """
+
+  def __init__(self, session, pool_maxsize: int = 10):
+    self.session = session
+    self.pool_maxsize = pool_maxsize
+    self.socket_buffer_size = None
+    self.__lock = Lock()
+    self.__adapters = {}  # prefix -> TunedHTTPAdapter
+    self.__mount("https://", self.__new_adapter(4))
+
+  def __new_adapter(self, pool_connections: int = 1) -> TunedHTTPAdapter:
+    return TunedHTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=self.pool_maxsize,
+        socket_buffer_size=self.socket_buffer_size)
+
+  def __mount(self, prefix: str, adapter: TunedHTTPAdapter):
+    """
+      Same as Session.mount() but the adapters of the session are replaced
+      by a new dictionary, so that threads which are selecting an adapter
+      are not disturbed.
+    """
+    adapters = OrderedDict(self.session.adapters)
+    old_adapter = adapters.get(prefix)
+    adapters[prefix] = adapter
+    # Longest prefixes first, as Session.mount()
+    self.session.adapters = OrderedDict(
+        sorted(adapters.items(), key=lambda item: -len(item[0])))
+    self.__adapters[prefix] = adapter
+    if old_adapter is not None:
+      old_adapter.close()
+
+  @staticmethod
+  def prefix_of(url: str) -> str:
+    parsed_url = urllib.parse.urlsplit(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}/"
+
+  def ensure_pool(self, url: str):
+    """ Create the pool of the host of 'url' if it does not exist """
+    prefix = ConnectionPools.prefix_of(url)
+    if prefix in self.__adapters:
+      return
+    with self.__lock:
+      if prefix not in self.__adapters:
+        lg.debug(
+            f"[ConnectionPools]New pool for '{prefix}' - maxsize ="
+            f" {self.pool_maxsize}")
+        self.__mount(prefix, self.__new_adapter())
+
+  def configure(self, pool_maxsize: int, socket_buffer_size: int = None):
+    """
+      Resize all pools. Pools are replaced only if their configuration
+      changes.
+    """
+    with self.__lock:
+      if (pool_maxsize == self.pool_maxsize
+              and socket_buffer_size == self.socket_buffer_size):
+        return
+      lg.debug(
+          f"[ConnectionPools]Resize pools - maxsize = {pool_maxsize}"
+          f" - socket buffer size = {socket_buffer_size}")
+      self.pool_maxsize = pool_maxsize
+      self.socket_buffer_size = socket_buffer_size
+      for prefix in list(self.__adapters):
+        self.__mount(
+            prefix, self.__new_adapter(4 if prefix == "https://" else 1))
+
+  def stats(self) -> dict:
+    """
+      Return a dictionary host -> dict with keys 'requests', 'hits' (a
+      kept-alive connection is reused), 'misses' (a new connection is
+      opened) and 'maxsize'
+    """
+    result = {}
+    with self.__lock:
+      adapters = list(self.__adapters.values())
+    for adapter in adapters:
+      for (host, (nb_requests, nb_connections)) in adapter.stats().items():
+        host_stats = result.setdefault(
+            host,
+            {'requests': 0, 'hits': 0, 'misses': 0,
+             'maxsize': self.pool_maxsize})
+        host_stats['requests'] += nb_requests
+        host_stats['misses'] += nb_connections
+        host_stats['hits'] += max(0, nb_requests - nb_connections)
+    return result
@@ -11,11 +11,21 @@ def utc_dt_from_str_ms_datetime(str_ms_datetime):
   try:
     result = datetime.datetime.strptime(str_ms_datetime, "%Y-%m-%dT%H:%M:%SZ")
   except ValueError:
+    # Fraction of seconds may have more than 6 digits (ex: expirationDateTime)
+    (str_dt, str_fraction) = str_ms_datetime.rstrip("Z").split(".")
     result = datetime.datetime.strptime(
-        str_ms_datetime, "%Y-%m-%dT%H:%M:%S.%fZ")
+        f"{str_dt}.{str_fraction[:6]}Z", "%Y-%m-%dT%H:%M:%S.%fZ")
   # datetime.datetime.now().strftime()
   return pytz.utc.localize(result)
 
 
 def utc_dt_now():
   return datetime.datetime.now(pytz.utc)
+
+
+def str_ms_datetime_from_timestamp(timestamp):
+  """ string representation for ms graph of a POSIX timestamp (seconds are
+      truncated)
+  """
+  return datetime.datetime.fromtimestamp(
+      int(timestamp), pytz.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,193 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+from lib.check_helper import QuickXorHasher, quickxorhash
+from lib.hash_record_helper import record_quickxorhash
+
+lg = logging.getLogger('odc.download')
+
+
+class PartFile:
+  """
+    Local '.part' file of an ongoing download.
+
+    Downloaded ranges are recorded in a state file next to the '.part' file
+    so that an interrupted download can be resumed, even after a restart of
+    the program. The state is only reused if the remote object has not
+    changed (same id, eTag and size).
+
+    The quickxorhash of downloaded chunks is computed as they are written
+    and saved with the state. The file does not need to be read again to
+    be checked.
+  """
+
+  PART_SUFFIX = ".part"
+  STATE_SUFFIX = ".part.json"
+  SAVE_INTERVAL = 5  # seconds
+
+  def __init__(self, local_fullpath: str, ms_id: str, etag, size: int):
+    self.local_fullpath = local_fullpath
+    self.part_path = f"{local_fullpath}{PartFile.PART_SUFFIX}"
+    self.state_path = f"{local_fullpath}{PartFile.STATE_SUFFIX}"
+    self.ms_id = ms_id
+    self.etag = etag
+    self.size = size
+    self.__done = []  # sorted list of [start, end_exclusive]
+    # quickxorhash of the downloaded ranges. None if a range has been
+    # marked as done without its data
+    self.__hasher = QuickXorHasher()
+    self.__lock = Lock()
+    self.__last_save = 0
+    self.__load()
+
+  def __load(self):
+    state = None
+    if os.path.exists(self.state_path) and os.path.exists(self.part_path):
+      try:
+        with open(self.state_path, 'r') as f:
+          state = json.load(f)
+      except (OSError, ValueError) as e:
+        lg.warning(f"[PartFile]Unable to read state {self.state_path} - {e}")
+
+    if (
+            state is not None
+            and state.get('id') == self.ms_id
+            and state.get('eTag') == self.etag
+            and state.get('size') == self.size
+            and os.path.getsize(self.part_path) == self.size):
+      self.__done = [list(r) for r in state['done']]
+      if state.get('qxhState') is not None:
+        self.__hasher = QuickXorHasher(
+            int(state['qxhState'], 16), self.nb_bytes_done())
+      elif len(self.__done) > 0:
+        self.__hasher = None
+      lg.info(
+          f"[PartFile]Resume download of '{self.local_fullpath}'"
+          f" - {self.nb_bytes_done():,} bytes already downloaded")
+    else:
+      # Start from scratch with a preallocated file
+      with open(self.part_path, 'wb') as f:
+        f.truncate(self.size)
+      self.__done = []
+      self.save()
+
+  def nb_bytes_done(self):
+    with self.__lock:
+      return sum(end - start for (start, end) in self.__done)
+
+  def missing_ranges(self):
+    """
+      Return list of tuple (start, end) of ranges not downloaded yet.
+      'end' is included.
+    """
+    result = []
+    pos = 0
+    with self.__lock:
+      for (start, end) in self.__done:
+        if start > pos:
+          result.append((pos, start - 1))
+        pos = max(pos, end)
+    if pos < self.size:
+      result.append((pos, self.size - 1))
+    return result
+
+  def mark_done(self, start: int, end_exclusive: int, data=None):
+    """
+      Bytes 'start' to 'end_exclusive' are written. 'data' is used to
+      compute the quickxorhash of the file.
+    """
+    partial_state = (
+        QuickXorHasher.partial_state(data, start) if data is not None
+        else None)
+    with self.__lock:
+      if partial_state is None:
+        self.__hasher = None
+      elif self.__hasher is not None:
+        self.__hasher.combine(partial_state, end_exclusive - start)
+      self.__done.append([start, end_exclusive])
+      self.__done.sort()
+      merged = []
+      for r in self.__done:
+        if len(merged) > 0 and r[0] <= merged[-1][1]:
+          merged[-1][1] = max(merged[-1][1], r[1])
+        else:
+          merged.append(r)
+      self.__done = merged
+      must_be_saved = time.time() - self.__last_save > PartFile.SAVE_INTERVAL
+    if must_be_saved:
+      self.save()
+
+  def save(self):
+    with self.__lock:
+      state = {
+          'id': self.ms_id,
+          'eTag': self.etag,
+          'size': self.size,
+          'done': self.__done,
+          'qxhState': (
+              format(self.__hasher.state, 'x')
+              if self.__hasher is not None else None)}
+      self.__last_save = time.time()
+      tmp_path = f"{self.state_path}.tmp"
+      with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+      os.replace(tmp_path, self.state_path)
+
+  def discard(self):
+    for p in (self.part_path, self.state_path):
+      if os.path.exists(p):
+        os.remove(p)
+
+  def commit(self, expected_qxh=None, mtime=None):
+    """
+      Rename the '.part' file to its final name if its size and its
+      quickxorhash match the remote object.
+      The '.part' file is discarded if they do not match.
+      The modification time of the file is set to 'mtime' if given.
+
+      Return True if the file has been committed.
+    """
+    if len(self.missing_ranges()) > 0:
+      lg.error(f"[PartFile]'{self.local_fullpath}' is not complete")
+      return False
+
+    if os.path.getsize(self.part_path) != self.size:
+      lg.error(
+          f"[PartFile]Size of '{self.part_path}' does not match remote size"
+          f" ({os.path.getsize(self.part_path)} vs {self.size}). Discard it")
+      self.discard()
+      return False
+
+    with self.__lock:
+      local_qxh = (
+          self.__hasher.base64_digest() if self.__hasher is not None
+          else None)
+    if local_qxh is None and expected_qxh is not None:
+      lg.debug(f"[PartFile]No inline hash for '{self.part_path}'. Read it")
+      local_qxh = quickxorhash().quickxorhash(self.part_path)
+
+    if expected_qxh is not None:
+      if local_qxh is not None and local_qxh != expected_qxh:
+        lg.error(
+            f"[PartFile]quickxorhash of '{self.part_path}' does not match"
+            f" remote hash ('{local_qxh}' vs '{expected_qxh}'). Discard it")
+        self.discard()
+        return False
+
+    os.replace(self.part_path, self.local_fullpath)
+    if os.path.exists(self.state_path):
+      os.remove(self.state_path)
+    if mtime is not None:
+      os.utime(
+          self.local_fullpath,
+          (os.stat(self.local_fullpath).st_atime, mtime))
+    if local_qxh is not None:
+      # Next runs will not need to read the file to get its hash
+      record_quickxorhash(self.local_fullpath, local_qxh)
+    return True
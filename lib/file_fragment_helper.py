@@ -0,0 +1,103 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import logging
+import os
+from threading import Lock
+
+lg = logging.getLogger('odc.filefragment')
+
+
+class TruncatedFileException(Exception):
+  """
+    Raised when a file has been truncated by another process while its
+    fragments are read
+  """
+
+  def __init__(self, filename: str, size: int, expected_size: int):
+    super().__init__(
+        f"'{filename}' has been truncated during the upload - size ="
+        f" {size:,} instead of {expected_size:,}")
+    self.filename = filename
+    self.size = size
+
+
+class FileFragments:
+  """
+    Read-only access to fragments of a local file.
+
+    Each fragment is read by one system call in a buffer of its own size,
+    which is sent (or sent again after an error) without any other copy.
+    The file is not memory mapped: reading a map beyond the end of a file
+    truncated by another process kills the program (SIGBUS), whereas a
+    read only returns less bytes.
+    Pages of the file are read ahead and released from the page cache
+    once their fragment is sent if the platform supports it.
+
+    Usage:
+      with FileFragments(src_file) as source:
+        stream = source.fragment(start, end)
+  """
+
+  def __init__(self, filename: str):
+    self.filename = filename
+    self.size = 0
+    self.__file = None
+    # Without positional reads, the file position is shared by threads
+    self.__lock = Lock()
+
+  def __enter__(self):
+    self.__file = open(self.filename, 'rb', buffering=0)
+    self.size = os.fstat(self.__file.fileno()).st_size
+    self.__fadvise('POSIX_FADV_SEQUENTIAL', 0, self.size)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.__file.close()
+
+  def __fadvise(self, option_name: str, start: int, end_exclusive: int):
+    """
+      Give advice on bytes [start, end_exclusive) if the platform supports
+      it
+    """
+    option = getattr(os, option_name, None)
+    end_exclusive = min(end_exclusive, self.size)
+    if option is None or end_exclusive <= start:
+      return
+    try:
+      os.posix_fadvise(
+          self.__file.fileno(), start, end_exclusive - start, option)
+    except OSError as e:
+      lg.debug(f"[FileFragments]posix_fadvise({option_name}) failed - {e}")
+
+  def __read_into(self, buffer: memoryview, offset: int) -> int:
+    if hasattr(os, 'preadv'):
+      return os.preadv(self.__file.fileno(), [buffer], offset)
+    with self.__lock:
+      self.__file.seek(offset)
+      return self.__file.readinto(buffer)
+
+  def fragment(self, start: int, end: int) -> memoryview:
+    """
+      Return bytes 'start' to 'end' (included).
+      Raise TruncatedFileException if the file is now too short.
+    """
+    end = min(end, self.size - 1)
+    view = memoryview(bytearray(max(end - start + 1, 0)))
+    nb_read = 0
+    while nb_read < len(view):
+      n = self.__read_into(view[nb_read:], start + nb_read)
+      if n == 0:
+        raise TruncatedFileException(
+            self.filename, os.fstat(self.__file.fileno()).st_size,
+            self.size)
+      nb_read += n
+    return view
+
+  def will_need(self, start: int, end: int):
+    """ Read bytes 'start' to 'end' (included) ahead in the background """
+    self.__fadvise('POSIX_FADV_WILLNEED', start, end + 1)
+
+  def release(self, start: int, end: int):
+    """ Bytes 'start' to 'end' (included) have been sent """
+    self.__fadvise('POSIX_FADV_DONTNEED', start, end + 1)
@@ -4,12 +4,30 @@
 import logging
 
 from requests_oauthlib import OAuth2Session
+from lib.batch_helper import MsGraphBatch
+from lib.check_helper import QuickXorHasher, QuickXorRangeHasher
+from lib.chunk_size_helper import ChunkSizeController
+from lib.connection_pool_helper import ConnectionPools
+from lib.datetime_helper import str_ms_datetime_from_timestamp, utc_dt_from_str_ms_datetime
+from lib.download_helper import PartFile
+from lib.hash_record_helper import record_quickxorhash
+from lib.file_fragment_helper import FileFragments, TruncatedFileException
+from lib.rate_limit_helper import BandwidthLimiter
+from lib.retry_helper import Backoff, CircuitBreaker, CircuitOpenException
 from lib.strpathutil import StrPathUtil
+from lib.throttle_helper import ThrottleCoordinator
+from lib.upload_session_helper import UploadSessionStore
 from pathlib import PurePosixPath
 import json
 import os
 import pprint
 import time
+import queue
+import requests
+import urllib.parse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Event, Lock
 
 try:
   from tqdm import tqdm
@@ -28,6 +46,31 @@ class MsGraphException(Exception):
     return f"{self.args[0]} - raised with link '{self.src_link}'"
 
 
+class MsGraphUploadSessionException(MsGraphException):
+  """
+    Raised when an upload session no longer exists
+  """
+
+  def __init__(self, link):
+    super().__init__(link)
+    self.args = ("Upload session no longer exists",)
+
+
+class MsGraphHashMismatchException(MsGraphException):
+  """
+    Raised when the quickxorhash of an uploaded item differs from the hash
+    of the local file
+  """
+
+  def __init__(self, link, local_qxh, remote_qxh):
+    super().__init__(link)
+    self.local_qxh = local_qxh
+    self.remote_qxh = remote_qxh
+    self.args = (
+        f"quickxorhash of uploaded item '{remote_qxh}' differs from local"
+        f" quickxorhash '{local_qxh}'",)
+
+
 class MsGraphClient:
 
   # TODO Implement copy feature
@@ -36,12 +79,320 @@ class MsGraphClient:
 
   (TYPE_NONE, TYPE_FILE, TYPE_FOLDER) = (0, 1, 2)
 
-  def __init__(self, mgc: OAuth2Session):
+  # Initial size of chunks. It is then adapted to the measured throughput
+  UPLOAD_CHUNK_SIZE = 1048576 * 20  # 20 MB
+  DOWNLOAD_CHUNK_SIZE = 1048576 * 20  # 20 MB
+  # Fragments of an upload session must be multiples of 320 KiB and must
+  # be smaller than 60 MiB
+  UPLOAD_FRAGMENT_MULTIPLE = 327680  # 320 KiB
+  UPLOAD_FRAGMENT_MAX_SIZE = 327680 * 191
+  # Fixed size of fragments of a stream (10 MiB). Memory used by the
+  # upload of a stream is bounded by three fragments.
+  UPLOAD_STREAM_FRAGMENT_SIZE = 327680 * 32
+  # Memory used to read ahead when a download is streamed to a pipe
+  STREAM_READ_AHEAD_SIZE = 1048576 * 32  # 32 MB
+  STREAM_BLOCK_SIZE = 1048576  # 1 MB
+  # (connect, read) timeouts in seconds by class of request
+  TIMEOUTS = {
+      'metadata': (10, 60),
+      'transfer': (10, 120)
+  }
+  # Methods which can be sent again after a transient error
+  IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+  # 500 - Internal Server Error - 502: Bad Gateway - 503: Service
+  # Unavailable - 504: Gateway Timeout
+  TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+  TRANSIENT_EXCEPTIONS = (
+      requests.ConnectionError,
+      requests.Timeout,
+      requests.exceptions.ChunkedEncodingError)
+
+  def __init__(self, mgc: OAuth2Session, config_folder: str = None):
     self.mgc = mgc
+    # All requests are paused together when the account is throttled
+    self.throttle = ThrottleCoordinator()
+    # Requests to a host which is down fail fast
+    self.__circuit_breakers = {}  # host -> CircuitBreaker
+    self.__circuit_breakers_lock = Lock()
+    # Bandwidth of transfers is not limited by default
+    self.bandwidth_limiter = None
+    # Persistent cache of the remote tree. See set_metadata_cache()
+    self.metadata_cache = None
+    # Number of files transferred concurrently by mget/mput
+    self.nb_jobs = 1
+    # (item id, fileSystemInfo) to be sent by batch
+    self.__pending_file_system_infos = []
+    self.__file_system_infos_lock = Lock()
+    # Upload sessions are persisted in the config folder to be resumed
+    self.upload_session_store = (
+        UploadSessionStore(f"{config_folder}/upload_sessions.json")
+        if config_folder is not None else None)
+    # Parallel ranged download is disabled by default (one connection)
+    self.download_nb_workers = 1
+    self.parallel_download_threshold = 1048576 * 100  # 100 MB
+    # Fragments of a large file are uploaded one at a time by default
+    self.upload_nb_workers = 1
+    self.__upload_out_of_order_rejected = False
+    self.upload_chunk_size = ChunkSizeController(
+        MsGraphClient.UPLOAD_CHUNK_SIZE,
+        min_size=MsGraphClient.UPLOAD_FRAGMENT_MULTIPLE,
+        max_size=MsGraphClient.UPLOAD_FRAGMENT_MAX_SIZE,
+        multiple=MsGraphClient.UPLOAD_FRAGMENT_MULTIPLE,
+        target_duration=10)
+    self.download_chunk_size = ChunkSizeController(
+        MsGraphClient.DOWNLOAD_CHUNK_SIZE,
+        min_size=262144,  # 256 KiB
+        max_size=1048576 * 64,
+        multiple=65536,
+        target_duration=2)
+    # One pool of connections per host, sized from the concurrency
+    self.connection_pools = ConnectionPools(mgc, self.__pool_maxsize())
+
+  def set_download_parallelism(self, nb_workers: int, threshold: int):
+    """
+      Files whose size is greater or equal to 'threshold' bytes will be
+      downloaded through 'nb_workers' concurrent connections.
+      'nb_workers' = 1 disables the parallel ranged download.
+    """
+    self.download_nb_workers = max(1, nb_workers)
+    self.parallel_download_threshold = threshold
+    self.__resize_connection_pools()
+
+  def set_upload_parallelism(self, nb_workers: int):
+    """
+      Up to 'nb_workers' fragments of a large file will be uploaded
+      concurrently within the same upload session.
+      'nb_workers' = 1 disables the concurrent upload.
+    """
+    self.upload_nb_workers = max(1, nb_workers)
+    self.__resize_connection_pools()
+
+  def set_file_concurrency(self, nb_jobs: int):
+    """
+      Up to 'nb_jobs' files will be transferred concurrently
+    """
+    self.nb_jobs = max(1, nb_jobs)
+    self.__resize_connection_pools()
+
+  def set_socket_buffer_size(self, socket_buffer_size: int):
+    """
+      Size in bytes of send and receive buffers of new connections.
+      None keeps the size chosen by the system.
+    """
+    self.connection_pools.configure(
+        self.__pool_maxsize(), socket_buffer_size)
+
+  def __pool_maxsize(self):
+    # Each concurrent file may use several connections to the same host.
+    # Two more connections are kept for metadata requests.
+    return max(
+        10,
+        self.nb_jobs * max(self.download_nb_workers, self.upload_nb_workers)
+        + 2)
+
+  def __resize_connection_pools(self):
+    self.connection_pools.configure(
+        self.__pool_maxsize(), self.connection_pools.socket_buffer_size)
+
+  def connection_pool_stats(self) -> dict:
+    """
+      Return statistics of connection pools by host. See
+      ConnectionPools.stats()
+    """
+    return self.connection_pools.stats()
+
+  def set_bandwidth_limiter(self, bandwidth_limiter: BandwidthLimiter):
+    """
+      All downloads and uploads share 'bandwidth_limiter'.
+      None disables the limit.
+    """
+    self.bandwidth_limiter = bandwidth_limiter
+
+  def circuit_breaker(self, url: str) -> CircuitBreaker:
+    """
+      Return the circuit breaker of the host of 'url'
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    with self.__circuit_breakers_lock:
+      if host not in self.__circuit_breakers:
+        self.__circuit_breakers[host] = CircuitBreaker(host)
+      return self.__circuit_breakers[host]
+
+  @staticmethod
+  def __request_class(url: str) -> str:
+    if url.startswith(MsGraphClient.graph_url) and not url.endswith('/content'):
+      return 'metadata'
+    return 'transfer'
+
+  @staticmethod
+  def __is_replayable(kwargs) -> bool:
+    """
+      Return True if the body of a request can be sent again. A
+      ThrottledStream wraps bytes in memory and starts from the beginning
+      at each iteration.
+    """
+    data = kwargs.get('data')
+    return data is None or isinstance(
+        data,
+        (bytes, bytearray, memoryview, str, dict,
+         BandwidthLimiter.ThrottledStream))
+
+  def set_metadata_cache(self, metadata_cache):
+    """
+      Folder infos are built from 'metadata_cache' (a synchronized
+      MetadataCache) instead of MS Graph. None disables the cache.
+    """
+    self.metadata_cache = metadata_cache
+
+  def __cache_item(self, ms_response):
+    """
+      Record in the metadata cache an item created or modified by this
+      client so that it is seen before the next synchronization.
+      An item without parent id is removed from the cache instead. It will
+      be retrieved from MS Graph.
+    """
+    if (self.metadata_cache is None or not isinstance(ms_response, dict)
+            or 'id' not in ms_response):
+      return
+    if 'id' in ms_response.get('parentReference', {}):
+      self.metadata_cache.apply_delta_items([ms_response])
+    else:
+      self.__uncache_item(ms_response['id'])
+
+  def __uncache_item(self, item_id: str):
+    """
+      Remove from the metadata cache an item deleted by this client
+    """
+    if self.metadata_cache is not None and item_id is not None:
+      self.metadata_cache.apply_delta_items([{'id': item_id, 'deleted': {}}])
+
+  def request(
+          self,
+          method: str,
+          url: str,
+          retry_if_throttled: bool = True,
+          max_retry: int = 5,
+          tqdm_position: int = None,
+          retry_on_error: bool = None,
+          request_class: str = None,
+          wait_if_circuit_open: bool = False,
+          **kwargs):
+    """
+      Send a request through the throttle coordinator and the circuit
+      breaker of the host. Every request must be sent with this method.
+
+      The request waits while the account is throttled. A throttled request
+      is sent again up to 'max_retry' times if 'retry_if_throttled' is True.
+      Else, the throttled response is returned.
+      A timer is displayed at position 'tqdm_position' during the pause if
+      tqdm is installed.
+
+      After a transient error (connection error, timeout, 5xx), the request
+      is sent again up to 'max_retry' times with a jittered backoff if
+      'retry_on_error' is True. By default, it is True for idempotent
+      methods. A request whose body is a stream is never sent again.
+      Once retries are exhausted, the last response is returned or the last
+      exception is raised.
+
+      Timeouts are given by TIMEOUTS['metadata'] or TIMEOUTS['transfer']
+      according to 'request_class' (deduced from 'url' if None) unless a
+      'timeout' is given.
+
+      Raise CircuitOpenException if the host is considered down. If
+      'wait_if_circuit_open' is True, the request first waits until the
+      host is probed again, up to 'max_retry' times RESET_TIMEOUT.
+      Only connection errors, timeouts and 5xx without Retry-After are
+      failures of the host.
+    """
+    replayable = self.__is_replayable(kwargs)
+    if retry_on_error is None:
+      retry_on_error = method in MsGraphClient.IDEMPOTENT_METHODS
+    retry_on_error = retry_on_error and replayable
+    retry_if_throttled = retry_if_throttled and replayable
+    if request_class is None:
+      request_class = self.__request_class(url)
+    kwargs.setdefault('timeout', MsGraphClient.TIMEOUTS[request_class])
+    breaker = self.circuit_breaker(url)
+    backoff = Backoff()
+
+    nb_throttled = 0
+    nb_errors = 0
+    circuit_deadline = None
+    while True:
+      pause = int(self.throttle.remaining_pause())
+      if tqdm is not None and tqdm_position is not None and pause > 0:
+        self.__tqdm_timer(pause, tqdm_position)
+      self.throttle.wait()
+      try:
+        is_probe = breaker.before_request()
+      except CircuitOpenException:
+        if not wait_if_circuit_open:
+          raise
+        if circuit_deadline is None:
+          circuit_deadline = (
+              time.monotonic() + max_retry * CircuitBreaker.RESET_TIMEOUT)
+        lg.warning(f"[request]{method} {url} - wait for '{breaker.name}'")
+        if not breaker.wait(circuit_deadline - time.monotonic()):
+          raise
+        continue
+
+      try:
+        self.connection_pools.ensure_pool(url)
+        r = self.mgc.request(method, url, **kwargs)
+      except requests.RequestException as e:
+        if isinstance(e, MsGraphClient.TRANSIENT_EXCEPTIONS):
+          breaker.record_failure()
+        elif is_probe:
+          # ie. TooManyRedirects. The host has answered.
+          breaker.abort_probe()
+        if (not isinstance(e, MsGraphClient.TRANSIENT_EXCEPTIONS)
+                or not retry_on_error or nb_errors >= max_retry):
+          raise
+        nb_errors += 1
+        delay = backoff.next_delay()
+        lg.warning(
+            f"[request]{method} {url} - {type(e).__name__} - Retry nb ="
+            f" {nb_errors} - Wait {delay:.1f} seconds")
+        time.sleep(delay)
+        continue
+      except BaseException:
+        # ie. KeyboardInterrupt. The host is not at fault.
+        if is_probe:
+          breaker.abort_probe()
+        raise
+
+      retry_after = self.throttle.notify_response(r)
+      if (r.status_code in MsGraphClient.TRANSIENT_STATUS_CODES
+              and 'Retry-After' not in r.headers):
+        breaker.record_failure()
+      else:
+        # A throttled host is available
+        breaker.record_success()
+
+      if retry_after is not None:
+        if not retry_if_throttled or nb_throttled >= max_retry:
+          return r
+        nb_throttled += 1
+        lg.warning(
+            f"[request]{method} {url} has been throttled - Retry nb ="
+            f" {nb_throttled}")
+        r.close()
+        continue
+
+      if (r.status_code not in MsGraphClient.TRANSIENT_STATUS_CODES
+              or not retry_on_error or nb_errors >= max_retry):
+        return r
+      nb_errors += 1
+      delay = backoff.next_delay()
+      lg.warning(
+          f"[request]{method} {url} - {r.reason} (error {r.status_code})"
+          f" - Retry nb = {nb_errors} - Wait {delay:.1f} seconds")
+      r.close()
+      time.sleep(delay)
 
   def get_user(self):
     # Send GET to /me
-    user = self.mgc.get(f"{MsGraphClient.graph_url}/me")
+    user = self.request("GET", f"{MsGraphClient.graph_url}/me")
     # Return the JSON result
     return user.json()
 
@@ -54,7 +405,8 @@ class MsGraphClient:
     }
 
     # Send GET to /me/events
-    events = self.mgc.get(
+    events = self.request(
+        "GET",
         f"{MsGraphClient.graph_url}/me/events",
         params=query_params)
     # Return the JSON result
@@ -98,7 +450,7 @@ class MsGraphClient:
         f"{link}"
         )
 
-    ms_response = self.mgc.get(link)
+    ms_response = self.request("GET", link)
     ms_response_json = ms_response.json()
     if 'error' in ms_response_json:
       lg.warn(
@@ -115,6 +467,29 @@ class MsGraphClient:
 
     return (ms_response_json['value'], next_link)
 
+  def get_ms_responses_for_subtree_from_id(self, id_item: str) -> list:
+    """
+      Return all items of the tree of folder 'id_item' (the folder
+      included) as flat records through the delta API. Pages are requested
+      until the delta link is received.
+      A MsGraphException is raised in case of error.
+    """
+    link = f"{MsGraphClient.graph_url}/me/drive/items/{id_item}/delta"
+    items = []
+    while link is not None:
+      r = self.request("GET", link)
+      r_json = r.json()
+      if r.status_code != 200 or 'error' in r_json:
+        lg.warning(
+            f"[get_ms_responses_for_subtree_from_id]Error received -"
+            f" {r.reason} (error {r.status_code}) - link = {link}")
+        raise MsGraphException(link)
+      items.extend(r_json.get('value', []))
+      link = r_json.get('@odata.nextLink')
+    lg.debug(
+        f"[get_ms_responses_for_subtree_from_id]{len(items)} items received")
+    return items
+
   def __tqdm_timer(self, sec: int, pos: int):
     t = tqdm(
         desc=f'Server is throttled - Wait {sec}s ',
@@ -158,127 +533,427 @@ class MsGraphClient:
           file_id: str,
           local_fullpath: str,
           retry_if_throttled: bool=False, max_retry: int=5,
-          list_tqdm: list = []):
+          list_tqdm: list = [],
+          with_progress_bar: bool = True,
+          preserve_mtime: bool = False,
+          file_info=None):
     """
       Try to download file with id 'file_id' as full path 'local_full_path'
       'local_full_path' must include the destination filename
+      If 'file_info' (MsFileInfo of 'file_id') has a download url, its size,
+      quickxorhash and eTag are used and metadata of the file are not
+      requested again. An expired download url is renewed.
+      Progress bars of 'list_tqdm' are updated with downloaded bytes. A
+      dedicated progress bar is added for large files if 'with_progress_bar'
+      is True.
+      If 'preserve_mtime' is True, the modification time of the local file
+      is the last modification of the remote file given by the client which
+      has uploaded it (fileSystemInfo).
+
+      The file is downloaded in a '.part' file which is renamed once its
+      size and its quickxorhash match the remote file. An interrupted
+      download is resumed from the last downloaded byte.
 
       Return 1 if download is sucessfull. 0 else.
 
     """
-    # Inspired from https://gist.github.com/mvpotter/9088499
     file_name = str(PurePosixPath(local_fullpath).name)
-    download_url = f"{MsGraphClient.graph_url}/me/drive/items/{file_id}/content"
+    # downloadUrl is pre-authenticated and supports 'Range' requests
+    if file_info is not None and file_info.download_url is not None:
+      total_size = file_info.size
+      download_url = file_info.download_url
+      qxh = file_info.qxh
+      etag = file_info.etag
+      lmdt = file_info.content_modified_datetime
+    else:
+      ms_response = self.get_ms_response_from_id(file_id)
+      if 'error' in ms_response or 'file' not in ms_response:
+        lg.error(
+            f"Error during processing of download_file_content({local_fullpath}) - "
+            f"file with id '{file_id}' not found")
+        return 0
 
-    nb_retry = 0
-    while True:
-      nb_retry += 1
-      nb_retry_exception = 0
-      while True:
+      total_size = ms_response['size']
+      download_url = ms_response.get(
+          '@microsoft.graph.downloadUrl',
+          f"{MsGraphClient.graph_url}/me/drive/items/{file_id}/content")
+      qxh = ms_response['file'].get('hashes', {}).get('quickXorHash')
+      etag = ms_response.get('eTag')
+      str_lmdt = ms_response.get('fileSystemInfo', {}).get(
+          'lastModifiedDateTime', ms_response.get('lastModifiedDateTime'))
+      lmdt = (
+          utc_dt_from_str_ms_datetime(str_lmdt)
+          if str_lmdt is not None else None)
+    part = PartFile(local_fullpath, file_id, etag, total_size)
+
+    if (self.download_nb_workers > 1
+            and total_size >= self.parallel_download_threshold):
+      nb_workers = self.download_nb_workers
+      lg.info(
+          f"[download_file_content] Parallel download of '{file_name}'"
+          f" - size = {total_size:,} - workers = {nb_workers}")
+    else:
+      nb_workers = 1
+
+    # With several workers, each worker gets at least one range. Ranges are
+    # limited to 100 MB so that a failed range is cheap to retry.
+    ranges = []
+    range_size = min(-(-total_size // nb_workers), 1048576 * 100)
+    for (missing_start, missing_end) in part.missing_ranges():
+      if nb_workers == 1:
+        ranges.append((missing_start, missing_end))
+      else:
+        ranges.extend(
+            (start, min(start + range_size - 1, missing_end))
+            for start in range(missing_start, missing_end + 1, range_size))
+
+    n_tqdm = (
+        self.__init_download_tqdm(file_name, total_size, list_tqdm)
+        if with_progress_bar else None)
+    nb_bytes_done = part.nb_bytes_done()
+    if nb_bytes_done > 0:
+      for t in list_tqdm:
+        t.update(nb_bytes_done)
+
+    lock = Lock()
+    # download_url expires after a while. It is shared by workers and
+    # renewed if necessary.
+    url_holder = {'url': download_url}
+
+    def download_range(range_start_end):
+      return self.__download_range(
+          file_id, url_holder, part, range_start_end[0], range_start_end[1],
+          retry_if_throttled, max_retry, lock, list_tqdm)
+
+    try:
+      if nb_workers == 1:
+        results = list(map(download_range, ranges))
+      else:
+        with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+          results = list(executor.map(download_range, ranges))
+    finally:
+      part.save()
+      if n_tqdm is not None:
+        list_tqdm.pop()
+        n_tqdm.close()
+
+    mtime = lmdt.timestamp() if preserve_mtime and lmdt is not None else None
+
+    if not all(results) or not part.commit(qxh, mtime):
+      lg.error(
+          f"[download_file_content] Download of file '{local_fullpath}' - KO")
+      return 0
+
+    lg.info(
+        f"[download_file_content] Download of file '{local_fullpath}' - OK")
+    return 1
+
+  def download_file_content_to_stream(
+          self,
+          file_id: str,
+          out_stream,
+          max_retry: int = 5,
+          with_progress_bar: bool = True):
+    """
+      Write the content of file with id 'file_id' in binary stream
+      'out_stream' (ie. sys.stdout.buffer).
+      Content is read ahead by another thread (up to STREAM_READ_AHEAD_SIZE
+      bytes) so that the download is not stalled by a slow consumer. After
+      a network error, download goes on from the last received byte.
+      The quickxorhash of the content is checked once it is written.
 
+      Return 1 if download is sucessfull. 0 else.
+    """
+    ms_response = self.get_ms_response_from_id(file_id)
+    if 'error' in ms_response or 'file' not in ms_response:
+      lg.error(
+          f"[download_file_content_to_stream]File with id '{file_id}' not"
+          " found")
+      return 0
+    total_size = ms_response['size']
+    expected_qxh = ms_response['file'].get('hashes', {}).get('quickXorHash')
+    hasher = QuickXorHasher()
+    url_holder = {'url': ms_response.get(
+        '@microsoft.graph.downloadUrl',
+        f"{MsGraphClient.graph_url}/me/drive/items/{file_id}/content")}
+
+    chunks = queue.Queue(
+        maxsize=MsGraphClient.STREAM_READ_AHEAD_SIZE
+        // MsGraphClient.STREAM_BLOCK_SIZE)
+    stop = Event()
+
+    def put_in_queue(item):
+      # Give up if the consumer has stopped
+      while not stop.is_set():
         try:
-          r = self.mgc.get(download_url, stream=True)
+          chunks.put(item, timeout=1)
+          return True
+        except queue.Full:
+          pass
+      return False
+
+    def read_ahead():
+      current = 0
+      nb_retry = 0
+      backoff = Backoff()
+      error = None
+      while current < total_size and not stop.is_set():
+        attempt_start = current
+        url = url_holder['url']
+        try:
+          r = self.request(
+              "GET",
+              url,
+              headers={'Range': f"bytes={current}-{total_size - 1}"},
+              retry_on_error=False,
+              wait_if_circuit_open=True,
+              stream=True,
+              withhold_token=not url.startswith(MsGraphClient.graph_url))
+          if (r.status_code == 206
+                  or (r.status_code == 200 and current == 0)):
+            for chunk in self.__iter_content_with_adaptive_size(
+                    r, MsGraphClient.STREAM_BLOCK_SIZE):
+              if not put_in_queue(chunk):
+                return
+              current += len(chunk)
+            error = "connection closed before end of file"
+          elif r.status_code in (401, 403, 410):
+            # Download URL has probably expired. Renew it.
+            error = f"download url refused (error {r.status_code})"
+            ms_response = self.get_ms_response_from_id(file_id)
+            if '@microsoft.graph.downloadUrl' in ms_response:
+              url_holder['url'] = ms_response['@microsoft.graph.downloadUrl']
+          elif r.status_code in MsGraphClient.TRANSIENT_STATUS_CODES:
+            error = f"{r.reason} (error {r.status_code})"
+          else:
+            error = f"{r.reason} (error {r.status_code})"
+            break
+        except CircuitOpenException as ex:
+          error = str(ex)
           break
         except Exception as ex:
-          nb_retry_exception += 1
+          error = f"{ex=} - {type(ex)=}"
+          self.download_chunk_size.record_failure()
+        if current >= total_size:
+          break
+        if current > attempt_start:
+          # Retries are only counted for attempts without progress
+          nb_retry = 0
+          backoff = Backoff()
+        nb_retry += 1
+        if nb_retry >= max_retry:
+          break
+        delay = backoff.next_delay()
+        lg.warning(
+            f"[download_file_content_to_stream]{error} - offset {current}"
+            f" - Retry nb = {nb_retry} - Wait {delay:.1f} seconds")
+        time.sleep(delay)
+
+      if current < total_size:
+        put_in_queue(Exception(error))
+      put_in_queue(None)  # End of file
+
+    n_tqdm = (
+        self.__init_download_tqdm(ms_response.get('name', ''), total_size, [])
+        if with_progress_bar else None)
+    result = 1
+    with ThreadPoolExecutor(max_workers=1) as reader:
+      reader.submit(read_ahead)
+      try:
+        while True:
+          chunk = chunks.get()
+          if chunk is None:
+            break
+          if isinstance(chunk, Exception):
+            lg.error(
+                f"[download_file_content_to_stream]Download of file with id"
+                f" '{file_id}' - KO - {chunk}")
+            result = 0
+            break
+          out_stream.write(chunk)
+          hasher.update(chunk)
+          if n_tqdm is not None:
+            n_tqdm.update(len(chunk))
+        out_stream.flush()
+        if (result == 1 and expected_qxh is not None
+                and hasher.base64_digest() != expected_qxh):
           lg.error(
-              f"Exception during download_file_content({local_fullpath}) - "
-              f"{ex=} - {type(ex)=} - Wait 10 seconds"
-          )
-          if nb_retry_exception < 3:
-            time.sleep(10)
-          else:
-            lg.info("A new exception occured and max retries (3) has been"
-                    "reached. Exit function")
-            return 0
+              f"[download_file_content_to_stream]quickxorhash of file with id"
+              f" '{file_id}' does not match ('{hasher.base64_digest()}' vs"
+              f" '{expected_qxh}')")
+          result = 0
+      except BrokenPipeError:
+        lg.warning("[download_file_content_to_stream]Output stream is closed")
+        result = 0
+      finally:
+        stop.set()
+        if n_tqdm is not None:
+          n_tqdm.close()
+    return result
 
-      if r.ok:
+  def __iter_content_with_adaptive_size(self, r, max_size: int = None):
+    """
+      Iterate over the content of response 'r' by chunks whose size is
+      adapted to the measured throughput. Chunks are not greater than
+      'max_size' if it is given.
+    """
+    limiter = self.bandwidth_limiter
+    while True:
+      chunk_size = self.download_chunk_size.size
+      if max_size is not None:
+        chunk_size = min(chunk_size, max_size)
+      if limiter is not None:
+        chunk_size = min(chunk_size, limiter.block_size())
+      start_time = time.monotonic()
+      chunk = r.raw.read(chunk_size, decode_content=True)
+      if not chunk:
         break
+      self.download_chunk_size.record_success(
+          len(chunk), time.monotonic() - start_time)
+      if limiter is not None:
+        limiter.consume(len(chunk))
+      yield chunk
+
+  def __init_download_tqdm(
+          self, file_name: str, total_size: int, list_tqdm: list):
+    """
+      A tqdm will be initiated if total size is greater than 100 Mb
+    """
+    if tqdm is None or total_size <= 100 * 1048576:
+      return None
+    n_tqdm = tqdm(
+        desc=file_name,
+        total=total_size,
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+        colour="green" if len(list_tqdm) == 0 else "",
+        position=len(list_tqdm),
+        leave=len(list_tqdm) == 0)
+    list_tqdm.append(n_tqdm)
+    return n_tqdm
+
+  def __download_range(
+          self,
+          file_id: str,
+          url_holder: dict,
+          part: PartFile,
+          range_start: int,
+          range_end: int,
+          retry_if_throttled: bool,
+          max_retry: int,
+          lock: Lock,
+          list_tqdm: list):
+    """
+      Download bytes 'range_start' to 'range_end' (included) of a file in
+      its '.part' file. After an error, download goes on from the last
+      received byte with a new 'Range' request.
 
-      # Manage Errors
-      if (r.status_code not in (429, 503) or not retry_if_throttled):
-        # 429 = TooManyRequests - 503 = Service Unavailable
-        lg.error(
-            f"Error during processing of download_file_content({local_fullpath}) - "
-            f"{r.reason} (error {r.status_code})")
-        return 0
+      Return True if range is completely downloaded. False else.
+    """
+    # Inspired from https://gist.github.com/mvpotter/9088499
+    file_name = str(PurePosixPath(part.local_fullpath).name)
+    current = range_start
+    nb_retry = 0
+    backoff = Backoff()
+    while current <= range_end:
+      attempt_start = current
+      url = url_holder['url']
+      try:
+        r = self.request(
+            "GET",
+            url,
+            headers={'Range': f"bytes={current}-{range_end}"},
+            retry_if_throttled=retry_if_throttled,
+            max_retry=max_retry,
+            tqdm_position=len(list_tqdm),
+            retry_on_error=False,
+            wait_if_circuit_open=True,
+            stream=True,
+            withhold_token=not url.startswith(MsGraphClient.graph_url))
+
+        if (r.status_code == 206  # Partial Content
+            or (r.status_code == 200 and current == 0
+                and range_end == part.size - 1)):
+          # Time to first byte
+          self.download_chunk_size.record_rtt(r.elapsed.total_seconds())
+          with open(part.part_path, 'r+b') as f:
+            f.seek(current)
+            for chunk in self.__iter_content_with_adaptive_size(r):
+              if chunk:  # filter out keep-alive new chunks
+                lg.info(
+                    f"[download_file_content] Downloading {file_name} from {current}")
+                f.write(chunk)
+                f.flush()
+                part.mark_done(current, current + len(chunk), chunk)
+                current += len(chunk)
+                with lock:
+                  for t in list_tqdm:
+                    t.update(len(chunk))
+          if current > range_end:
+            break
+          error = "connection closed before end of range"
+          self.download_chunk_size.record_failure()
+
+        elif r.status_code in (401, 403, 410):
+          # Download URL has probably expired. Renew it.
+          error = f"download url refused (error {r.status_code})"
+          with lock:
+            if url_holder['url'] == url:
+              ms_response = self.get_ms_response_from_id(file_id)
+              if '@microsoft.graph.downloadUrl' in ms_response:
+                url_holder['url'] = ms_response['@microsoft.graph.downloadUrl']
+
+        elif r.status_code in MsGraphClient.TRANSIENT_STATUS_CODES:
+          error = f"{r.reason} (error {r.status_code})"
+
+        else:
+          lg.error(
+              f"Error during processing of download_file_content({part.local_fullpath}) - "
+              f"range {current}-{range_end} - {r.reason} (error {r.status_code})")
+          return False
 
-      # From here status_code in (429, 503) and retry_if_throttled is True
-      # https://learn.microsoft.com/en-US/sharepoint/dev/general-development/how-to-avoid-getting-throttled-or-blocked-in-sharepoint-online
-      if nb_retry >= max_retry:
+      except CircuitOpenException as ex:
         lg.error(
-            f"Error during processing of try_download_file_content({local_fullpath}) -"
-            "Max retry has been reached. Stop function.")
-        return 0
-
-      header_params = {}
-      for p in (
-          "Retry-After",
-              "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset"):
-        header_params[p] = int(r.headers[p]) if p in r.headers else ""
-      if header_params["Retry-After"] == "":
-        header_params["Retry-After"] = 11
-
-      lg.warn(
-          f"Warn during processing of download_file_content({local_fullpath}) -"
-          f"Client application has been throttled"
-          f" (error code = {r.status_code}). Wait for "
-          f"{header_params['Retry-After']} seconds - Retry nb = {nb_retry} "
-          f" - RateLimit-Limit = {header_params['RateLimit-Limit']}"
-          f" - RateLimit-Remaining = {header_params['RateLimit-Remaining']}"
-          f" - RateLimit-Reset = {header_params['RateLimit-Reset']}"
-          f" - Headers = {r.headers}")
-
-      if tqdm is not None:
-        self.__tqdm_timer(header_params["Retry-After"], len(list_tqdm))
-      else:
-        time.sleep(header_params["Retry-After"])
-
-    # A tqdm will be initiated if content length is greater than 100 Mb
-    if (
-            tqdm is not None
-            and 'Content-Length' in r.headers
-            and int(r.headers['Content-Length']) > 100 * 1048576):
-      n_tqdm = tqdm(
-          desc=file_name,
-          total=int(r.headers['Content-Length']),
-          unit="B",
-          unit_scale=True,
-          unit_divisor=1024,
-          colour="green" if len(list_tqdm) == 0 else "",
-          position=len(list_tqdm),
-          leave=len(list_tqdm) == 0)
-      list_tqdm.append(n_tqdm)
-    else:
-      n_tqdm = None
-
-    CHUNK_SIZE = 1048576 * 20  # 20 MB
-    start = 0
+            f"Error during processing of download_file_content({part.local_fullpath}) - "
+            f"range {current}-{range_end} - {ex}")
+        return False
 
-    with open(local_fullpath, 'wb') as f:
-      for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
-        if chunk:  # filter out keep-alive new chunks
-          lg.info(
-              f"[download_file_content] Downloading {file_name} from {start}")
-          f.write(chunk)
-          f.flush()
-          start = start + len(chunk)
-          for t in list_tqdm:
-            t.update(len(chunk))
-    lg.info(
-        f"[download_file_content] Download of file '{local_fullpath}' - OK")
+      except Exception as ex:
+        error = f"{ex=} - {type(ex)=}"
+        self.download_chunk_size.record_failure()
 
-    if n_tqdm is not None:
-      list_tqdm.pop()
-      n_tqdm.close()
+      if current > range_end:
+        # Error after the last byte of the range
+        break
+      if current > attempt_start:
+        # Retries are only counted for attempts without progress
+        nb_retry = 0
+        backoff = Backoff()
+      nb_retry += 1
+      if nb_retry >= max_retry:
+        lg.error(
+            f"Error during processing of download_file_content({part.local_fullpath}) - "
+            f"range {current}-{range_end} - {error}"
+            " - Max retry has been reached. Stop function.")
+        return False
+      delay = backoff.next_delay()
+      lg.warning(
+          f"[download_file_content] {file_name} - range"
+          f" {current}-{range_end} - {error} - Retry nb = {nb_retry}"
+          f" - Wait {delay:.1f} seconds")
+      time.sleep(delay)
 
-    return 1
+    return True
 
   def delete_file(self, file_path):
     file_path = StrPathUtil.add_first_char_if_necessary(file_path, "/")
     item_id = self.get_id_from_path(file_path)
-    r = self.mgc.delete(
+    r = self.request(
+        "DELETE",
         f"{MsGraphClient.graph_url}/me/drive/items/{item_id}")
+    if r.status_code in (204, 404):
+      self.__uncache_item(item_id)
     if r.status_code == 404:
       return 0      # File not found
     elif r.status_code == 204:
@@ -287,7 +962,7 @@ class MsGraphClient:
       return 2      # ??
 
   def raw_command(self, cmd):
-    result = self.mgc.get(f"{MsGraphClient.graph_url}{cmd}")
+    result = self.request("GET", f"{MsGraphClient.graph_url}{cmd}")
     return result
 
 
@@ -313,11 +988,26 @@ class MsGraphClient:
           dst_folder_id,
           src_file,
           dst_file_name=None,
-          with_progress_bar=True):
+          with_progress_bar=True,
+          preserve_mtime=False):
+    """
+      Upload local file 'src_file' in remote folder 'dst_folder_id'.
+      If 'preserve_mtime' is True, the modification time of the local file
+      is given as fileSystemInfo of the remote file. It is sent with the
+      upload session of a large file. It is sent later by batch for a small
+      file (see flush_file_system_infos()).
+      Return the last response received from the server.
+    """
     dst_file_name = dst_file_name if dst_file_name is not None else src_file.split("/").pop()
 
-    total_size = os.path.getsize(src_file)
+    st = os.stat(src_file)
+    total_size = st.st_size
     lg.debug(f"File size = {total_size}")
+    file_system_info = (
+        {'lastModifiedDateTime': str_ms_datetime_from_timestamp(st.st_mtime)}
+        if preserve_mtime else None)
+    # quickxorhash is computed while the file is read to be sent
+    hasher = QuickXorRangeHasher(total_size)
     # For file size < 4Mb
     if total_size < (1048576 * 4):
       url = f"{MsGraphClient.graph_url}/me/drive/items/{dst_folder_id}:/{dst_file_name}:/content"
@@ -326,38 +1016,29 @@ class MsGraphClient:
           'Content-Type': 'application/octet-stream'
       }
       lg.debug(f"url put file = {url}")
+      # Content is read in memory so that it can be sent again if the
+      # request is throttled
       with open(src_file, 'rb') as f:
-        r = self.mgc.put(
-            url,
-            data=f,
-            headers=headers)
+        data = f.read()
+      hasher.add(0, data)
+      if self.bandwidth_limiter is not None:
+        data = self.bandwidth_limiter.throttled_stream(data)
+      r = self.request(
+          "PUT",
+          url,
+          data=data,
+          headers=headers)
+      if r.status_code in (200, 201):
+        self.__cache_item(r.json())
+        self.__verify_uploaded_file(src_file, st, hasher, r.json())
+        if file_system_info is not None:
+          self.defer_file_system_info(r.json()['id'], file_system_info)
 
       return r
 
     else:
       # For file size > 4 Mb
       # https://docs.microsoft.com/fr-fr/graph/api/driveitem-createuploadsession?view=graph-rest-1.0
-      url = f"{MsGraphClient.graph_url}/me/drive/items/{dst_folder_id}:/{dst_file_name}:/createUploadSession"
-      data = {
-          "item": {
-              "@microsoft.graph.conflictBehavior": "replace"
-          }
-      }
-
-      # Initiate upload session
-      data_json = json.dumps(data)
-      r1 = self.mgc.post(
-          url,
-          headers={
-              'Content-Type': 'application/json'
-          },
-          data=data_json
-      )
-      r1_json = r1.json()
-      uurl = r1_json["uploadUrl"]
-
-      # Upload parts of file
-      total_size = os.path.getsize(src_file)
       lg.debug(f"total_size = {total_size:,}")
 
       # Init Progress bar
@@ -371,136 +1052,669 @@ class MsGraphClient:
       else:
         pbar = None
 
-      CHUNK_SIZE = 1048576 * 20  # 20 MB
-      current_start = 0
+      nb_attempts = 0
+      while True:
+        nb_attempts += 1
+        (uurl, next_ranges) = self.__get_upload_session(
+            dst_folder_id, src_file, dst_file_name, total_size,
+            file_system_info)
+        if pbar is not None:
+          pbar.reset()
+          pbar.update(total_size - sum(e - s + 1 for (s, e) in next_ranges))
+        try:
+          r = self.__upload_fragments(
+              uurl, src_file, total_size, next_ranges, pbar, hasher)
+          break
+        except MsGraphUploadSessionException:
+          if self.upload_session_store is not None:
+            self.upload_session_store.remove(src_file)
+          if nb_attempts >= 2:
+            raise
+          lg.warning(
+              "Upload session no longer exists. Upload with a new session")
+        except TruncatedFileException:
+          # The session cannot be resumed with the same content
+          if pbar is not None:
+            pbar.close()
+          self.cancel_upload(uurl)
+          raise
+
+      if pbar is not None:
+        pbar.close()
 
-      if total_size >= current_start + CHUNK_SIZE:
-        current_end = current_start + CHUNK_SIZE - 1
+      rjson = r.json()
+      if "id" not in rjson:
+        lg.error("Error during uploading")
       else:
-        current_end = total_size - 1
-      current_size = current_end - current_start + 1
+        lg.info(f"Correctly uploaded - id = {rjson['id']}")
+        r_status = self.request("GET", uurl)
+        lg.debug(f"Status of upload URL: {pprint.pformat(r_status.json())}")
+        if self.upload_session_store is not None:
+          self.upload_session_store.remove(src_file)
 
-      stop_reason = "OK"
-      retry_status = self.RetryStatus(5)  # MaxRetry = 5
+      # Close URL
+      self.cancel_upload(uurl)
 
-      simu_error = 0 == 1  # No simulation of error
+      if "id" in rjson:
+        self.__cache_item(rjson)
+        self.__verify_uploaded_file(src_file, st, hasher, rjson)
 
-      with open(src_file, 'rb') as fin:
-        i = 0
-        while True:
-          current_stream = fin.read(current_size)
+      lg.info("Session is finish")
+      return r
 
-          if not current_stream:
-            stop_reason = "end_of_stream"
-            break
-          if current_start > total_size:
-            stop_reason = "current_size_oversized"
-            break
-          if i > 2000:
-            stop_reason = "exceed_number_of_loop"
-            break
+  def put_stream_content_from_fullpath(
+          self,
+          dst_fullpath: str,
+          in_stream,
+          with_progress_bar: bool = True):
+    """
+      Upload binary stream 'in_stream' (ie. sys.stdin.buffer) as remote file
+      'dst_fullpath'. Return the last response of the server or None if the
+      destination folder does not exist.
+    """
+    dst_posix_path = PurePosixPath(
+        StrPathUtil.add_first_char_if_necessary(dst_fullpath, "/"))
+    parent_id = self.get_id_from_path(str(dst_posix_path.parent))
+    if parent_id is None:
+      lg.warn(
+          "[put_stream_content_from_fullpath]parent_id not found for folder"
+          f" '{dst_posix_path.parent}'")
+      return None
+    return self.put_stream_content_from_id_of_dstfolder(
+        parent_id, in_stream, dst_posix_path.name, with_progress_bar)
 
-          lg.debug(
-              "{0} start/end/size/total/nbretry - {1:>15,}{2:>15,}{3:>15,}{4:>15,}{5:>6}".format(
-                  i,
-                  current_start,
-                  current_end,
-                  current_size,
-                  total_size,
-                  retry_status.get_nb_retry()))
-
-          i = i + 1
-
-          headers = {
-              'Content-Length': str(current_size),
-              'Content-Range': f"bytes {current_start}-{current_end}/{total_size}"}
-
-          #simu_error = i==5 # Uncomment to simulate an error
-          if not simu_error:
-            r = self.mgc.put(
-                uurl,
-                headers=headers,
-                data=current_stream,
-                withhold_token=True)
-          status_code_put = r.status_code
-          if ((status_code_put in (500, 502, 503, 504)) or (simu_error)):
-            # 500 - Internal Server Error - 502: Bad Gateway - 503: Service
-            # Unavailable - 504: Gateway Timeout
-
-            r = self.mgc.get(uurl)
-            lg.debug(
-                f"Error with retry. Status of upload URL: {pprint.pformat(r.json())}")
-
-            if not retry_status.max_retry_reach():
-              retry_status.increase_retry()
-              lg.warning(
-                  "Error during uploading. Retry #{0}. Uploaded range: {1}->{2}. error code : {3}. Retrying upload".format(
-                      retry_status.get_nb_retry(),
-                      current_start,
-                      current_end,
-                      status_code_put))
-              lg.info(f"Wait {retry_status.delay_wait()} seconds")
-              ner = r.json()['nextExpectedRanges'][0]
-              current_start = int(ner[:ner.find('-')])
-              if total_size >= current_start + CHUNK_SIZE:
-                current_end = current_start + CHUNK_SIZE - 1
-              else:
-                current_end = total_size - 1
-              current_size = current_end - current_start + 1
-              time.sleep(retry_status.delay_wait())
-              fin.seek(current_start)
-            else:
-              raise Exception("Maximum retry reached after an error")
-
-          elif status_code_put == 404:  # Not found. Upload session no longer exists
-            lg.error(
-                "Upload session no longer exists (error code 404). Stop upload")
-            raise Exception(
-                "Upload session no longer exists. Please relaunch upload. Current range: {0}->{1}.".format(
-                    current_start, current_end))
+  def put_stream_content_from_id_of_dstfolder(
+          self,
+          dst_folder_id: str,
+          in_stream,
+          dst_file_name: str,
+          with_progress_bar: bool = True):
+    """
+      Upload binary stream 'in_stream' whose size is not known in advance.
+
+      A stream smaller than 4 MB is sent with a single request. Else, it is
+      sent through an upload session by fragments of
+      UPLOAD_STREAM_FRAGMENT_SIZE read in memory while it is sent. The
+      total size is unknown ("*") until the last fragment, which is
+      detected by reading one fragment ahead. Memory is bounded by three
+      fragments. Nothing is staged on disk.
+      An upload from a stream can not be resumed by a next run.
+      quickxorhash of the stream is computed while it is sent and compared
+      with the hash of the uploaded item.
+
+      Return the last response received from the server.
+    """
+    def read_block(size):
+      blocks = []
+      nb_bytes = 0
+      while nb_bytes < size:
+        block = in_stream.read(size - nb_bytes)
+        if not block:
+          break
+        blocks.append(block)
+        nb_bytes += len(block)
+      return b"".join(blocks)
+
+    # 13 x 320 KiB is the first multiple of 320 KiB greater than 4 MB
+    first_block = read_block(MsGraphClient.UPLOAD_FRAGMENT_MULTIPLE * 13)
+    hasher = QuickXorHasher()
+    if len(first_block) < 1048576 * 4:
+      url = f"{MsGraphClient.graph_url}/me/drive/items/{dst_folder_id}:/{dst_file_name}:/content"
+      hasher.update(first_block)
+      data = first_block
+      if self.bandwidth_limiter is not None:
+        data = self.bandwidth_limiter.throttled_stream(data)
+      r = self.request(
+          "PUT",
+          url,
+          data=data,
+          headers={'Content-Type': 'application/octet-stream'})
+      if r.status_code in (200, 201):
+        self.__cache_item(r.json())
+        self.__verify_uploaded_hash(
+            dst_file_name, hasher.base64_digest(), r.json())
+      return r
 
-          elif status_code_put not in (202, 201, 200):  # Accepted/Created/OK
-            msg_error = "Error during uploading. uploaded range: {0}->{1}. status_code : {2}. Stop upload".format(
-                current_start, current_end, r.status_code)
-            lg.error(msg_error)
+    url = f"{MsGraphClient.graph_url}/me/drive/items/{dst_folder_id}:/{dst_file_name}:/createUploadSession"
+    r1 = self.request(
+        "POST",
+        url,
+        headers={'Content-Type': 'application/json'},
+        data=json.dumps({
+            "item": {"@microsoft.graph.conflictBehavior": "replace"}}))
+    r1_json = r1.json()
+    if "uploadUrl" not in r1_json:
+      lg.error(f"Error during creation of upload session - {r1_json}")
+      raise MsGraphException(url)
+    uurl = r1_json["uploadUrl"]
+
+    pbar = (
+        tqdm(
+            desc=f"Uploading {dst_file_name}",
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024)
+        if tqdm is not None and with_progress_bar else None)
+    r = None
+    try:
+      with ThreadPoolExecutor(max_workers=1) as reader:
+        current = first_block
+        current_start = 0
+        next_block = reader.submit(
+            read_block, MsGraphClient.UPLOAD_STREAM_FRAGMENT_SIZE)
+        while len(current) > 0:
+          # Next fragment is read before sending the current one to know
+          # whether the current one is the last one
+          next_data = next_block.result()
+          if len(next_data) > 0:
+            next_block = reader.submit(
+            read_block, MsGraphClient.UPLOAD_STREAM_FRAGMENT_SIZE)
+          current_end = current_start + len(current) - 1
+          total = "*" if len(next_data) > 0 else str(current_end + 1)
+          hasher.update(current)
+          r = self.__put_stream_fragment(
+              uurl, current, current_start, current_end, total)
+          if pbar is not None:
+            pbar.update(len(current))
+          (current_start, current) = (current_end + 1, next_data)
+    except Exception:
+      self.cancel_upload(uurl)
+      raise
+    finally:
+      if pbar is not None:
+        pbar.close()
+
+    if r is not None and "id" in r.json():
+      lg.info(f"Correctly uploaded - id = {r.json()['id']}")
+      self.__cache_item(r.json())
+      self.__verify_uploaded_hash(
+          dst_file_name, hasher.base64_digest(), r.json())
+    else:
+      lg.error("Error during uploading")
+    return r
 
-            raise Exception(msg_error)
-            # r is a object with type 'request.response' which is not serializable as json - an error is raised
-            # 'TypeError: Object of type 'Response' is not JSON serializable'
-            # lg.error("Error during uploading. uploaded range: {0}->{1}. status_code : {2}. response : {3}".format(
-            #  current_start, current_end, r.status_code, pprint.pformat(json.dumps(r))
-            # ))
+  def __put_stream_fragment(self, uurl, data, start, end, total):
+    """
+      Send a fragment of a stream. It is sent again after a transient
+      failure (see __fragment_must_be_resent()).
+      Return the response of the server or None if the fragment has been
+      received before a failure.
+    """
+    retry_status = self.RetryStatus(5)  # MaxRetry = 5
+    while True:
+      r = self.__put_fragment(uurl, data, start, end, total)
+      if self.__fragment_must_be_resent(r):
+        next_ranges = self.__wait_before_resending_fragment(
+            uurl, r, start, end, end + 1, retry_status)
+        if len(next_ranges) == 0 or next_ranges[0][0] == start:
+          continue
+        if next_ranges[0][0] == end + 1:
+          # Fragment has been received before the failure
+          return None
+        msg_error = (
+            f"Server expects range {next_ranges[0]} after a failure of range"
+            f" {start}->{end}. Stream can not be rewound. Stop upload")
+        lg.error(msg_error)
+        raise Exception(msg_error)
+      if r.status_code in (200, 201):  # Upload is completed
+        return r
+      if r.status_code == 202:  # Accepted
+        next_ranges = self.__parse_next_expected_ranges(r.json(), end + 1)
+        if len(next_ranges) > 0 and next_ranges[0][0] != end + 1:
+          msg_error = (
+              f"Server expects range {next_ranges[0]} after range"
+              f" {start}->{end}. Stream can not be rewound. Stop upload")
+          lg.error(msg_error)
+          raise Exception(msg_error)
+        return r
+      if r.status_code == 404:  # Upload session no longer exists
+        lg.error(
+            "Upload session no longer exists (error code 404). Stop upload")
+        raise MsGraphUploadSessionException(uurl)
+      msg_error = (
+          f"Error during uploading. uploaded range: {start}->{end}."
+          f" status_code : {r.status_code}. Stop upload")
+      lg.error(msg_error)
+      raise Exception(msg_error)
+
+  def __get_upload_session(
+          self, dst_folder_id, src_file, dst_file_name, total_size,
+          file_system_info=None):
+    """
+      Return a tuple (upload url, next expected ranges).
+      A persisted upload session of the same local file is resumed if it
+      still exists. Else, a new upload session is created and persisted.
+      'file_system_info' is given to the item of a new session.
+    """
+    store = self.upload_session_store
+    session = (
+        store.get(src_file, dst_folder_id, dst_file_name)
+        if store is not None else None)
+
+    if session is not None:
+      r = self.request("GET", session['uploadUrl'])
+      self.upload_chunk_size.record_rtt(r.elapsed.total_seconds())
+      if r.status_code == 200:
+        r_json = r.json()
+        self.__refresh_upload_session(src_file, r_json)
+        session['expirationDateTime'] = r_json.get(
+            'expirationDateTime', session['expirationDateTime'])
+        next_ranges = self.__parse_next_expected_ranges(r_json, total_size)
+        nothing_uploaded = next_ranges == [(0, total_size - 1)]
+        if not (nothing_uploaded and store.is_close_to_expiry(session)):
+          # Expiration of the session is extended by each uploaded fragment
+          lg.info(
+              f"Resume upload session of '{src_file}' - next expected"
+              f" ranges = {next_ranges}")
+          return (session['uploadUrl'], next_ranges)
+        lg.info(
+            f"Upload session of '{src_file}' is close to expiry and empty."
+            " Replace it")
+        self.cancel_upload(session['uploadUrl'])
+      else:
+        lg.info(
+            f"Upload session of '{src_file}' no longer exists"
+            f" (error {r.status_code})")
+      store.remove(src_file)
+
+    url = f"{MsGraphClient.graph_url}/me/drive/items/{dst_folder_id}:/{dst_file_name}:/createUploadSession"
+    data = {
+        "item": {
+            "@microsoft.graph.conflictBehavior": "replace"
+        }
+    }
+    if file_system_info is not None:
+      data["item"]["fileSystemInfo"] = file_system_info
+
+    # Initiate upload session
+    data_json = json.dumps(data)
+    r1 = self.request(
+        "POST",
+        url,
+        headers={
+            'Content-Type': 'application/json'
+        },
+        data=data_json
+    )
+    self.upload_chunk_size.record_rtt(r1.elapsed.total_seconds())
+    r1_json = r1.json()
+    if "uploadUrl" not in r1_json:
+      lg.error(f"Error during creation of upload session - {r1_json}")
+      raise MsGraphException(url)
+    uurl = r1_json["uploadUrl"]
+    if store is not None:
+      store.put(
+          src_file, dst_folder_id, dst_file_name, uurl,
+          r1_json.get('expirationDateTime', ''))
+    return (uurl, [(0, total_size - 1)])
+
+  def __refresh_upload_session(self, src_file, r_json):
+    """
+      Record the new expiration of a persisted upload session
+    """
+    if (self.upload_session_store is not None
+            and 'expirationDateTime' in r_json):
+      self.upload_session_store.update_expiration(
+          src_file, r_json['expirationDateTime'])
 
-          else:  # status_code_put in (202, 201, 200)
+  @staticmethod
+  def __verify_uploaded_hash(name, local_qxh, rjson):
+    """
+      Compare the quickxorhash computed during the upload with the hash of
+      the uploaded item. Raise MsGraphHashMismatchException if they differ.
+    """
+    remote_qxh = rjson.get('file', {}).get('hashes', {}).get('quickXorHash')
+    if remote_qxh is None:
+      lg.debug(f"[verify_uploaded_hash]No quickxorhash for '{name}'")
+    elif remote_qxh != local_qxh:
+      lg.error(
+          f"[verify_uploaded_hash]'{name}' - local quickxorhash"
+          f" '{local_qxh}' vs uploaded '{remote_qxh}'")
+      raise MsGraphHashMismatchException(name, local_qxh, remote_qxh)
+    else:
+      lg.debug(f"[verify_uploaded_hash]'{name}' - quickxorhash '{local_qxh}'")
+
+  def __verify_uploaded_file(self, src_file, st, hasher, rjson):
+    """
+      Verify the hash of uploaded file 'src_file' whose stat before the
+      upload is 'st'. The hash is recorded for the next comparisons if the
+      file has not changed during the upload.
+    """
+    local_qxh = hasher.base64_digest()
+    self.__verify_uploaded_hash(src_file, local_qxh, rjson)
+    new_st = os.stat(src_file)
+    if (new_st.st_size, new_st.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+      record_quickxorhash(src_file, local_qxh)
+
+  def __upload_fragments(
+          self, uurl, src_file, total_size, next_ranges, pbar, hasher):
+    """
+      Upload the ranges of src_file expected by the upload session.
+      Each fragment is read from src_file in its own buffer.
+      They are added to 'hasher' when they are sent. Ranges which have not
+      been sent (ie. uploaded by a previous session) are added at the end.
+      Return the last response received from the server.
+    """
+    with FileFragments(src_file) as source:
+      r = None
+      if (self.upload_nb_workers > 1
+              and not self.__upload_out_of_order_rejected):
+        (r, rejected) = self.__upload_fragments_concurrently(
+            uurl, src_file, source, total_size, next_ranges, pbar, hasher)
+        if rejected:
+          lg.warning(
+              "Server rejects out-of-order fragments. Fall back to"
+              " sequential upload")
+          self.__upload_out_of_order_rejected = True
+
+        if r is None or r.status_code not in (200, 201):
+          # Fragments are still expected by the server
+          r_status = self.request("GET", uurl)
+          next_ranges = self.__parse_next_expected_ranges(
+              r_status.json(), total_size)
+
+      if r is None or r.status_code not in (200, 201):
+        current_start = next_ranges[0][0] if len(next_ranges) > 0 else 0
+        r = self.__upload_fragments_sequentially(
+            uurl, src_file, source, total_size, current_start, pbar, hasher)
+
+      if r is not None and r.status_code in (200, 201):
+        for (start, end_exclusive) in hasher.missing_ranges():
+          hasher.add(start, source.fragment(start, end_exclusive - 1))
+
+    return r
+
+  @staticmethod
+  def __parse_next_expected_ranges(status_json, total_size):
+    """
+      Return list of tuple (start, end) from 'nextExpectedRanges' of the
+      status of an upload session.
+      A range with no end ("12345-") ends with the file.
+    """
+    result = []
+    for ner in status_json.get('nextExpectedRanges', []):
+      (str_start, str_end) = ner.split('-')
+      result.append(
+          (int(str_start), int(str_end) if str_end != "" else total_size - 1))
+    return result
+
+  @staticmethod
+  def __fragment_must_be_resent(r) -> bool:
+    """
+      Return True if response 'r' of a fragment is a transient failure: no
+      response (None), throttled or server error
+    """
+    return (
+        r is None
+        or r.status_code == 429
+        or 'Retry-After' in r.headers
+        or r.status_code in MsGraphClient.TRANSIENT_STATUS_CODES)
+
+  def __wait_before_resending_fragment(
+          self, uurl, r, start, end, total_size, retry_status):
+    """
+      Wait before fragment 'start'->'end' whose response 'r' is a transient
+      failure is sent again. A throttled fragment waits for the throttle
+      coordinator. Else, it waits for the backoff of 'retry_status'.
+      Raise an exception once retries are exhausted.
+      Return the ranges still expected by the upload session.
+    """
+    if retry_status.max_retry_reach():
+      raise Exception("Maximum retry reached after an error")
+    retry_status.increase_retry()
+    throttled = r is not None and (
+        r.status_code == 429 or 'Retry-After' in r.headers)
+    cause = "no response" if r is None else f"error code : {r.status_code}"
+    lg.warning(
+        f"Error during uploading. Retry #{retry_status.get_nb_retry()}."
+        f" Range: {start}->{end}. {cause}."
+        + ("" if throttled else f" Wait {retry_status.delay_wait()} seconds"))
+    if not throttled:
+      time.sleep(retry_status.delay_wait())
+    # Throttled request waits until the end of the throttling
+    r_status = self.request("GET", uurl)
+    if r_status.status_code == 404:  # Upload session no longer exists
+      lg.error("Upload session no longer exists (error code 404). Stop upload")
+      raise MsGraphUploadSessionException(uurl)
+    lg.debug(f"Status of upload URL: {pprint.pformat(r_status.json())}")
+    return self.__parse_next_expected_ranges(r_status.json(), total_size)
+
+  def __put_fragment(self, uurl, stream, start, end, total_size, hasher=None):
+    """
+      Send a fragment and record its throughput to adapt the size of the
+      next fragments. The fragment is added to 'hasher' if any.
+      Return the response of the server or None after a connection error
+      or a timeout.
+    """
+    if hasher is not None:
+      hasher.add(start, stream)
+    headers = {
+        'Content-Length': str(end - start + 1),
+        'Content-Range': f"bytes {start}-{end}/{total_size}"}
+    if self.bandwidth_limiter is not None:
+      stream = self.bandwidth_limiter.throttled_stream(stream)
+    start_time = time.monotonic()
+    try:
+      # Failed fragments are sent again by the caller from the ranges
+      # expected by the server
+      r = self.request(
+          "PUT",
+          uurl,
+          headers=headers,
+          data=stream,
+          retry_on_error=False,
+          withhold_token=True)
+    except MsGraphClient.TRANSIENT_EXCEPTIONS as e:
+      lg.warning(
+          f"[put_fragment]Range {start}->{end} - {type(e).__name__} - {e}")
+      self.upload_chunk_size.record_failure()
+      return None
+    except Exception:
+      self.upload_chunk_size.record_failure()
+      raise
+    if r.status_code in (200, 201, 202):
+      self.upload_chunk_size.record_success(
+          end - start + 1, time.monotonic() - start_time)
+    else:
+      self.upload_chunk_size.record_failure()
+    return r
+
+  def __upload_fragments_sequentially(
+          self, uurl, src_file, source, total_size, current_start, pbar,
+          hasher=None):
+    """
+      Upload fragments one after another from 'current_start'.
+      The next fragment is read ahead while the current one is sent.
+      Next start is given by the 'nextExpectedRanges' returned by the server.
+
+      Return the last response received from the server.
+    """
+    def fragment_end(start, range_end=None):
+      end = min(start + self.upload_chunk_size.size, total_size) - 1
+      return end if range_end is None else min(end, range_end)
+
+    retry_status = self.RetryStatus(5)  # MaxRetry = 5
+    r = None
+    i = 0
+    max_nb_loop = 2000 + 2 * (total_size // self.upload_chunk_size.min_size)
+    current_end = fragment_end(current_start)
+    source.will_need(current_start, current_end)
+
+    while current_start < total_size:
+      current_stream = source.fragment(current_start, current_end)
+      if not current_stream:
+        lg.warning("Unexpected end of stream")
+        break
+      if i > max_nb_loop:
+        lg.warning("Exceed number of loop")
+        break
+
+      # Read next fragment ahead while the current one is sent
+      (next_start, next_end) = (
+          current_end + 1, fragment_end(current_end + 1))
+      if next_start < total_size:
+        source.will_need(next_start, next_end)
+
+      lg.debug(
+          "{0} start/end/size/total/nbretry - {1:>15,}{2:>15,}{3:>15,}{4:>15,}{5:>6}".format(
+              i,
+              current_start,
+              current_end,
+              current_end - current_start + 1,
+              total_size,
+              retry_status.get_nb_retry()))
+      i = i + 1
+
+      r = self.__put_fragment(
+          uurl, current_stream, current_start, current_end, total_size,
+          hasher)
+
+      if self.__fragment_must_be_resent(r):
+        next_ranges = self.__wait_before_resending_fragment(
+            uurl, r, current_start, current_end, total_size, retry_status)
+        if len(next_ranges) > 0:
+          (next_start, next_end) = (
+              next_ranges[0][0],
+              fragment_end(next_ranges[0][0], next_ranges[0][1]))
+        else:
+          (next_start, next_end) = (current_start, current_end)
+        (current_start, current_end) = (next_start, next_end)
+        continue
+
+      status_code_put = r.status_code
+      if status_code_put == 404:  # Not found. Upload session no longer exists
+        lg.error(
+            "Upload session no longer exists (error code 404). Current"
+            f" range: {current_start}->{current_end}. Stop upload")
+        raise MsGraphUploadSessionException(uurl)
+
+      elif status_code_put not in (202, 201, 200):  # Accepted/Created/OK
+        msg_error = "Error during uploading. uploaded range: {0}->{1}. status_code : {2}. Stop upload".format(
+            current_start, current_end, r.status_code)
+        lg.error(msg_error)
+        raise Exception(msg_error)
+
+      elif status_code_put in (201, 200):  # Upload is completed
+        if pbar is not None:
+          pbar.update(current_end - current_start + 1)
+        break
+
+      else:  # status_code_put == 202
+        if pbar is not None:
+          pbar.update(current_end - current_start + 1)
+        source.release(current_start, current_end)
+        self.__refresh_upload_session(src_file, r.json())
+        next_ranges = self.__parse_next_expected_ranges(r.json(), total_size)
+        if len(next_ranges) > 0 and next_ranges[0][0] != next_start:
+          lg.debug(f"Server expects range {next_ranges[0]}")
+          (next_start, next_end) = (
+              next_ranges[0][0],
+              fragment_end(next_ranges[0][0], next_ranges[0][1]))
+          source.will_need(next_start, next_end)
+        if retry_status.get_nb_retry() > 0:
+          retry_status.reset()
+
+      (current_start, current_end) = (next_start, next_end)
+
+    return r
+
+  def __upload_fragments_concurrently(
+          self, uurl, src_file, source, total_size, next_ranges, pbar,
+          hasher=None):
+    """
+      Upload fragments of 'next_ranges' with up to self.upload_nb_workers
+      fragments in flight.
+      Failed fragments are sent again. Upload stops as soon as the server
+      rejects a fragment which is not the next expected one.
+
+      Return a tuple (last response, out-of-order fragments are rejected).
+      The last response is None if the upload is not completed.
+    """
+    def send_fragment(start, end):
+      return self.__put_fragment(
+          uurl, source.fragment(start, end), start, end, total_size, hasher)
+
+    def new_fragments():
+      # Size of each fragment is decided when the fragment is sent
+      for (range_start, range_end) in next_ranges:
+        start = range_start
+        while start <= range_end:
+          end = min(start + self.upload_chunk_size.size - 1, range_end)
+          yield (start, end)
+          start = end + 1
+
+    fragments_to_be_sent = new_fragments()
+    fragments_to_be_retried = deque()
+    in_flight = {}
+    retry_status = self.RetryStatus(5)  # MaxRetry = 5
+    final_response = None
+    rejected = False
+
+    with ThreadPoolExecutor(max_workers=self.upload_nb_workers) as executor:
+      while True:
+        while not rejected and len(in_flight) < self.upload_nb_workers:
+          if len(fragments_to_be_retried) > 0:
+            (start, end) = fragments_to_be_retried.popleft()
+          else:
+            (start, end) = next(fragments_to_be_sent, (None, None))
+            if start is None:
+              break
+          in_flight[executor.submit(send_fragment, start, end)] = (start, end)
+        if len(in_flight) == 0:
+          break
+
+        (done, not_done) = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+          (start, end) = in_flight.pop(future)
+          r = future.result()
+          lg.debug(
+              f"Fragment {start:>15,}{end:>15,} - status"
+              f" {None if r is None else r.status_code}")
+
+          if self.__fragment_must_be_resent(r):
+            next_ranges = self.__wait_before_resending_fragment(
+                uurl, r, start, end, total_size, retry_status)
+            if any(range_start <= end and start <= range_end
+                   for (range_start, range_end) in next_ranges):
+              fragments_to_be_retried.append((start, end))
+            elif pbar is not None:
+              # Fragment has been received before the failure
+              pbar.update(end - start + 1)
+
+          elif r.status_code in (200, 201):  # Upload is completed
+            final_response = r
             if pbar is not None:
-              pbar.update(current_size)
-            current_start = current_end + 1
-            if total_size >= current_start + CHUNK_SIZE:
-              current_end = current_start + CHUNK_SIZE - 1
-            else:
-              current_end = total_size - 1
-            current_size = current_end - current_start + 1
+              pbar.update(end - start + 1)
 
+          elif r.status_code == 202:  # Accepted
+            if pbar is not None:
+              pbar.update(end - start + 1)
+            source.release(start, end)
+            self.__refresh_upload_session(src_file, r.json())
             if retry_status.get_nb_retry() > 0:
               retry_status.reset()
 
-      rjson = r.json()
-      if "id" not in rjson:
-        lg.error("Error during uploading")
-      else:
-        lg.info(f"Correctly uploaded - id = {rjson['id']}")
-        r = self.mgc.get(uurl)
-        lg.debug(f"Status of upload URL: {pprint.pformat(r.json())}")
+          elif r.status_code in (400, 409, 416):
+            # Fragment is not accepted by the server. It will be sent
+            # again by the sequential upload
+            rejected = True
 
-      # Close URL
-      self.cancel_upload(uurl)
+          elif r.status_code == 404:  # Upload session no longer exists
+            lg.error(
+                "Upload session no longer exists (error code 404). Stop upload")
+            raise MsGraphUploadSessionException(uurl)
 
-      lg.info(f"Session is finish - Stop_reason = {stop_reason}")
-      r = r1
-      return r
+          else:
+            msg_error = (
+                f"Error during uploading. uploaded range: {start}->{end}."
+                f" status_code : {r.status_code}. Stop upload")
+            lg.error(msg_error)
+            raise Exception(msg_error)
+
+    return (final_response, rejected)
 
   def cancel_upload(self, upload_url):
-    r = self.mgc.delete(upload_url)
+    r = self.request("DELETE", upload_url)
 
     return r
 
@@ -515,7 +1729,8 @@ class MsGraphClient:
     data = {'name': new_folder, 'folder': {},
             '@microsoft.graph.conflictBehavior': 'rename'}
     data_json = json.dumps(data)
-    r = self.mgc.post(
+    r = self.request(
+        "POST",
         dst_url,
         headers={
             'Content-Type': 'application/json'},
@@ -523,6 +1738,7 @@ class MsGraphClient:
 
     if r.status_code == 201:
       result = r.json()
+      self.__cache_item(result)
     else:
       result = None
       lg.error(
@@ -555,7 +1771,8 @@ class MsGraphClient:
     if not self.__could_be_buggy_path(object_path):
       # Consider root
       prefixed_path = "" if object_path == "/" or object_path == "" else f":/{object_path}"
-      r = self.mgc.get(
+      r = self.request(
+          "GET",
           f'{MsGraphClient.graph_url}/me/drive/items/root{prefixed_path}').json()
       lg.debug(f"[get_ms_response_from_path]return {r}")
       return None if 'error' in r else r
@@ -570,7 +1787,8 @@ class MsGraphClient:
         return None
 
   def get_ms_response_from_id(self, id_item: str):
-    r = self.mgc.get(
+    r = self.request(
+        "GET",
         f'{MsGraphClient.graph_url}/me/drive/items/{id_item}').json()
     return r
 
@@ -584,13 +1802,127 @@ class MsGraphClient:
     posix_path = PurePosixPath(object_path)
     if not self.__could_be_buggy_path(object_path):
       prefixed_path = "" if object_path == "" else f":/{object_path}"
-      r = self.mgc.get(
+      r = self.request(
+        "GET",
         f"{MsGraphClient.graph_url}/me/drive/root{prefixed_path}").json()
       return r["id"] if "id" in r else None
     else:
       return self.__get_id_from_buggy_path(object_path)
 
 
+  def new_batch(self) -> MsGraphBatch:
+    """
+      Return an empty batch of requests to be sent through '/$batch' calls
+    """
+    return MsGraphBatch(self)
+
+  def get_ms_responses_from_ids(self, ids: list) -> list:
+    """
+      Same as get_ms_response_from_id() for several ids with batched
+      requests. Responses are returned in the order of 'ids'.
+    """
+    batch = self.new_batch()
+    request_ids = [
+        batch.add("GET", f"/me/drive/items/{id_item}") for id_item in ids]
+    responses = batch.execute()
+    result = []
+    for request_id in request_ids:
+      body = responses[request_id].json()
+      if body is None:
+        body = {'error': {'code': responses[request_id].status_code}}
+      result.append(body)
+    return result
+
+  def get_ids_from_paths(self, object_paths: list) -> list:
+    """
+      Same as get_id_from_path() for several paths with batched requests.
+      Ids are returned in the order of 'object_paths'. None for an object
+      which is not found.
+    """
+    batch = self.new_batch()
+    request_ids = []
+    for object_path in object_paths:
+      object_path = StrPathUtil.remove_first_char_if_necessary(object_path, "/")
+      if self.__could_be_buggy_path(object_path):
+        request_ids.append(None)
+        continue
+      prefixed_path = (
+          "" if object_path == ""
+          else f":/{urllib.parse.quote(object_path)}")
+      request_ids.append(batch.add("GET", f"/me/drive/root{prefixed_path}"))
+    responses = batch.execute()
+
+    result = []
+    for (object_path, request_id) in zip(object_paths, request_ids):
+      if request_id is None:
+        result.append(self.get_id_from_path(object_path))
+      else:
+        body = responses[request_id].json()
+        result.append(
+            body["id"] if isinstance(body, dict) and "id" in body else None)
+    return result
+
+  def delete_items_from_ids(self, ids: list) -> list:
+    """
+      Delete several objects with batched requests.
+      Return for each id: 0 if object is not found - 1 if object is deleted
+      - 2 for other errors. Same as delete_file().
+    """
+    batch = self.new_batch()
+    request_ids = [
+        batch.add("DELETE", f"/me/drive/items/{id_item}") for id_item in ids]
+    responses = batch.execute()
+    result = []
+    for (id_item, request_id) in zip(ids, request_ids):
+      status_code = responses[request_id].status_code
+      if status_code in (204, 404):
+        self.__uncache_item(id_item)
+      if status_code == 404:
+        result.append(0)      # File not found
+      elif status_code == 204:
+        result.append(1)      # OK
+      else:
+        result.append(2)      # ??
+    return result
+
+  def delete_files(self, file_paths: list) -> list:
+    """
+      Same as delete_file() for several paths with batched requests
+    """
+    ids = self.get_ids_from_paths(file_paths)
+    existing_ids = [id_item for id_item in ids if id_item is not None]
+    codes = iter(self.delete_items_from_ids(existing_ids))
+    return [0 if id_item is None else next(codes) for id_item in ids]
+
+  def create_folders_from_id(self, parent_id: str, folder_names: list) -> list:
+    """
+      Create several folders in the folder with id 'parent_id' with batched
+      requests.
+      Return for each name the msgraph response of the new folder or None
+      if it has not been created.
+    """
+    batch = self.new_batch()
+    request_ids = [
+        batch.add(
+            "POST",
+            f"/me/drive/items/{parent_id}/children",
+            body={
+                'name': folder_name, 'folder': {},
+                '@microsoft.graph.conflictBehavior': 'rename'})
+        for folder_name in folder_names]
+    responses = batch.execute()
+    result = []
+    for (folder_name, request_id) in zip(folder_names, request_ids):
+      if responses[request_id].status_code == 201:
+        result.append(responses[request_id].json())
+        self.__cache_item(result[-1])
+      else:
+        result.append(None)
+        lg.error(
+            "[create_folders_from_id]Error during creation of folder"
+            f" {folder_name} - Error {responses[request_id].status_code}")
+    return result
+
   def move_object(self, src_path: str, dst_path: str):
     lg.info(f"[move]Entering move_object ({src_path},{dst_path})")
 
@@ -635,11 +1967,13 @@ class MsGraphClient:
     }
     data_json = json.dumps(data)
     lg.debug(f"[move]Move from '{src_path}' to parent whose id is '{id_parent}'")
-    r = self.mgc.patch(
+    r = self.request(
+      "PATCH",
       f"{MsGraphClient.graph_url}/me/drive/items/{src_id}",
       headers=headers, data=data_json)
 
     if r.status_code == 200:
+      self.__cache_item(r.json())
       return True
     else:
       lg.error(f"[move]Error during move: {r.reason}")
@@ -660,7 +1994,7 @@ class MsGraphClient:
         "password": password,
         "scope": "anonymous"
     })
-    r = self.mgc.post(url, headers=headers, data=data)
+    r = self.request("POST", url, headers=headers, data=data)
     if r.status_code in (
             200, 201):  # 200 = Already Exists - 201 = Just created
       r_json = r.json()
@@ -674,7 +2008,53 @@ class MsGraphClient:
           f"[create_share_link]Error during link creation to '{path}' '{type}' - {r.reason}")
       return None
 
+  def defer_file_system_info(self, item_id: str, file_system_info: dict):
+    """
+      Set fileSystemInfo of item 'item_id' with the next batch. A batch is
+      sent as soon as it is full.
+    """
+    with self.__file_system_infos_lock:
+      self.__pending_file_system_infos.append((item_id, file_system_info))
+      is_full = (
+          len(self.__pending_file_system_infos) >= MsGraphBatch.MAX_REQUESTS)
+    if is_full:
+      self.flush_file_system_infos()
+
+  def flush_file_system_infos(self):
+    """
+      Send the pending fileSystemInfo. Return the number of items which
+      have not been updated.
+    """
+    with self.__file_system_infos_lock:
+      pending = self.__pending_file_system_infos
+      self.__pending_file_system_infos = []
+    if len(pending) == 0:
+      return 0
+    batch = self.new_batch()
+    for (item_id, file_system_info) in pending:
+      batch.add(
+          "PATCH",
+          f"/me/drive/items/{item_id}",
+          body={'fileSystemInfo': file_system_info})
+    nb_errors = 0
+    for response in batch.execute().values():
+      if not response.ok:
+        nb_errors += 1
+        lg.warning(
+            f"[flush_file_system_infos]fileSystemInfo not set -"
+            f" {response.reason} (error {response.status_code})")
+      else:
+        self.__cache_item(response.json())
+    return nb_errors
+
   def close(self):
+    self.flush_file_system_infos()
+    for (host, host_stats) in self.connection_pool_stats().items():
+      lg.info(
+          f"[close]Connection pool of '{host}' - requests ="
+          f" {host_stats['requests']} - reused connections ="
+          f" {host_stats['hits']} - new connections = {host_stats['misses']}"
+          f" - maxsize = {host_stats['maxsize']}")
     self.mgc.close()
 
 
@@ -717,17 +2097,19 @@ class MsGraphClient:
     def __init__(self, max_retry=5):
       self.__nb_retry = 0
       self.max_retry = max_retry
-      self.__delay = 15  # second
+      self.__backoff = Backoff(base=5, cap=120)
+      self.__delay = 0  # second
 
     def reset(self):
       self.__nb_retry = 0
-      self.__delay = 15
+      self.__backoff.reset()
+      self.__delay = 0
 
     def increase_retry(self):
       if self.max_retry_reach():
         return False
       self.__nb_retry += 1
-      self.__delay *= 2
+      self.__delay = round(self.__backoff.next_delay(), 1)
       return True
 
     def get_nb_retry(self):
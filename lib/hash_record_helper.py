@@ -0,0 +1,169 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import json
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+
+from lib.file_config_helper import force_permission_file_read_write_owner
+
+lg = logging.getLogger('odc.hashrecord')
+
+# Extended attribute where the quickxorhash of a local file is recorded
+XATTR_NAME = 'user.odc.quickxorhash'
+
+
+class HashCache:
+  """
+    Cache of quickxorhash of local files in a SQLite database of the config
+    folder. Used when extended attributes are not supported.
+
+    An entry is identified by the device and the inode of the file and is
+    only valid for the size and the modification time recorded with it.
+    Stale entries are removed when they are read. Entries which have not
+    been read for PURGE_DELAY (ie. deleted files) are removed when the
+    database is opened.
+  """
+
+  PURGE_DELAY = 90 * 86400       # seconds
+  LAST_SEEN_RESOLUTION = 86400   # seconds
+
+  def __init__(self, filename: str):
+    self.filename = filename
+    self.__lock = Lock()
+    self.__connection = None
+
+  def __connect(self) -> sqlite3.Connection:
+    """ Open the database at first use """
+    if self.__connection is None:
+      connection = sqlite3.connect(
+          self.filename, timeout=10, check_same_thread=False)
+      force_permission_file_read_write_owner(self.filename)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      connection.execute(
+          "CREATE TABLE IF NOT EXISTS local_hash ("
+          " dev INTEGER NOT NULL, ino INTEGER NOT NULL,"
+          " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+          " qxh TEXT NOT NULL, path TEXT, last_seen INTEGER NOT NULL,"
+          " PRIMARY KEY (dev, ino))")
+      connection.execute(
+          "DELETE FROM local_hash WHERE last_seen < ?",
+          (int(time.time()) - HashCache.PURGE_DELAY,))
+      connection.commit()
+      self.__connection = connection
+    return self.__connection
+
+  def get(self, filename: str, st: os.stat_result = None):
+    """
+      Return the quickxorhash of 'filename' or None if it is not cached or
+      if the file has changed. 'st' is the stat of the file if known.
+    """
+    if st is None:
+      st = os.stat(filename)
+    now = int(time.time())
+    with self.__lock:
+      connection = self.__connect()
+      row = connection.execute(
+          "SELECT size, mtime_ns, qxh, last_seen FROM local_hash"
+          " WHERE dev = ? AND ino = ?",
+          (st.st_dev, st.st_ino)).fetchone()
+      if row is None:
+        return None
+      (size, mtime_ns, qxh_value, last_seen) = row
+      if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+        connection.execute(
+            "DELETE FROM local_hash WHERE dev = ? AND ino = ?",
+            (st.st_dev, st.st_ino))
+        connection.commit()
+        return None
+      if now - last_seen > HashCache.LAST_SEEN_RESOLUTION:
+        connection.execute(
+            "UPDATE local_hash SET last_seen = ? WHERE dev = ? AND ino = ?",
+            (now, st.st_dev, st.st_ino))
+        connection.commit()
+    return qxh_value
+
+  def put(self, filename: str, qxh_value: str, st: os.stat_result = None):
+    if st is None:
+      st = os.stat(filename)
+    with self.__lock:
+      connection = self.__connect()
+      connection.execute(
+          "INSERT OR REPLACE INTO local_hash"
+          " (dev, ino, size, mtime_ns, qxh, path, last_seen)"
+          " VALUES (?, ?, ?, ?, ?, ?, ?)",
+          (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, qxh_value,
+           os.path.abspath(filename), int(time.time())))
+      connection.commit()
+
+  def close(self):
+    with self.__lock:
+      if self.__connection is not None:
+        self.__connection.close()
+        self.__connection = None
+
+
+# Cache used by record_quickxorhash() and get_recorded_quickxorhash()
+hash_cache = None
+
+
+def open_hash_cache(filename: str) -> HashCache:
+  """ Use the SQLite database 'filename' as cache of local hashes """
+  global hash_cache
+  hash_cache = HashCache(filename)
+  return hash_cache
+
+
+def record_quickxorhash(filename: str, qxh_value: str):
+  """
+    Record 'qxh_value' as the quickxorhash of local file 'filename'.
+    The record is bound to the size and the modification time of the file.
+    It is stored in an extended attribute of the file if the platform and
+    the file system support it, else in the hash cache if it is opened.
+  """
+  try:
+    st = os.stat(filename)
+  except OSError as e:
+    lg.debug(f"[record_quickxorhash]Unable to record hash of '{filename}' - {e}")
+    return
+  if hasattr(os, 'setxattr'):
+    try:
+      record = {'qxh': qxh_value, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+      os.setxattr(filename, XATTR_NAME, json.dumps(record).encode('utf8'))
+      return
+    except OSError as e:
+      lg.debug(f"[record_quickxorhash]No extended attribute for '{filename}' - {e}")
+  if hash_cache is not None:
+    try:
+      hash_cache.put(filename, qxh_value, st)
+    except sqlite3.Error as e:
+      lg.warning(f"[record_quickxorhash]Unable to record hash of '{filename}' - {e}")
+
+
+def get_recorded_quickxorhash(filename: str):
+  """
+    Return the quickxorhash recorded for 'filename' or None if there is no
+    record or if the file has changed since it has been recorded
+  """
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return None
+  if hasattr(os, 'getxattr'):
+    try:
+      record = json.loads(os.getxattr(filename, XATTR_NAME))
+      if (record.get('size') == st.st_size
+              and record.get('mtime_ns') == st.st_mtime_ns):
+        return record.get('qxh')
+    except (OSError, ValueError):
+      pass
+  if hash_cache is not None:
+    try:
+      return hash_cache.get(filename, st)
+    except sqlite3.Error as e:
+      lg.warning(f"[get_recorded_quickxorhash]Unable to read hash cache - {e}")
+  return None
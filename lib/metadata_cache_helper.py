@@ -0,0 +1,271 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import json
+import logging
+import sqlite3
+import urllib.parse
+from threading import Lock
+
+import requests
+
+from lib.file_config_helper import force_permission_file_read_write_owner
+from lib.retry_helper import CircuitOpenException
+
+lg = logging.getLogger('odc.metadatacache')
+
+
+class MetadataCache:
+  """
+    Persistent cache of the metadata of the remote drive in a SQLite
+    database of the config folder: items as returned by MS Graph, parent
+    links, hashes, eTags and the delta link of the last synchronization.
+
+    The cache is kept current with the delta API (see synchronize()). Once
+    it is synchronized, folder infos are built from the cache without
+    listing children through MS Graph (see ObjectInfoFactory and
+    MsFolderInfo.retrieve_children_info()).
+  """
+
+  # Prefix of 'parentReference.path' in MS Graph responses
+  ROOT_PATH_PREFIX = "/drive/root:"
+
+  def __init__(self, filename: str):
+    self.filename = filename
+    self.__lock = Lock()
+    self.__connection = None
+
+  def __connect(self) -> sqlite3.Connection:
+    """ Open the database at first use """
+    if self.__connection is None:
+      connection = sqlite3.connect(
+          self.filename, timeout=10, check_same_thread=False)
+      force_permission_file_read_write_owner(self.filename)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      connection.execute(
+          "CREATE TABLE IF NOT EXISTS item ("
+          " id TEXT PRIMARY KEY, parent_id TEXT, name TEXT NOT NULL,"
+          " etag TEXT, qxh TEXT, item TEXT NOT NULL)")
+      connection.execute(
+          "CREATE INDEX IF NOT EXISTS item_parent"
+          " ON item (parent_id, name COLLATE NOCASE)")
+      connection.execute(
+          "CREATE TABLE IF NOT EXISTS state ("
+          " key TEXT PRIMARY KEY, value TEXT)")
+      connection.commit()
+      self.__connection = connection
+    return self.__connection
+
+  @staticmethod
+  def __get_state(connection, key: str):
+    row = connection.execute(
+        "SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+    return None if row is None else row[0]
+
+  @staticmethod
+  def __set_state(connection, key: str, value: str):
+    connection.execute(
+        "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+        (key, value))
+
+  def get_delta_link(self):
+    """
+      Return the link to be used to get the next changes of the drive or
+      None if the cache has never been synchronized
+    """
+    with self.__lock:
+      return self.__get_state(self.__connect(), 'delta_link')
+
+  def clear(self):
+    with self.__lock:
+      connection = self.__connect()
+      connection.execute("DELETE FROM item")
+      connection.execute("DELETE FROM state")
+      connection.commit()
+
+  def synchronize(self, mgc) -> bool:
+    """
+      Apply changes of the drive since the last synchronization through
+      the delta API of MS Graph client 'mgc'. The whole drive is enumerated
+      at the first synchronization.
+      Return True if the cache is current. Return False if it can not be
+      synchronized (ie. network error). Pages already received are kept
+      and the next synchronization resumes from them.
+    """
+    try:
+      return self.__synchronize(mgc)
+    except (requests.RequestException, CircuitOpenException, ValueError) as e:
+      lg.warning(
+          f"[synchronize]Metadata cache is not synchronized -"
+          f" {type(e).__name__} - {e}")
+      return False
+
+  def __synchronize(self, mgc) -> bool:
+    link = self.get_delta_link()
+    is_resync = link is None
+    if link is None:
+      link = f"{mgc.graph_url}/me/drive/root/delta"
+    nb_items = 0
+    while True:
+      r = mgc.request("GET", link)
+      if r.status_code == 410 and not is_resync:
+        # Delta link has expired. The drive must be enumerated again.
+        lg.warning("[synchronize]Delta link has expired. Enumerate the drive")
+        self.clear()
+        link = f"{mgc.graph_url}/me/drive/root/delta"
+        is_resync = True
+        continue
+      if r.status_code != 200:
+        lg.error(
+            f"[synchronize]Metadata cache is not synchronized -"
+            f" {r.reason} (error {r.status_code})")
+        return False
+      r_json = r.json()
+      items = r_json.get('value', [])
+      nb_items += len(items)
+      # The next page is recorded with the items so that an interrupted
+      # enumeration is resumed by the next run
+      next_link = r_json.get('@odata.nextLink')
+      self.apply_delta_items(
+          items, next_link or r_json.get('@odata.deltaLink'))
+      if next_link is None:
+        break
+      link = next_link
+    lg.info(f"[synchronize]Metadata cache is synchronized - {nb_items} changes")
+    return True
+
+  def apply_delta_items(self, items: list, delta_link: str = None):
+    """
+      Record items of a delta response. Deleted items and their
+      descendants are removed. 'delta_link' is recorded in the same
+      transaction if it is given.
+    """
+    with self.__lock:
+      connection = self.__connect()
+      for item in items:
+        if 'deleted' in item:
+          connection.execute(
+              "WITH RECURSIVE sub(id) AS (SELECT ? UNION"
+              " SELECT item.id FROM item JOIN sub ON item.parent_id = sub.id)"
+              " DELETE FROM item WHERE id IN sub",
+              (item['id'],))
+          continue
+        # Pre-authenticated urls expire
+        item = {k: v for (k, v) in item.items() if not k.startswith('@')}
+        if 'root' in item:
+          parent_id = None
+          self.__set_state(connection, 'root_id', item['id'])
+        else:
+          parent_id = item.get('parentReference', {}).get('id')
+        connection.execute(
+            "INSERT OR REPLACE INTO item (id, parent_id, name, etag, qxh, item)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (item['id'], parent_id, item.get('name', ''), item.get('eTag'),
+             item.get('file', {}).get('hashes', {}).get('quickXorHash'),
+             json.dumps(item)))
+      if delta_link is not None:
+        self.__set_state(connection, 'delta_link', delta_link)
+      connection.commit()
+
+  def __path(self, connection, ms_id: str):
+    """
+      Return the path of item 'ms_id' ("" for root) or None if the item is
+      not linked to root in the cache
+    """
+    names = []
+    current_id = ms_id
+    while True:
+      row = connection.execute(
+          "SELECT parent_id, name FROM item WHERE id = ?",
+          (current_id,)).fetchone()
+      if row is None:
+        return None
+      (parent_id, name) = row
+      if parent_id is None:
+        break
+      names.append(name)
+      current_id = parent_id
+    return "".join(f"/{name}" for name in reversed(names))
+
+  def __item_from_row(self, connection, ms_id: str, str_item: str, parent_path):
+    """
+      Return item of a row as a MS Graph response. 'parentReference.path'
+      is set from 'parent_path' and 'childCount' of folders is set from the
+      cache if it is missing.
+    """
+    item = json.loads(str_item)
+    if parent_path is not None and 'root' not in item:
+      item.setdefault('parentReference', {})['path'] = (
+          f"{MetadataCache.ROOT_PATH_PREFIX}"
+          f"{urllib.parse.quote(parent_path)}")
+    if 'folder' in item and 'childCount' not in item['folder']:
+      item['folder']['childCount'] = connection.execute(
+          "SELECT COUNT(*) FROM item WHERE parent_id = ?",
+          (ms_id,)).fetchone()[0]
+    return item
+
+  def get_item(self, ms_id: str):
+    """
+      Return the cached item 'ms_id' as a MS Graph response or None
+    """
+    with self.__lock:
+      connection = self.__connect()
+      row = connection.execute(
+          "SELECT parent_id, item FROM item WHERE id = ?", (ms_id,)).fetchone()
+      if row is None:
+        return None
+      (parent_id, str_item) = row
+      parent_path = (
+          self.__path(connection, parent_id) if parent_id is not None else "")
+      if parent_path is None:
+        return None
+      return self.__item_from_row(connection, ms_id, str_item, parent_path)
+
+  def get_item_from_path(self, path: str):
+    """
+      Return the cached item of 'path' as a MS Graph response or None.
+      Names are not case sensitive as in OneDrive.
+    """
+    with self.__lock:
+      connection = self.__connect()
+      current_id = self.__get_state(connection, 'root_id')
+      if current_id is None:
+        return None
+      parent_path = ""
+      names = [name for name in path.split("/") if name != ""]
+      for (i, name) in enumerate(names):
+        row = connection.execute(
+            "SELECT id, name FROM item WHERE parent_id = ?"
+            " AND name = ? COLLATE NOCASE",
+            (current_id, name)).fetchone()
+        if row is None:
+          return None
+        current_id = row[0]
+        if i < len(names) - 1:
+          parent_path = f"{parent_path}/{row[1]}"
+      row = connection.execute(
+          "SELECT item FROM item WHERE id = ?", (current_id,)).fetchone()
+      return self.__item_from_row(connection, current_id, row[0], parent_path)
+
+  def get_children(self, ms_id: str):
+    """
+      Return the cached children of folder 'ms_id' as MS Graph responses or
+      None if the folder is not cached
+    """
+    with self.__lock:
+      connection = self.__connect()
+      path = self.__path(connection, ms_id)
+      if path is None:
+        return None
+      rows = connection.execute(
+          "SELECT id, item FROM item WHERE parent_id = ?", (ms_id,)).fetchall()
+      return [
+          self.__item_from_row(connection, child_id, str_item, path)
+          for (child_id, str_item) in rows]
+
+  def close(self):
+    with self.__lock:
+      if self.__connection is not None:
+        self.__connection.close()
+        self.__connection = None
@@ -9,6 +9,8 @@ import sys
 import urllib.parse
 from abc import ABC, abstractmethod
 from beartype import beartype
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from lib._typing import Optional, Tuple
 from lib.graph_helper import MsGraphClient, MsGraphException
 from lib.datetime_helper import utc_dt_from_str_ms_datetime, utc_dt_now
@@ -208,6 +210,12 @@ class MsObject(ABC):
 
 class MsFolderInfo(MsObject):
 
+  # Number of folders whose children are retrieved concurrently by
+  # retrieve_children_info_concurrently()
+  TREE_WALK_NB_WORKERS = 8
+  # Depth of a tree walk without limit (default of '--depth')
+  UNBOUNDED_DEPTH = 999
+
   @beartype
   def __init__(
           self,
@@ -290,8 +298,17 @@ class MsFolderInfo(MsObject):
     ):
       nb_retrieved_children_start = self.get_nb_retrieved_children()
 
+      cached_children = (
+          self.__mgc.metadata_cache.get_children(self.ms_id)
+          if (self.__mgc.metadata_cache is not None
+              and self.next_link_children is None)
+          else None)
       try:
-        if self.next_link_children is None:
+        if cached_children is not None:
+          # All children are given by the metadata cache
+          (ms_response, next_link) = (cached_children, None)
+          self.child_count = len(cached_children)
+        elif self.next_link_children is None:
           (ms_response, next_link) = self.__mgc.get_ms_response_for_children_from_id(
               self.ms_id)
         else:
@@ -372,6 +389,164 @@ class MsFolderInfo(MsObject):
 
       self.__children_retrieval_status = "partial" if self.next_link_children is not None else "all"
 
+  def __children_to_be_retrieved(self, max_retrieved_children):
+    return not self.children_retrieval_has_started() or (
+        self.get_nb_retrieved_children() < self.child_count
+        and self.get_nb_retrieved_children() < max_retrieved_children)
+
+  def __fetch_children(self, max_retrieved_children):
+    """
+      Return a tuple (children as MS Graph responses, next link) with the
+      pages of children which are missing, up to 'max_retrieved_children'.
+      This folder info is not updated so that it can be called by another
+      thread.
+    """
+    if (self.__mgc.metadata_cache is not None
+            and self.next_link_children is None):
+      cached_children = self.__mgc.metadata_cache.get_children(self.ms_id)
+      if cached_children is not None:
+        return (cached_children, None)
+    if self.next_link_children is None:
+      (ms_response, next_link) = (
+          self.__mgc.get_ms_response_for_children_from_id(self.ms_id))
+    else:
+      (ms_response, next_link) = (
+          self.__mgc.get_ms_response_for_children_from_link(
+              self.next_link_children))
+    nb_children = self.get_nb_retrieved_children() + len(ms_response)
+    while (next_link is not None
+           and nb_children < min(self.child_count, max_retrieved_children)):
+      (next_ms_response, next_link) = (
+          self.__mgc.get_ms_response_for_children_from_link(next_link))
+      ms_response.extend(next_ms_response)
+      nb_children += len(next_ms_response)
+    return (ms_response, next_link)
+
+  def __add_children_info(self, ms_response, next_link):
+    for c in ms_response:
+      if 'folder' in c:
+        ObjectInfoFactory.MsFolderFromMgcResponse(self.__mgc, c, self)
+      elif 'file' in c:
+        ObjectInfoFactory.MsFileInfoFromMgcResponse(self.__mgc, c, self)
+      elif 'package' in c:
+        ObjectInfoFactory.MsOtherInfoFromMgcResponse(self.__mgc, c, self)
+    self.next_link_children = next_link
+    if next_link is None:
+      self.child_count = self.get_nb_retrieved_children()
+    self.__children_retrieval_status = "partial" if next_link is not None else "all"
+
+  def retrieve_children_info_concurrently(
+          self,
+          depth=999,
+          max_retrieved_children=200,
+          nb_workers=None):
+    """
+      Same as retrieve_children_info(recursive=True) but the tree is walked
+      breadth first and children of up to 'nb_workers' folders
+      (TREE_WALK_NB_WORKERS by default) are retrieved concurrently. Folders
+      whose children are already retrieved are walked without request.
+      Folder infos are only updated by the calling thread.
+    """
+    if nb_workers is None:
+      nb_workers = MsFolderInfo.TREE_WALK_NB_WORKERS
+    lg.debug(
+        f"[retrieve_children_info_concurrently] {self.path} - depth = {depth}"
+        f" - max_retrieved_children = {max_retrieved_children}"
+        f" - nb_workers = {nb_workers}")
+    frontier = deque([(self, depth)])  # (folder, depth)
+    in_flight = {}  # future -> (folder, depth)
+    with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+      while len(frontier) > 0 or len(in_flight) > 0:
+        while len(frontier) > 0 and len(in_flight) < nb_workers:
+          (folder, folder_depth) = frontier.popleft()
+          if folder_depth < 0:
+            continue
+          if folder.__children_to_be_retrieved(max_retrieved_children):
+            future = executor.submit(
+                folder.__fetch_children, max_retrieved_children)
+            in_flight[future] = (folder, folder_depth)
+          else:
+            frontier.extend(
+                (child, folder_depth - 1) for child in folder.children_folder)
+        if len(in_flight) == 0:
+          continue
+
+        (done, not_done) = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+          (folder, folder_depth) = in_flight.pop(future)
+          try:
+            (ms_response, next_link) = future.result()
+          except MsGraphException as mge:
+            # Can occurs if folder name has changed
+            lg.warning(
+                f"[retrieve_children_info_concurrently]Warning - Nothing"
+                f" received from link {mge.src_link}")
+            continue
+          folder.__add_children_info(ms_response, next_link)
+          frontier.extend(
+              (child, folder_depth - 1) for child in folder.children_folder)
+
+  def retrieve_tree_from_delta(self, depth=999):
+    """
+      Retrieve children info of the whole tree of this folder through the
+      delta API. The tree is sent as flat records linked by parent ids: a
+      few large pages instead of one request per folder.
+
+      Return False if the tree has not been retrieved. The walk of the tree
+      (retrieve_children_info_concurrently()) should then be used. It is
+      always used if 'depth' is lower than UNBOUNDED_DEPTH, because the
+      delta API always sends the whole subtree, and if the metadata cache
+      is enabled.
+    """
+    if (depth < MsFolderInfo.UNBOUNDED_DEPTH
+            or self.__mgc.metadata_cache is not None):
+      return False
+    try:
+      items = self.__mgc.get_ms_responses_for_subtree_from_id(self.ms_id)
+    except MsGraphException as mge:
+      lg.warning(
+          f"[retrieve_tree_from_delta]Tree of '{self.path}' not retrieved"
+          f" from link {mge.src_link}")
+      return False
+
+    # An item can be sent several times. The last record is the current one.
+    items_by_id = {}
+    for c in items:
+      items_by_id[c['id']] = c
+    children_by_parent_id = {}
+    for c in items_by_id.values():
+      if 'deleted' in c or c['id'] == self.ms_id:
+        continue
+      parent_id = c.get('parentReference', {}).get('id')
+      children_by_parent_id.setdefault(parent_id, []).append(c)
+
+    folders_to_be_filled = [(self, depth)]
+    while len(folders_to_be_filled) > 0:
+      (folder, folder_depth) = folders_to_be_filled.pop()
+      if folder_depth < 0:
+        continue
+      children = children_by_parent_id.get(folder.ms_id, [])
+      for c in children:
+        # Paths are not given by the delta API
+        c.setdefault('parentReference', {})['path'] = (
+            f"/drive/root:{urllib.parse.quote(folder.path)}")
+        if 'folder' in c:
+          fi = ObjectInfoFactory.MsFolderFromMgcResponse(
+              folder.__mgc, c, folder)
+          folders_to_be_filled.append((fi, folder_depth - 1))
+        elif 'file' in c:
+          ObjectInfoFactory.MsFileInfoFromMgcResponse(folder.__mgc, c, folder)
+        elif 'package' in c:
+          ObjectInfoFactory.MsOtherInfoFromMgcResponse(
+              folder.__mgc, c, folder)
+      folder.next_link_children = None
+      folder.child_count = len(children)
+      folder.__children_retrieval_status = "all"
+
+    lg.debug(
+        f"[retrieve_tree_from_delta] {self.path} - {len(items)} items")
+    return True
+
   def create_empty_subfolder(self, folder_name):
     folder_json = self.__mgc.create_folder(self.path, folder_name)
     if folder_json:
@@ -389,6 +564,31 @@ class MsFolderInfo(MsObject):
     else:
       return None
 
+  def create_empty_subfolders(self, folder_names):
+    """
+      Same as create_empty_subfolder() for several folders with batched
+      requests.
+      Return a dictionary name -> new folder info (None if not created)
+    """
+    result = {}
+    folders_json = self.__mgc.create_folders_from_id(self.ms_id, folder_names)
+    for (folder_name, folder_json) in zip(folder_names, folders_json):
+      if folder_json:
+        new_folder_info = ObjectInfoFactory.MsFolderFromMgcResponse(
+            mgc=self.__mgc,
+            mgc_response_json=folder_json,
+            parent=self
+        )
+        self.__add_folder_info_if_necessary(new_folder_info)
+        new_folder_info.update_parent_after_arrival(
+            self, new_folder_info.last_modified_datetime)
+        if self.child_count is not None:
+          self.child_count += 1
+        result[folder_name] = new_folder_info
+      else:
+        result[folder_name] = None
+    return result
+
   def __add_folder_info_if_necessary(self, folder_info):
     if folder_info.name not in self.__dict_children_folder:
       self.children_folder.append(folder_info)
@@ -566,12 +766,28 @@ class MsFolderInfo(MsObject):
 
 class MsFileInfo(MsObject):
   def __init__(self, name, parent_path, mgc, file_id,
-               size, qxh, s1h, cdt, lmdt, parent=None):
+               size, qxh, s1h, cdt, lmdt, parent=None, fs_lmdt=None,
+               etag=None, download_url=None):
     # qxh = quickxorhash
+    # fs_lmdt = last modification given by the client (fileSystemInfo)
+    # download_url = pre-authenticated url of the content. It expires.
     super().__init__(parent, name, parent_path, file_id, size, lmdt, cdt)
     self.mgc = mgc
     self.sha1hash = s1h
     self.qxh = qxh
+    self.fs_last_modified_datetime = fs_lmdt
+    self.etag = etag
+    self.download_url = download_url
+
+  @property
+  def content_modified_datetime(self):
+    """
+      Last modification of the content. It is the one of the local file
+      which has been uploaded if the client has given it.
+    """
+    if self.fs_last_modified_datetime is not None:
+      return self.fs_last_modified_datetime
+    return self.last_modified_datetime
 
   def _change_name_in_parent(self, new_name):
     if self.parent is not None:
@@ -742,7 +958,11 @@ class ObjectInfoFactory:
       An ObjectRetrievalException is raised in case of error.
     """
     lg.debug(f"[get_object_info_from_path]get path '{path}'")
-    r = mgc.get_ms_response_from_path(path)
+    r = (
+        mgc.metadata_cache.get_item_from_path(path)
+        if mgc.metadata_cache is not None else None)
+    if r is None:
+      r = mgc.get_ms_response_from_path(path)
     if r is None:
       raise ObjectInfoFactory.ObjectRetrievalException(
           'CUSTOM_PATH_NOT_FOUND')
@@ -760,7 +980,11 @@ class ObjectInfoFactory:
       Return MsObject from its id.
       An ObjectRetrievalException is raised in case of error.
     """
-    r = mgc.get_ms_response_from_id(ms_id)
+    r = (
+        mgc.metadata_cache.get_item(ms_id)
+        if mgc.metadata_cache is not None else None)
+    if r is None:
+      r = mgc.get_ms_response_from_id(ms_id)
     return ObjectInfoFactory.get_object_info_from_mgc_response(
         mgc, r, parent, no_warn_if_no_parent, no_update_and_get_from_global_dict)
 
@@ -840,6 +1064,10 @@ class ObjectInfoFactory:
     fi_to_be_updated.creation_datetime = fi_reference.creation_datetime
     fi_to_be_updated.qxh = fi_reference.qxh
     fi_to_be_updated.sha1hash = fi_reference.sha1hash
+    fi_to_be_updated.fs_last_modified_datetime = (
+        fi_reference.fs_last_modified_datetime)
+    fi_to_be_updated.etag = fi_reference.etag
+    fi_to_be_updated.download_url = fi_reference.download_url
 
   @staticmethod
   def MsFileInfoFromMgcResponse(
@@ -860,6 +1088,10 @@ class ObjectInfoFactory:
              if 'quickXorHash' in mgc_hashes else None)
       sha1hash = (mgc_hashes['sha1Hash']
                   if 'sha1Hash' in mgc_hashes else None)
+    fs_info = mgc_response_json.get('fileSystemInfo', {})
+    fs_lmdt = (
+        utc_dt_from_str_ms_datetime(fs_info['lastModifiedDateTime'])
+        if 'lastModifiedDateTime' in fs_info else None)
     ms_id = mgc_response_json['id']
     result = MsFileInfo(
         mgc_response_json['name'],
@@ -871,7 +1103,10 @@ class ObjectInfoFactory:
             mgc_response_json['createdDateTime']),
         utc_dt_from_str_ms_datetime(
             mgc_response_json['lastModifiedDateTime']),
-        parent=parent)
+        parent=parent,
+        fs_lmdt=fs_lmdt,
+        etag=mgc_response_json.get('eTag'),
+        download_url=mgc_response_json.get('@microsoft.graph.downloadUrl'))
 
     if parent is not None:
       parent._MsFolderInfo__add_file_info_if_necessary(result)
@@ -0,0 +1,176 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import datetime
+import logging
+import re
+import time
+from threading import Lock
+
+lg = logging.getLogger('odc.ratelimit')
+
+
+def parse_rate(str_rate: str):
+  """
+    Return a rate in bytes per second from a string like '500K', '2M',
+    '1.5G' or '1048576'. Return None for '0' or 'unlimited' (no limit).
+    Raise ValueError if the string is not a rate.
+  """
+  str_rate = str_rate.strip()
+  if str_rate.lower() in ('0', 'unlimited', 'none'):
+    return None
+  m = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kKmMgG]?)[bB]?', str_rate)
+  if m is None:
+    raise ValueError(f"'{str_rate}' is not a rate")
+  factor = {'': 1, 'k': 1024, 'm': 1048576, 'g': 1073741824}
+  rate = int(float(m.group(1)) * factor[m.group(2).lower()])
+  return rate if rate > 0 else None
+
+
+class RateSchedule:
+  """
+    Time-of-day schedule of rates read from a file.
+
+    Each line is 'HH:MM RATE'. A rate applies from its time until the time
+    of the next line. The rate of the last line applies until the time of
+    the first line of the next day. '0' or 'unlimited' disables the limit.
+    Empty lines and lines starting with '#' are ignored.
+
+    Example:
+      # Limit during office hours
+      08:00 1M
+      19:00 unlimited
+  """
+
+  def __init__(self, filename: str):
+    self.filename = filename
+    self.entries = []  # sorted list of (minute of day, rate)
+    with open(filename, 'r') as f:
+      for (num_line, line) in enumerate(f, start=1):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+          continue
+        m = re.fullmatch(r'(\d{1,2}):(\d{2})\s+(\S+)', line)
+        if m is None or int(m.group(1)) > 23 or int(m.group(2)) > 59:
+          raise ValueError(f"{filename}:{num_line}: '{line}' is not 'HH:MM RATE'")
+        self.entries.append(
+            (int(m.group(1)) * 60 + int(m.group(2)), parse_rate(m.group(3))))
+    if len(self.entries) == 0:
+      raise ValueError(f"{filename}: schedule is empty")
+    self.entries.sort(key=lambda e: e[0])
+
+  def rate_at(self, dt: datetime.datetime):
+    minute_of_day = dt.hour * 60 + dt.minute
+    rate = self.entries[-1][1]
+    for (minute, entry_rate) in self.entries:
+      if minute > minute_of_day:
+        break
+      rate = entry_rate
+    return rate
+
+
+class TokenBucket:
+  """
+    Token bucket shared by all transfers. A token is a byte.
+    Capacity of the bucket is the rate of one second so that bursts stay
+    short.
+    A rate None means no limit.
+  """
+
+  def __init__(self, rate=None):
+    self.__lock = Lock()
+    self.__rate = rate
+    self.__tokens = rate if rate is not None else 0
+    self.__last = time.monotonic()
+
+  @property
+  def rate(self):
+    return self.__rate
+
+  def set_rate(self, rate):
+    with self.__lock:
+      if rate != self.__rate:
+        lg.info(f"[TokenBucket]Rate = {rate} B/s")
+        self.__rate = rate
+        self.__tokens = min(self.__tokens, rate) if rate is not None else 0
+
+  def consume(self, nb_bytes: int):
+    """
+      Wait until 'nb_bytes' can be transferred
+    """
+    with self.__lock:
+      if self.__rate is None:
+        return
+      now = time.monotonic()
+      self.__tokens = min(
+          self.__rate, self.__tokens + (now - self.__last) * self.__rate)
+      self.__last = now
+      # Tokens are borrowed: next callers wait for the debt to be paid
+      self.__tokens -= nb_bytes
+      delay = -self.__tokens / self.__rate if self.__tokens < 0 else 0
+    if delay > 0:
+      time.sleep(delay)
+
+
+class BandwidthLimiter:
+  """
+    Limit the bandwidth of all transfers to a fixed rate or to the rate of
+    a time-of-day schedule.
+  """
+
+  # Transfers are split in blocks so that the limit is smooth
+  MIN_BLOCK_SIZE = 16384
+  SCHEDULE_CHECK_INTERVAL = 30  # seconds
+
+  class ThrottledStream:
+    """
+      Iterable over the bytes of 'data' which waits for the limiter before
+      each block.
+      A new iteration starts from the beginning so that a request can be
+      sent again. len() is the size of 'data' so that requests sets the
+      Content-Length.
+    """
+
+    def __init__(self, limiter: "BandwidthLimiter", data):
+      self.limiter = limiter
+      self.data = memoryview(data)
+
+    def __len__(self):
+      return self.data.nbytes
+
+    def __iter__(self):
+      pos = 0
+      while pos < len(self):
+        block_size = self.limiter.block_size()
+        self.limiter.consume(min(block_size, len(self) - pos))
+        yield self.data[pos:pos + block_size]
+        pos += block_size
+
+  def __init__(self, rate=None, schedule: RateSchedule = None):
+    self.schedule = schedule
+    self.bucket = TokenBucket(rate)
+    self.__last_schedule_check = 0
+
+  def __refresh_rate(self):
+    if self.schedule is None:
+      return
+    now = time.monotonic()
+    if now - self.__last_schedule_check >= BandwidthLimiter.SCHEDULE_CHECK_INTERVAL:
+      self.__last_schedule_check = now
+      self.bucket.set_rate(self.schedule.rate_at(datetime.datetime.now()))
+
+  def block_size(self) -> int:
+    """ Size of blocks so that about ten blocks are sent per second """
+    self.__refresh_rate()
+    rate = self.bucket.rate
+    if rate is None:
+      return 1048576
+    return max(BandwidthLimiter.MIN_BLOCK_SIZE, rate // 10)
+
+  def consume(self, nb_bytes: int):
+    self.__refresh_rate()
+    self.bucket.consume(nb_bytes)
+
+  def throttled_stream(self, data) -> "BandwidthLimiter.ThrottledStream":
+    """ Return a limited stream over bytes-like object 'data' """
+    return BandwidthLimiter.ThrottledStream(self, data)
@@ -0,0 +1,156 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import logging
+import math
+import random
+import time
+from threading import Condition, Lock
+
+lg = logging.getLogger('odc.retry')
+
+
+class Backoff:
+  """
+    Delays between retries of a failed operation, with decorrelated jitter:
+    each delay is drawn between 'base' and three times the previous delay,
+    and is never greater than 'cap'. Clients which fail together do not
+    retry together.
+    https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+  """
+
+  def __init__(self, base: float = 1, cap: float = 60):
+    self.base = base
+    self.cap = cap
+    self.__delay = base
+
+  def reset(self):
+    self.__delay = self.base
+
+  def next_delay(self) -> float:
+    self.__delay = min(
+        self.cap, random.uniform(self.base, self.__delay * 3))
+    return self.__delay
+
+
+class CircuitOpenException(Exception):
+  """
+    Raised instead of sending a request to a host which is considered down
+  """
+
+  def __init__(self, name: str, remaining: float):
+    self.name = name
+    self.remaining = remaining
+
+  def __str__(self):
+    return (
+        f"'{self.name}' is unavailable - requests are refused for"
+        f" {math.ceil(self.remaining)} seconds")
+
+
+class CircuitBreaker:
+  """
+    Fail fast when a host is down instead of piling up requests which wait
+    for timeouts.
+
+    - closed: requests are sent. After FAILURE_THRESHOLD consecutive
+      failures, the circuit is opened.
+    - open: requests are refused with a CircuitOpenException during
+      RESET_TIMEOUT seconds.
+    - half-open: one request is sent to probe the host. The circuit is
+      closed if it succeeds and opened again if it fails. Other requests
+      are refused until then. A probe whose outcome is never recorded is
+      replaced by a new probe after RESET_TIMEOUT seconds.
+  """
+
+  FAILURE_THRESHOLD = 5
+  RESET_TIMEOUT = 30  # seconds
+
+  (CLOSED, OPEN, HALF_OPEN) = ('closed', 'open', 'half-open')
+
+  def __init__(self, name: str):
+    self.name = name
+    self.__lock = Lock()
+    # Notified when the state changes
+    self.__state_changed = Condition(self.__lock)
+    self.__state = CircuitBreaker.CLOSED
+    self.__nb_failures = 0
+    self.__opened_at = 0  # time.monotonic() value
+
+  @property
+  def state(self) -> str:
+    with self.__lock:
+      return self.__state
+
+  def before_request(self) -> bool:
+    """
+      Raise CircuitOpenException if the request must not be sent.
+      Return True if the request is the probe of the host. Its outcome must
+      then be recorded with record_success(), record_failure() or
+      abort_probe().
+    """
+    with self.__lock:
+      if self.__state == CircuitBreaker.CLOSED:
+        return False
+      now = time.monotonic()
+      remaining = self.__opened_at + CircuitBreaker.RESET_TIMEOUT - now
+      if remaining <= 0:
+        # This request is the probe
+        self.__state = CircuitBreaker.HALF_OPEN
+        self.__opened_at = now
+        lg.info(f"[CircuitBreaker]'{self.name}' - probe the host")
+        return True
+      raise CircuitOpenException(self.name, remaining)
+
+  def wait(self, timeout: float) -> bool:
+    """
+      Wait up to 'timeout' seconds until a request can be sent: the
+      circuit is closed or a new probe can be sent. Waiting requests are
+      woken up as soon as the probe succeeds.
+      Return False on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    with self.__lock:
+      while True:
+        if self.__state == CircuitBreaker.CLOSED:
+          return True
+        now = time.monotonic()
+        remaining = self.__opened_at + CircuitBreaker.RESET_TIMEOUT - now
+        if remaining <= 0:
+          return True
+        if now >= deadline:
+          return False
+        self.__state_changed.wait(min(remaining, deadline - now))
+
+  def abort_probe(self):
+    """
+      The probe has ended without telling whether the host is available
+      (ie. interrupted). Next request is a new probe.
+    """
+    with self.__lock:
+      if self.__state == CircuitBreaker.HALF_OPEN:
+        self.__state = CircuitBreaker.OPEN
+        self.__opened_at = time.monotonic() - CircuitBreaker.RESET_TIMEOUT
+        self.__state_changed.notify_all()
+
+  def record_success(self):
+    with self.__lock:
+      if self.__state != CircuitBreaker.CLOSED:
+        lg.warning(f"[CircuitBreaker]'{self.name}' is available again")
+      self.__state = CircuitBreaker.CLOSED
+      self.__nb_failures = 0
+      self.__state_changed.notify_all()
+
+  def record_failure(self):
+    with self.__lock:
+      self.__nb_failures += 1
+      if (self.__state == CircuitBreaker.HALF_OPEN
+              or (self.__state == CircuitBreaker.CLOSED
+                  and self.__nb_failures >= CircuitBreaker.FAILURE_THRESHOLD)):
+        self.__state = CircuitBreaker.OPEN
+        self.__opened_at = time.monotonic()
+        lg.error(
+            f"[CircuitBreaker]'{self.name}' seems to be down after"
+            f" {self.__nb_failures} consecutive failures. Requests are"
+            f" refused for {CircuitBreaker.RESET_TIMEOUT} seconds")
+        self.__state_changed.notify_all()
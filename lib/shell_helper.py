@@ -22,7 +22,7 @@ from colorama import init as cinit
 
 from lib._common import PROGRAM_NAME, get_versionned_name
 from lib._typing import List, Optional, Tuple
-from lib.graph_helper import MsGraphClient
+from lib.graph_helper import MsGraphClient, MsGraphHashMismatchException
 from lib.msobject_info import DictMsObject, MsFileInfo, MsFolderInfo, MsObject
 from lib.msobject_info import ObjectInfoFactory as OIF
 from lib.msobject_info import StrPathUtil
@@ -439,10 +439,14 @@ class DeltaChecker():
 
   def __init__(self, mgc: MsGraphClient):
     self.mgc = mgc
-    query_string = (
-        f"{MsGraphClient.graph_url}/me/drive/root/delta?token=latest")
-    r = self.mgc.mgc.get(query_string)
-    self.delta_link = r.json()["@odata.deltaLink"]
+    if mgc.metadata_cache is not None:
+      # The metadata cache has been synchronized at startup
+      self.delta_link = mgc.metadata_cache.get_delta_link()
+    else:
+      query_string = (
+          f"{MsGraphClient.graph_url}/me/drive/root/delta?token=latest")
+      r = self.mgc.request("GET", query_string)
+      self.delta_link = r.json()["@odata.deltaLink"]
 
     self.items_to_be_processed = []
     self.lg = logging.getLogger("odc.browser.checkdelta")
@@ -451,7 +455,7 @@ class DeltaChecker():
     query_string = self.delta_link
     i = 0
     while True:
-      r = self.mgc.mgc.get(query_string)
+      r = self.mgc.request("GET", query_string)
       items_json = r.json()
       current_items_list = items_json['value']
       self.items_to_be_processed += current_items_list
@@ -461,6 +465,9 @@ class DeltaChecker():
       else:
         break
     self.delta_link = r.json()['@odata.deltaLink']
+    if self.mgc.metadata_cache is not None:
+      self.mgc.metadata_cache.apply_delta_items(
+          self.items_to_be_processed, self.delta_link)
 
   def __process_diff_delete(self, diff_item):
     """
@@ -892,13 +899,21 @@ class OneDriveShell:
         dst_folder_path = os.path.normpath(lfip_dst.path)
         dst_filename = rt_dst
 
-      self.mgc.put_file_content_from_fullpath_of_dstfolder(dst_folder_path, args.srcfile, dst_filename)
+      is_verified = True
+      try:
+        self.mgc.put_file_content_from_fullpath_of_dstfolder(dst_folder_path, args.srcfile, dst_filename)
+      except MsGraphHashMismatchException as e:
+        # The remote file exists anyway
+        print(f"Uploaded content of '{args.srcfile}' differs from local"
+              f" content - local quickxorhash '{e.local_qxh}' - remote"
+              f" quickxorhash '{e.remote_qxh}'")
+        is_verified = False
 
       msoi_new_file = OIF.get_object_info_from_path(
           self.mgc, f"{dst_folder_path}/{dst_filename}", parent=dst_parent)[1]
       msoi_new_file.update_parent_after_arrival(
           dst_parent, msoi_new_file.last_modified_datetime)
-      return True
+      return is_verified
 
     def action_mv(self2, args):
       # lfip = last_folder_info_path
@@ -970,23 +985,34 @@ class OneDriveShell:
       return msoi_newfolder is not None
 
     def action_rm(self2, args):
-      (lfip_dst, rt_dst) = MsObject.get_lastfolderinfo_path(
-          self.root_folder, args.dstpath, self.current_fi)
-      if lfip_dst.relative_path_is_a_file(rt_dst, True):
-        dst_obj = lfip_dst.get_child_file(rt_dst)
-      elif lfip_dst.relative_path_is_a_folder(rt_dst, True):
-        dst_obj = lfip_dst.get_child_folder(rt_dst)
-      else:
-        print(f"'{args.dstpath}' is not a path of a remote object")
-        return False
-      dst_path = os.path.normpath(f"{lfip_dst.path}/{rt_dst}")
-      r = self.mgc.delete_file(dst_path)
-      if r != 1:
-        print("[rm]An error has occured")
-        return False
-      dst_obj.update_parent_before_removal()
-      DictMsObject.remove(dst_obj.ms_id)
-      return True
+      dst_objs = []
+      for dstpath in args.dstpath:
+        (lfip_dst, rt_dst) = MsObject.get_lastfolderinfo_path(
+            self.root_folder, dstpath, self.current_fi)
+        if lfip_dst is None:
+          dst_obj = None
+        elif lfip_dst.relative_path_is_a_file(rt_dst, True):
+          dst_obj = lfip_dst.get_child_file(rt_dst)
+        elif lfip_dst.relative_path_is_a_folder(rt_dst, True):
+          dst_obj = lfip_dst.get_child_folder(rt_dst)
+        else:
+          dst_obj = None
+        if dst_obj is None:
+          print(f"'{dstpath}' is not a path of a remote object")
+          return False
+        dst_objs.append(dst_obj)
+
+      # All objects are removed with batched requests
+      result = True
+      codes = self.mgc.delete_items_from_ids([o.ms_id for o in dst_objs])
+      for (dst_obj, r) in zip(dst_objs, codes):
+        if r != 1:
+          print(f"[rm]An error has occured with '{dst_obj.path}'")
+          result = False
+          continue
+        dst_obj.update_parent_before_removal()
+        DictMsObject.remove(dst_obj.ms_id)
+      return result
 
     def action_pwd(self2, args):
       print(self.current_fi.path)
@@ -1050,11 +1076,12 @@ class OneDriveShell:
     sp_put.add_argument('srcfile', type=str, help='source file')
     sp_put.add_argument('dstpath', type=str, help='destination path')
     sp_rm = sub_parser.add_parser(
-        'rm', description='Remove a file or a folder')
+        'rm', description='Remove files or folders')
     sp_rm.add_argument(
         'dstpath',
         type=str,
-        help='File or Folder to be removed')
+        nargs='+',
+        help='Files or Folders to be removed')
     sp_mv = sub_parser.add_parser(
         'mv', description='Move or rename a file or a folder')
     sp_mv.add_argument(
@@ -1366,7 +1393,11 @@ class LsFormatter():
     lg.debug(
         f"Entering __format_folder_children_lite({fi.path},"
         f"{recursive}, {depth}, {max_retrieved_children})")
-    if not fi.children_retrieval_is_completed():
+    if recursive and is_first_folder and depth > 0:
+      # Folders of the tree are retrieved concurrently
+      fi.retrieve_children_info_concurrently(
+          depth=depth, max_retrieved_children=max_retrieved_children)
+    elif not fi.children_retrieval_is_completed():
       fi.retrieve_children_info(max_retrieved_children=max_retrieved_children)
 
     folder_names = map(folder_desc_formatter, fi.children_folder)
@@ -0,0 +1,134 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import email.utils
+import logging
+import time
+from threading import Lock
+
+lg = logging.getLogger('odc.throttle')
+
+
+class ThrottleCoordinator:
+  """
+    Coordinate all requests sent to the same account.
+
+    - When a response signals a throttling (429 or 503), every request is
+      paused until the delay given by 'Retry-After' has elapsed.
+    - When 'RateLimit-Remaining' shows that the quota is almost consumed,
+      requests are paced so that the remaining quota lasts until
+      'RateLimit-Reset'.
+    https://learn.microsoft.com/en-US/sharepoint/dev/general-development/how-to-avoid-getting-throttled-or-blocked-in-sharepoint-online
+  """
+
+  DEFAULT_RETRY_AFTER = 11  # seconds
+  # Requests are paced when less than this ratio of the limit remains
+  PACING_RATIO = 0.2
+
+  def __init__(self):
+    self.__lock = Lock()
+    self.__resume_time = 0       # time.monotonic() value
+    self.__pacing_interval = 0   # seconds between two requests
+    self.__pacing_until = 0      # time.monotonic() value
+    self.__next_slot = 0         # time.monotonic() value
+
+  @staticmethod
+  def __parse_int_header(headers, name):
+    try:
+      return int(headers[name]) if name in headers else None
+    except ValueError:
+      return None
+
+  @staticmethod
+  def parse_retry_after(headers):
+    """
+      Return delay in seconds given by header 'Retry-After' or None.
+      'Retry-After' is either a number of seconds or an HTTP date.
+    """
+    if 'Retry-After' not in headers:
+      return None
+    value = headers['Retry-After']
+    try:
+      return max(0, int(value))
+    except ValueError:
+      pass
+    try:
+      retry_date = email.utils.parsedate_to_datetime(value)
+      return max(0, int(retry_date.timestamp() - time.time()) + 1)
+    except (TypeError, ValueError):
+      return None
+
+  def remaining_pause(self) -> float:
+    with self.__lock:
+      return max(0, self.__resume_time - time.monotonic())
+
+  def wait(self):
+    """
+      Wait until a request can be sent
+    """
+    while True:
+      with self.__lock:
+        now = time.monotonic()
+        if self.__resume_time > now:
+          # Paused: wait and check again as the pause may have been extended
+          delay = self.__resume_time - now
+          slot_reserved = False
+        elif self.__pacing_interval > 0 and self.__pacing_until > now:
+          slot = max(now, self.__next_slot)
+          self.__next_slot = slot + self.__pacing_interval
+          delay = slot - now
+          slot_reserved = True
+        else:
+          return
+      if delay > 0:
+        time.sleep(delay)
+      if slot_reserved:
+        return
+
+  def notify_response(self, r):
+    """
+      Update throttling state from response 'r'.
+      Return delay in seconds to wait before retrying if the response
+      signals a throttling. Else return None.
+    """
+    return self.notify(r.status_code, r.headers)
+
+  def notify(self, status_code: int, headers):
+    """
+      Same as notify_response() from a status code and headers. Used for
+      the responses embedded in a JSON batch.
+    """
+    limit = self.__parse_int_header(headers, 'RateLimit-Limit')
+    remaining = self.__parse_int_header(headers, 'RateLimit-Remaining')
+    reset = self.__parse_int_header(headers, 'RateLimit-Reset')
+    now = time.monotonic()
+
+    if remaining is not None and reset is not None:
+      with self.__lock:
+        if limit is None or remaining < limit * ThrottleCoordinator.PACING_RATIO:
+          self.__pacing_interval = reset / max(remaining, 1)
+          self.__pacing_until = now + reset
+          lg.info(
+              f"[ThrottleCoordinator]RateLimit-Remaining = {remaining}"
+              f" - RateLimit-Reset = {reset}s - pace requests every"
+              f" {self.__pacing_interval:.2f}s")
+        else:
+          self.__pacing_interval = 0
+
+    if status_code not in (429, 503):
+      # 429 = TooManyRequests - 503 = Service Unavailable
+      return None
+
+    retry_after = self.parse_retry_after(headers)
+    if retry_after is None:
+      retry_after = ThrottleCoordinator.DEFAULT_RETRY_AFTER
+    with self.__lock:
+      self.__resume_time = max(self.__resume_time, now + retry_after)
+    lg.warning(
+        f"[ThrottleCoordinator]Client application has been throttled"
+        f" (error code = {status_code}). All requests are paused for"
+        f" {retry_after} seconds"
+        f" - RateLimit-Limit = {limit}"
+        f" - RateLimit-Remaining = {remaining}"
+        f" - RateLimit-Reset = {reset}")
+    return retry_after
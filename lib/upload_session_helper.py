@@ -0,0 +1,150 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+from threading import Lock
+
+from lib.datetime_helper import utc_dt_from_str_ms_datetime, utc_dt_now
+from lib.file_config_helper import force_permission_file_read_write_owner
+
+lg = logging.getLogger('odc.uploadsession')
+
+
+class UploadSessionStore:
+  """
+    Upload sessions persisted in a JSON file of the config folder.
+
+    A session is identified by the absolute path, the size and the
+    modification time of the local file. It can then be resumed by a new
+    run of the program as long as the local file has not changed and the
+    session has not expired.
+  """
+
+  # A session which expires in less than this delay is close to expiry
+  REFRESH_MARGIN = datetime.timedelta(minutes=30)
+  # Minimum delay (seconds) between two saves of the expiration of a session
+  EXPIRATION_SAVE_INTERVAL = 60
+
+  def __init__(self, filename: str):
+    self.filename = filename
+    self.__lock = Lock()
+    self.__last_expiration_saves = {}  # key -> time.monotonic()
+
+  @staticmethod
+  def key_of(src_file: str) -> str:
+    st = os.stat(src_file)
+    return f"{os.path.abspath(src_file)}|{st.st_size}|{st.st_mtime_ns}"
+
+  def __load(self) -> dict:
+    if not os.path.exists(self.filename):
+      return {}
+    try:
+      with open(self.filename, 'r') as f:
+        return json.load(f)
+    except (OSError, ValueError) as e:
+      lg.warning(f"[UploadSessionStore]Unable to read {self.filename} - {e}")
+      return {}
+
+  def __save(self, sessions: dict):
+    # Each save has its own temporary file so that several runs of the
+    # program never write in the same one
+    (fd, tmp_filename) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(self.filename)),
+        prefix=f"{os.path.basename(self.filename)}.")
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump(sessions, f, indent=1)
+      force_permission_file_read_write_owner(tmp_filename)
+      os.replace(tmp_filename, self.filename)
+    except BaseException:
+      os.remove(tmp_filename)
+      raise
+
+  @staticmethod
+  def __expiration(session: dict) -> datetime.datetime:
+    try:
+      return utc_dt_from_str_ms_datetime(session['expirationDateTime'])
+    except (KeyError, ValueError):
+      return utc_dt_now()
+
+  def is_close_to_expiry(self, session: dict) -> bool:
+    return (
+        self.__expiration(session) - utc_dt_now()
+        < UploadSessionStore.REFRESH_MARGIN)
+
+  def get(self, src_file: str, dst_folder_id: str, dst_file_name: str):
+    """
+      Return the session (dict with keys 'uploadUrl' and
+      'expirationDateTime') matching the local file and its destination.
+      Return None if there is no session or if it has expired.
+      Expired sessions are purged.
+    """
+    key = UploadSessionStore.key_of(src_file)
+    with self.__lock:
+      sessions = self.__load()
+      expired_keys = [
+          k for (k, v) in sessions.items()
+          if self.__expiration(v) <= utc_dt_now()]
+      for k in expired_keys:
+        lg.debug(f"[UploadSessionStore]Purge expired session of '{k}'")
+        sessions.pop(k)
+      if len(expired_keys) > 0:
+        self.__save(sessions)
+
+    session = sessions.get(key)
+    if (session is None
+            or session['dstFolderId'] != dst_folder_id
+            or session['dstFileName'] != dst_file_name):
+      return None
+    return session
+
+  def put(
+          self,
+          src_file: str,
+          dst_folder_id: str,
+          dst_file_name: str,
+          upload_url: str,
+          expiration: str):
+    key = UploadSessionStore.key_of(src_file)
+    with self.__lock:
+      sessions = self.__load()
+      sessions[key] = {
+          'uploadUrl': upload_url,
+          'expirationDateTime': expiration,
+          'dstFolderId': dst_folder_id,
+          'dstFileName': dst_file_name}
+      self.__save(sessions)
+
+  def update_expiration(self, src_file: str, expiration: str):
+    """
+      Record the new expiration of the session of 'src_file'. It is saved
+      only if it has changed, and at most every EXPIRATION_SAVE_INTERVAL
+      seconds. The saved expiration is then a little early, which is
+      negligible compared to the lifetime of a session.
+    """
+    key = UploadSessionStore.key_of(src_file)
+    with self.__lock:
+      last_save = self.__last_expiration_saves.get(key)
+      if (last_save is not None and time.monotonic() - last_save
+              < UploadSessionStore.EXPIRATION_SAVE_INTERVAL):
+        return
+      self.__last_expiration_saves[key] = time.monotonic()
+      sessions = self.__load()
+      if (key in sessions
+              and sessions[key]['expirationDateTime'] != expiration):
+        sessions[key]['expirationDateTime'] = expiration
+        self.__save(sessions)
+
+  def remove(self, src_file: str):
+    key = UploadSessionStore.key_of(src_file)
+    with self.__lock:
+      self.__last_expiration_saves.pop(key, None)
+      sessions = self.__load()
+      if key in sessions:
+        sessions.pop(key)
+        self.__save(sessions)
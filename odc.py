@@ -8,6 +8,7 @@
 import logging
 from lib.auth_helper import TokenRecorder
 from lib.graph_helper import MsGraphClient
+from lib.rate_limit_helper import BandwidthLimiter, RateSchedule
 
 from lib.args_helper import parse_odc_args
 from lib.action_helper import (
@@ -21,6 +22,8 @@ from lib.action_helper import (
     action_mkdir
 )
 from lib.file_config_helper import create_and_get_config_folder, force_permission_file_read_write_owner
+from lib.hash_record_helper import open_hash_cache
+from lib.metadata_cache_helper import MetadataCache
 import os
 import sys
 from lib._common import VERSION
@@ -100,8 +103,30 @@ if __name__ == '__main__':
     print(f"please connect first with {sys.argv[0]} init")
     quit()
 
+  # Cache of quickxorhash of local files
+  open_hash_cache(f"{config_dirname}/hash_cache.sqlite")
+
   # Manage command
-  mgc = MsGraphClient(tr.get_session_from_token())
+  mgc = MsGraphClient(tr.get_session_from_token(), config_dirname)
+  if args.command in ("get", "mget", "put", "mput"):
+    if args.limit_rate_schedule is not None:
+      try:
+        schedule = RateSchedule(args.limit_rate_schedule)
+      except (OSError, ValueError) as e:
+        print(f"Invalid rate schedule - {e}")
+        quit()
+      mgc.set_bandwidth_limiter(BandwidthLimiter(schedule=schedule))
+    elif args.limit_rate is not None:
+      mgc.set_bandwidth_limiter(BandwidthLimiter(rate=args.limit_rate))
+    if args.socketbuffer is not None:
+      mgc.set_socket_buffer_size(args.socketbuffer * 1024)
+
+  metadata_cache = None
+  if args.metadatacache and args.command in ("ls", "stat", "mget", "mput", "shell"):
+    metadata_cache = MetadataCache(f"{config_dirname}/metadata_cache.sqlite")
+    if metadata_cache.synchronize(mgc):
+      mgc.set_metadata_cache(metadata_cache)
+
   if args.command == "whoami":
     action_get_user(mgc)
 
@@ -111,10 +136,14 @@ if __name__ == '__main__':
     action_get_children(mgc, args.folder, args.p, args.l, args.maxchildren)
 
   if args.command == "put":
-    action_upload(mgc, args.dstpath, args.srcfile, args.withprogressbar)
+    action_upload(
+        mgc, args.dstpath, args.srcfile, args.withprogressbar,
+        args.parallelfragments)
 
   if args.command == "mput":
-    action_mupload(mgc, args.srclocalpath, args.dstremotefolder)
+    action_mupload(
+        mgc, args.srclocalpath, args.dstremotefolder, args.parallelfragments,
+        args.jobs, args.compare)
 
   if args.command == "raw_cmd":
     action_raw_cmd(mgc)
@@ -123,7 +152,9 @@ if __name__ == '__main__':
     action_shell(mgc)
 
   if args.command == "get":
-    action_download(mgc, args.remotefile, args.dstlocalpath)
+    action_download(
+        mgc, args.remotefile, args.dstlocalpath,
+        args.connections, args.parallelthreshold)
 
   if args.command == "mget":
     action_mdownload(
@@ -132,7 +163,11 @@ if __name__ == '__main__':
         args.dstlocalpath,
         args.depth,
         args.n,
-        file_with_exclusion=None if args.X == '' else args.X
+        file_with_exclusion=None if args.X == '' else args.X,
+        nb_connections=args.connections,
+        parallel_threshold=args.parallelthreshold,
+        nb_jobs=args.jobs,
+        compare=args.compare
     )
 
   if args.command == "mv":
@@ -157,3 +192,5 @@ if __name__ == '__main__':
     print(VERSION)
 
   mgc.close()
+  if metadata_cache is not None:
+    metadata_cache.close()
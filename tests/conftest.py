@@ -0,0 +1,8 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import os
+import sys
+
+# Modules of the program are imported as 'lib.xxx' from its folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,120 @@
+#  Copyright 2019-2025 Jareth Lomson <jareth.lomson@gmail.com>
+#  This file is part of OneDrive Client Program which is released under MIT License
+#  See file LICENSE for full license details
+import pytest
+
+from lib import check_helper
+from lib.check_helper import QuickXorHasher, QuickXorRangeHasher, quickxorhash
+
+EMPTY_QXH = 'AAAAAAAAAAAAAAAAAAAAAAAAAAA='
+
+# quickxorhash of data(size) given by the reference 'quickxorhash' module.
+# Most sizes are not multiples of 160 bits (20 bytes).
+KNOWN_HASHES = [
+    (0, EMPTY_QXH),
+    (1, 'AQAAAAAAAAAAAAAAAQAAAAAAAAA='),
+    (19, 'QE2xw+/PARKsQAY5E8IRnFAFLow='),
+    (20, 'QE2xw+/PDROsQAY5FMIRnFAFLow='),
+    (21, 'QE2xw+/PDcOkQAY5FcIRnFAFLow='),
+    (159, 'miDPGvBxREwNmYMeRzNVz42f9/E='),
+    (160, 'miDPGvBxREwNmYMeeDNVz42ft/o='),
+    (161, '+yDPGvBxREwNmYMeeTNVz42ft/o='),
+    (1000, 'j4QI/2kk2WmA2FKbDv67iuw1mU0='),
+    (327693, 'AUDAAyzQARKsQAY5DcIUnFAFAAA='),
+]
+
+
+def data(size: int) -> bytes:
+  return bytes((i * 7 + 1 + i // 256) % 256 for i in range(size))
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def fold(request, monkeypatch):
+  """ Run a test with the NumPy fold and with the pure Python fold """
+  if request.param == 'numpy':
+    if check_helper.np is None:
+      pytest.skip("NumPy is not installed")
+  else:
+    monkeypatch.setattr(check_helper, 'np', None)
+  return request.param
+
+
+@pytest.fixture
+def pool_hasher(monkeypatch):
+  """
+    quickxorhash whose files are hashed by segments of 1000 bytes (not a
+    multiple of 160 bytes) in the pool of processes
+  """
+  monkeypatch.setattr(quickxorhash, 'PARALLEL_THRESHOLD', 2000)
+  monkeypatch.setattr(quickxorhash, 'SEGMENT_SIZE', 1000)
+  return quickxorhash(nb_processes=2)
+
+
+@pytest.mark.parametrize('size,expected', KNOWN_HASHES)
+def test_hasher_known_values(fold, size, expected):
+  hasher = QuickXorHasher()
+  hasher.update(data(size))
+  assert hasher.base64_digest() == expected
+
+
+@pytest.mark.parametrize('size,expected', KNOWN_HASHES)
+def test_hasher_by_small_updates(fold, size, expected):
+  content = data(size)
+  hasher = QuickXorHasher()
+  for start in range(0, size, 7):
+    hasher.update(content[start:start + 7])
+  assert hasher.base64_digest() == expected
+
+
+def test_hasher_update_at_in_any_order(fold):
+  (size, expected) = KNOWN_HASHES[-1]
+  content = data(size)
+  hasher = QuickXorHasher()
+  bounds = [0, 13, 160, 4097, 65536, 200001, size]
+  for (start, end) in reversed(list(zip(bounds, bounds[1:]))):
+    hasher.update_at(start, content[start:end])
+  assert hasher.base64_digest() == expected
+
+
+@pytest.mark.parametrize('size,expected', KNOWN_HASHES)
+def test_hash_file(tmp_path, fold, size, expected):
+  filename = tmp_path / 'f.bin'
+  filename.write_bytes(data(size))
+  assert QuickXorHasher.hash_file(str(filename)) == expected
+
+
+def test_range_hasher_empty():
+  assert QuickXorRangeHasher(0).base64_digest() == EMPTY_QXH
+  assert QuickXorRangeHasher(0).missing_ranges() == []
+
+
+def test_range_hasher_overlapping_ranges(fold):
+  (size, expected) = KNOWN_HASHES[-2]
+  content = data(size)
+  hasher = QuickXorRangeHasher(size)
+  # Ranges sent again after an error overlap ranges already added
+  for (start, end) in [(500, 700), (0, 300), (250, 600), (500, 700)]:
+    hasher.add(start, content[start:end])
+  assert hasher.missing_ranges() == [(700, size)]
+  hasher.add(650, content[650:])
+  assert hasher.missing_ranges() == []
+  assert hasher.base64_digest() == expected
+
+
+@pytest.mark.parametrize('size,expected', KNOWN_HASHES)
+def test_quickxorhash_by_segments(tmp_path, pool_hasher, size, expected):
+  filename = tmp_path / 'f.bin'
+  filename.write_bytes(data(size))
+  assert pool_hasher.quickxorhash_by_segments(str(filename)) == expected
+
+
+def test_submit_files(tmp_path, pool_hasher):
+  # Small files are hashed by one process, large files by segments
+  filenames = {}
+  for (size, expected) in KNOWN_HASHES:
+    filename = tmp_path / f"f{size}.bin"
+    filename.write_bytes(data(size))
+    filenames[str(filename)] = expected
+  futures = pool_hasher.submit_files(list(filenames))
+  assert {f: future.result(timeout=60) for (f, future) in futures.items()} \
+      == filenames